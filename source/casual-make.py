@@ -8,6 +8,58 @@ import platform
 import casual.make.entity.state as state
 import casual.make.entity.cli as cli
 
+def make(args):
+    """
+    Builds the selected target, the model is built
+    """
+    import casual.make.entity.model as model
+    import casual.make.tools.handler as handler
+    import casual.make.tools.output as output
+    import casual.make.tools.artifact as artifact
+    import casual.make.entity.recipe as recipe
+    import casual.make.tools.trace as trace
+    import casual.make.tools.statistics as statistics
+    import casual.make.tools.filesystem as filesystem
+
+    selected = args.target
+
+    selected_target = model.get(selected)
+
+    if not selected_target:
+        raise SystemError(selected + " not known")
+
+    # construct the dependency tree
+    with trace.instance().phase("dependency tree"):
+        model.construct_dependency_tree(selected_target)
+
+    # retreive the actions to take
+    with trace.instance().phase("action graph"):
+        actions = model.construct_action_graph(selected_target)
+
+    output.print("done")
+
+    # stats of the analysis, before the workers are started
+    stats = filesystem.cache.stats()
+
+    # start handling actions, each as soon as its prerequisites are done
+    try:
+        with trace.instance().phase("execute"), handler.Handler() as handler:
+            recipe.prefetch(actions)
+            handler.handle(actions)
+    finally:
+        if args.trace:
+            trace.instance().save(args.trace)
+        if args.statistics_json:
+            statistics.save(statistics.collect(trace.instance(), model.store, stats), args.statistics_json)
+
+    if artifact.enabled() and artifact.used() and not state.settings.quiet():
+        output.print(artifact.report())
+
+    if args.statistics:
+        for line in statistics.text(statistics.collect(trace.instance(), model.store, stats)):
+            output.print(line, format=False)
+
+
 def main():
 
     args = cli.handle_arguments()
@@ -20,58 +72,39 @@ def main():
 
     state.environment(args)
 
-    selected = args.target
-
     try:
 
+        import casual.make.tools.daemon as daemon
+        import casual.make.tools.environment as environment
+
+        if args.server:
+            daemon.Server(make).serve()
+            return
+
+        if args.watch:
+            daemon.Server(make).watch(sys.argv[1:])
+            return
+
+        if args.client or environment.get("CASUAL_MAKE_CLIENT"):
+            status = daemon.forward([argument for argument in sys.argv[1:] if argument != "--client"])
+            if status is not None:
+                raise SystemExit(status)
+
         # Need to import this after argparse
         import casual.make.entity.model as model
-        import casual.make.tools.handler as handler
-        import casual.make.tools.executor as executor
         import casual.make.tools.output as output
+        import casual.make.tools.trace as trace
 
         # Build the actual model from a file
         output.print("building model: ", end="")
-        model.build()
-
-        selected_target = model.get(selected)
-
-        if not selected_target:
-            raise SystemError(selected + " not known")
+        with trace.instance().phase("model"):
+            model.build(args.target)
 
-        # construct the dependency tree
-        model.construct_dependency_tree(selected_target)
-
-        # retreive the current action list
-        actions = model.construct_action_list(selected_target)
-
-        output.print("done")
-
-        total_handled = 0
-        number_of_actions = 0
-        if args.statistics:
-            for level in actions:
-                number_of_actions = number_of_actions + len(level)
-            statistics = "(" + str(total_handled) + "/" + \
-                str(number_of_actions) + ")"
-            output.print("progress: " + statistics)
-
-        # start handling actions
-        with handler.Handler() as handler:
-            for level in actions:
-                # All actions within a 'level' can be done in parallel
-                number_of_actions_in_level = len(level)
-                handler.handle(level)
-                if args.statistics:
-                    total_handled = total_handled + number_of_actions_in_level
-                    statistics = "(" + str(total_handled) + \
-                        "/" + str(number_of_actions) + ")"
-                    output.print("progress: " + statistics)
+        make(args)
 
     except SystemError as exception:
         print(exception)
         raise SystemExit(1)
 
-
 if __name__ == "__main__":
     main()
@@ -1,11 +1,18 @@
+import hashlib
 import inspect
 import os
 
+import casual.make.entity.cache as cache
 import casual.make.entity.model as model
+import casual.make.entity.parallel as parallel
 import casual.make.entity.recipe as recipe
 import casual.make.entity.state as state
 
+import casual.make.tools.dependency as dependency
 import casual.make.tools.environment as environment
+import casual.make.tools.filesystem as filesystem
+import casual.make.tools.history as history
+import casual.make.tools.unity as unity
 
 from casual.make.entity.target import Target, Recipe
 from casual.make.tools.executor import importCode
@@ -17,23 +24,35 @@ selector = importlib.import_module(compiler_handler_module)
 #
 # global setup for operations
 #
-compile_target = model.register('compile')
-link_library_target = model.register('link-library')
-link_archive_target = model.register('link-archive')
-link_executable_target = model.register('link-executable')
-link_unittest_target = model.register('link-unittest')
-link_target = model.register('link').add_dependency(
-    [
-        link_library_target,
-        link_archive_target,
-        link_executable_target,
-        link_unittest_target
-    ]
-)
-
-test_target = model.register('test').execute(True).serial(True)
-clean_target = model.register('clean')
-install_target = model.register('install').serial(True)
+
+
+def register():
+    """
+    Registers the global operations in the current model, again for each new model, see model.reset()
+    """
+    global compile_target, link_library_target, link_archive_target, link_executable_target, \
+        link_unittest_target, link_target, test_target, clean_target, install_target
+
+    compile_target = model.register('compile')
+    link_library_target = model.register('link-library')
+    link_archive_target = model.register('link-archive')
+    link_executable_target = model.register('link-executable')
+    link_unittest_target = model.register('link-unittest')
+    link_target = model.register('link').add_dependency(
+        [
+            link_library_target,
+            link_archive_target,
+            link_executable_target,
+            link_unittest_target
+        ]
+    )
+
+    test_target = model.register('test').execute(True).serial(True)
+    clean_target = model.register('clean')
+    install_target = model.register('install').serial(True)
+
+
+register()
 
 #
 # Helpers
@@ -42,8 +61,11 @@ install_target = model.register('install').serial(True)
 
 def caller():
 
-    name = inspect.getouterframes(inspect.currentframe())[2][1]
-    path = os.path.abspath(name)
+    path = model.current_makefile()
+    if not path:
+        # not called from an evaluated makefile, use the file of the calling frame
+        path = os.path.abspath(
+            inspect.currentframe().f_back.f_back.f_code.co_filename)
     return model.register(name=path, filename=path, makefile=path)
 
 
@@ -69,24 +91,20 @@ def normalize_library_target(libs, paths=None):
 def includes(dependency_file, makefile):
 
     context_directory, dummy = os.path.split(makefile)
-    if os.path.exists(dependency_file):
-        with open(dependency_file) as file:
-            files = file.read()
-        files = files.replace('\\\n', '\n')
-        reply = []
-        for f in (files.split()[1:]):
-            filename = f.rstrip()
-            if os.path.isabs(filename):
-                abs_path = filename
-            else:
-                abs_path = os.path.abspath(
-                    os.path.join(context_directory, filename))
-            item = model.store.register(abs_path, abs_path, makefile)
-
-            reply.append(item)
-        return reply
-    else:
-        return []
+    if cache.journal:
+        cache.journal.input(dependency_file)
+
+    paths = dependency.instance().headers(dependency_file, context_directory)
+    filesystem.cache.prefetch(paths)
+    return [model.store.register(path, path, makefile) for path in paths]
+
+
+def single_pass():
+    """
+    Can the compiler write the dependency file while compiling
+    """
+    return getattr(selector, 'COMPILE_GENERATES_DEPENDENCIES', False) and \
+        not state.settings.dependency_step()
 
 
 def make_clean_target(targets, makefile):
@@ -144,12 +162,10 @@ def optional_library_paths():
 #
 
 
-def Compile(sourcefile, objectfile=None, directive=[]):
+def compile_object(makefile, include_paths, sourcefile, objectfile, directive):
     """
-    Compile code to object files
+    helper registering the targets for one source file
     """
-    makefile = caller()
-
     if not objectfile:
         objectfile = selector.make_objectname(sourcefile)
 
@@ -178,13 +194,23 @@ def Compile(sourcefile, objectfile=None, directive=[]):
         'destination': object_target,
         'dependencyfile':  dependencyfile,
         'source': source_target,
-        'include_paths': model.include_paths(makefile.filename()),
+        'include_paths': include_paths,
         'directive': directive
     }
 
+    # the precompiled header of the makefile that is compiled with the same directive, if any
+    for precompiled in model.get_value(makefile.filename(), 'precompiled_header') or []:
+        if precompiled['directive'] == directive:
+            arguments['precompiled_header'] = precompiled['target']
+            object_dependencies.append(precompiled['target'])
+
+    if single_pass():
+        arguments['single_pass'] = True
+    else:
+        object_target.add_recipe(
+            Recipe(recipe.execute_dependency_generation, arguments))
+
     object_target.add_recipe(
-        Recipe(recipe.execute_dependency_generation, arguments)
-    ).add_recipe(
         Recipe(recipe.compile, arguments)
     ).add_dependency(object_dependencies)
 
@@ -195,12 +221,188 @@ def Compile(sourcefile, objectfile=None, directive=[]):
     return object_target
 
 
+def PrecompiledHeader(header, directive=[]):
+    """
+    Precompile the header with the include paths of the makefile and the directive.
+    The compiles in the makefile, declared after it and with the same directive, use it.
+    """
+    makefile = caller()
+    if not hasattr(selector, 'precompiled_header_command'):
+        raise SystemError("precompiled headers are not supported by " + compiler_handler_module)
+
+    # the wrapper includes the header, see recipe.precompile
+    name = selector.make_precompiled_header_name(header, directive)
+    wrapper, dummy = os.path.splitext(name)
+    dependencyfile = wrapper + '.d'
+
+    precompiled_target = model.register(name=name, filename=absolute_path(
+        name, makefile.filename()), makefile=makefile.filename())
+    if precompiled_target.has_recipes():
+        # the same header with the same directive is already precompiled
+        return precompiled_target
+
+    header_target = model.register(name=header, filename=absolute_path(
+        header, makefile.filename()), makefile=makefile.filename())
+    wrapper_filename = absolute_path(wrapper, makefile.filename())
+    wrapper_target = model.register(name=wrapper_filename, filename=wrapper_filename, makefile=makefile.filename())
+    dependencyfile_target = model.register(name=dependencyfile, filename=absolute_path(
+        dependencyfile, makefile.filename()), makefile=makefile.filename())
+    dependencyfile_target.add_dependency(header_target)
+
+    header_dependencies = includes(dependencyfile_target.filename(), makefile=makefile.filename())
+    if not header_dependencies:
+        header_dependencies = [header_target]
+    header_dependencies.append(dependencyfile_target)
+
+    arguments = {
+        'destination': precompiled_target,
+        'dependencyfile': dependencyfile,
+        'source': header_target,
+        'wrapper': wrapper_target,
+        'include_paths': model.include_paths(makefile.filename()),
+        'directive': directive
+    }
+
+    precompiled_target.add_recipe(
+        Recipe(recipe.precompile, arguments)
+    ).add_dependency(header_dependencies)
+
+    compile_target.add_dependency(precompiled_target)
+
+    # the last one declared with a directive is used by the compiles with that directive
+    precompiled = [item for item in model.get_value(makefile.filename(), 'precompiled_header') or []
+                   if item['directive'] != directive]
+    model.add_key_value(makefile.filename(), 'precompiled_header',
+                        precompiled + [{'target': precompiled_target, 'directive': directive}])
+
+    make_clean_target([precompiled_target, wrapper_target, dependencyfile_target], makefile)
+
+    return precompiled_target
+
+
+def Compile(sourcefile, objectfile=None, directive=[]):
+    """
+    Compile code to object files
+    """
+    makefile = caller()
+
+    return compile_object(makefile, model.include_paths(makefile.filename()),
+                          sourcefile, objectfile, directive)
+
+
+def CompileMany(sourcefiles, directive=[]):
+    """
+    Compile a list of source files to object files
+    """
+    makefile = caller()
+    include_paths = model.include_paths(makefile.filename())
+
+    return [compile_object(makefile, include_paths, sourcefile, None, directive)
+            for sourcefile in sourcefiles]
+
+
+def unity_objects(makefile, name, objects):
+    """
+    helper for the links in unity mode, the compiles of the makefile with the same include paths,
+    directive and kind of source are compiled in batches. Returns the objects to link.
+    """
+    if not state.settings.unity():
+        return objects
+
+    groups = {}
+    for target in objects:
+        recipes = target.recipe() if isinstance(target, Target) else []
+        if not recipes or recipes[-1].function != recipe.compile or target.makefile() != makefile.filename():
+            continue
+        arguments = recipes[-1].arguments()
+        dummy, extension = os.path.splitext(arguments['source'].filename())
+        key = (tuple(arguments['include_paths']), tuple(arguments['directive']), extension)
+        groups.setdefault(key, []).append(target)
+
+    isolation = unity.instance()
+    batched = {}
+    for (include_paths, directive, extension), members in groups.items():
+        if len(members) < 2:
+            continue
+
+        # the batches of a group are named by what the group shares, and numbered within it
+        group = hashlib.sha1(repr((include_paths, directive, extension)).encode()).hexdigest()[:8]
+        prefix = 'obj/unity/' + name + '.' + group
+        targets = {target.recipe()[-1].arguments()['source'].filename(): target for target in members}
+        sources = sorted(targets)
+
+        # the batches are sized by the compile time of the sources when compiled one by one,
+        # and kept until the threshold changes
+        known = [history.instance().duration(targets[source]) for source in sources]
+        known = [duration for duration in known if duration]
+        estimate = sum(known) / len(known) if known else history.instance().estimate()
+        durations = [(source, history.instance().duration(targets[source]) or estimate) for source in sources]
+        layout = unity.location(absolute_path(prefix, makefile.filename()))
+        split = unity.split(sources, unity.boundaries(layout, durations, unity.threshold()))
+        if cache.journal:
+            cache.journal.input(layout)
+
+        for index, batch in enumerate(split, 1):
+            batch = [targets[source] for source in batch]
+            objectfile = prefix + '.' + str(index) + '.o'
+            sourcefile = prefix + '.' + str(index) + extension
+
+            # an edited source is taken out of the batch, a batch compiled from scratch takes them all
+            batch_filename = absolute_path(objectfile, makefile.filename())
+            timestamp = filesystem.cache.timestamp(batch_filename)
+            if not timestamp:
+                isolation.reset(batch_filename)
+            for target in batch:
+                source = target.recipe()[-1].arguments()['source']
+                if timestamp and source.timestamp() > timestamp:
+                    isolation.isolate(batch_filename, source.filename())
+            batch = [target for target in batch
+                     if target.recipe()[-1].arguments()['source'].filename() not in isolation.isolated(batch_filename)]
+            if len(batch) < 2:
+                # clean removes the object of the dissolved batch, the sources are batched again
+                dependencyfile = selector.make_dependencyfilename(objectfile)
+                make_clean_target([model.register(name=path, filename=absolute_path(path, makefile.filename()),
+                                                  makefile=makefile.filename()) for path in [objectfile, dependencyfile]],
+                                  makefile)
+                continue
+
+            sources = [target.recipe()[-1].arguments()['source'].filename() for target in batch]
+            filename = absolute_path(sourcefile, makefile.filename())
+            if not state.settings.dry_run():
+                unity.write(filename, unity.content(os.path.dirname(filename), sources))
+            if cache.journal:
+                # an edited source changes the batches
+                for path in sources + [filename]:
+                    cache.journal.input(path)
+
+            batch_target = compile_object(makefile, list(include_paths), sourcefile, objectfile, list(directive))
+            compile_target.remove_dependency(batch)
+            for target in batch:
+                batched[target] = batch_target
+
+    if not parallel.deferred:
+        # a worker of the parallel model hands the changes to the main process, see entity/parallel.py
+        isolation.save()
+
+    # each batch object in place of the first of its objects
+    reply = []
+    linked = set()
+    for target in objects:
+        if target not in batched:
+            reply.append(target)
+        elif batched[target] not in linked:
+            linked.add(batched[target])
+            reply.append(batched[target])
+    return reply
+
+
 def LinkLibrary(destination, objects, libs):
     """
     Link object files to shared objects library
     """
 
     makefile = caller()
+    objects = unity_objects(makefile, os.path.basename(destination), objects)
     directory, dummy = os.path.split(makefile.filename())
     name = os.path.basename(destination)
     full_library_name = selector.expanded_library_name(destination, directory)
@@ -219,7 +421,7 @@ def LinkLibrary(destination, objects, libs):
 
     library_target.add_recipe(
         Recipe(recipe.link_library, arguments)
-    ).add_dependency(objects + normalized_library_targets).add_dependency(makefile)
+    ).add_dependency(objects + normalized_library_targets).add_dependency(makefile).pools('link')
 
     link_library_target.add_dependency([library_target, makefile])
 
@@ -234,6 +436,7 @@ def LinkArchive(destination, objects):
     """
 
     makefile = caller()
+    objects = unity_objects(makefile, os.path.basename(destination), objects)
     directory, dummy = os.path.split(makefile.filename())
     name = os.path.basename(destination)
 
@@ -259,6 +462,7 @@ def LinkArchive(destination, objects):
 def LinkExecutable(destination, objects, libs):
 
     makefile = caller()
+    objects = unity_objects(makefile, os.path.basename(destination), objects)
     directory, dummy = os.path.split(makefile.filename())
 
     full_executable_name = selector.expanded_executable_name(
@@ -276,7 +480,7 @@ def LinkExecutable(destination, objects, libs):
 
     executable_target.add_recipe(
         Recipe(recipe.link_executable, arguments)
-    ).add_dependency(objects + normalized_library_targets).add_dependency(makefile)
+    ).add_dependency(objects + normalized_library_targets).add_dependency(makefile).pools('link')
 
     link_executable_target.add_dependency([executable_target, makefile])
 
@@ -288,6 +492,7 @@ def LinkExecutable(destination, objects, libs):
 def LinkUnittest(destination, objects, libs):
 
     makefile = caller()
+    objects = unity_objects(makefile, os.path.basename(destination), objects)
     directory, dummy = os.path.split(makefile.filename())
 
     full_executable_name = selector.expanded_executable_name(
@@ -306,7 +511,7 @@ def LinkUnittest(destination, objects, libs):
 
     executable_target.add_recipe(
         Recipe(recipe.link_unittest, arguments)
-    ).add_dependency(objects + normalized_library_targets).add_dependency(makefile)
+    ).add_dependency(objects + normalized_library_targets).add_dependency(makefile).pools('link')
 
     link_unittest_target.add_dependency([executable_target, makefile])
 
@@ -322,7 +527,7 @@ def LinkUnittest(destination, objects, libs):
                 'library_paths': library_paths
             }
         )
-    ).execute(True).serial(True)
+    ).execute(True).pools('test')
 
     test_executable_target.add_dependency(executable_target)
     test_target.add_dependency(test_executable_target)
@@ -392,6 +597,8 @@ def Environment(variabel, value):
     """
     Set a environment variable
     """
+    if cache.journal:
+        cache.journal.environment(variabel, value)
     os.environ[variabel] = value
 
 
@@ -424,6 +631,32 @@ def Dependencies(target, dependencies):
     target.add_dependency(dependencies)
 
 
+def Pool(name, size):
+    """
+    Declare a pool with a number of slots, e.g. Pool('link', 2) or Pool('db_port', 1)
+    """
+    model.add_pool(name, size)
+
+
+def AssignPool(targets, pool):
+    """
+    The targets hold a slot of the pool while they are built, at most as many
+    targets as the pool has slots are built at the same time.
+    Targets can be given by name, e.g. 'test-' + the name of a unittest.
+    """
+    if not isinstance(targets, list):
+        targets = [targets]
+
+    for target in targets:
+        if not isinstance(target, Target):
+            name = target
+            target = model.get(name)
+            if not target:
+                raise SystemError("target " + name + " is not known")
+        if pool not in target.pools():
+            target.pools(target.pools() + [pool])
+
+
 def Build(filename):
     """
     Build a separate file
@@ -438,5 +671,4 @@ def Build(filename):
     target = model.register(name=filename, filename=absolute_path(
         filename, makefile.filename()), makefile=makefile.filename())
 
-    with open(filename) as file:
-        importCode(file, filename, "makefile", 1)
+    model.evaluate(filename)
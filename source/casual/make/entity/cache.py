@@ -0,0 +1,333 @@
+import hashlib
+import importlib
+import os
+import pickle
+import sys
+
+import casual
+import casual.make.entity.lazy as lazy
+import casual.make.entity.target as target
+import casual.make.entity.state as state
+import casual.make.tools.dependency as dependency
+import casual.make.tools.environment as environment
+import casual.make.tools.filesystem as filesystem
+
+# the journal of the makefile currently being evaluated, if any
+journal = None
+
+# the version of the recorded operations, fragments of an other version are evaluated again
+FORMAT = '5'
+
+
+class Uncacheable(Exception):
+    pass
+
+
+class Reference(object):
+    """
+    Stands in for a target inside an encoded recipe argument
+    """
+
+    def __init__(self, index):
+        self.index = index
+
+
+class Journal(object):
+    """
+    Records every mutation of the model done while a makefile is evaluated.
+    Replaying the journal reproduces the makefile's fragment of the model.
+    """
+
+    def __init__(self, makefile):
+        self.makefile = makefile
+        self.operations = []
+        self.targets = []
+        self.inputs = {}
+        self.lookups = set()
+        self.names = set()
+        self.cacheable = True
+        self.__index = {}
+        self.__identity = {}
+        self.__alive = []
+        self.__encoded = {}
+
+    def reference(self, item, filename=None):
+        index = self.__identity.get(id(item))
+        if index is not None:
+            return index
+        key = (item.name(), filename if filename else item.filename(), item.makefile())
+        index = self.__index.get(key)
+        if index is None:
+            index = len(self.targets)
+            self.targets.append(key)
+            self.__index[key] = index
+        self.__identity[id(item)] = index
+        self.__alive.append(item)
+        return index
+
+    def encode(self, value):
+        if value is None or isinstance(value, (str, int, float, bool)):
+            return value
+        if isinstance(value, target.Target):
+            return Reference(self.reference(value))
+        if isinstance(value, list):
+            return [self.encode(item) for item in value]
+        if isinstance(value, tuple):
+            return tuple(self.encode(item) for item in value)
+        if isinstance(value, dict):
+            # recipes often share the same argument dict
+            if id(value) not in self.__encoded:
+                self.__encoded[id(value)] = (value, {key: self.encode(item) for key, item in value.items()})
+            return self.__encoded[id(value)][1]
+        raise Uncacheable("can't cache value of type " + str(type(value)))
+
+    def record(self, operation):
+        if self.cacheable:
+            self.operations.append(operation)
+
+    def register(self, item, filename):
+        # the model is indexed on the filename as given, not the normalized one
+        self.record(('register', self.reference(item, filename)))
+
+    def dependency(self, item, dependencies):
+        if not isinstance(dependencies, list):
+            dependencies = [dependencies]
+        if not all(isinstance(d, target.Target) for d in dependencies):
+            self.uncacheable("can't cache dependencies " + str(dependencies))
+            return
+        self.record(('dependency', self.reference(item), [self.reference(d) for d in dependencies]))
+
+    def remove(self, item, dependencies):
+        self.record(('remove', self.reference(item), [self.reference(d) for d in dependencies]))
+
+    def recipe(self, item, recipes):
+        if not isinstance(recipes, list):
+            recipes = [recipes]
+        try:
+            for recipe in recipes:
+                function = recipe.function
+                if function.__module__ not in sys.modules or function.__module__ == 'makefile' or '<' in function.__qualname__:
+                    raise Uncacheable("can't cache recipe " + function.__qualname__)
+                self.record(('recipe', self.reference(item), function.__module__,
+                             function.__qualname__, self.encode(recipe.arguments())))
+        except Uncacheable as exception:
+            self.uncacheable(str(exception))
+
+    def execute(self, item, value):
+        self.record(('execute', self.reference(item), value))
+
+    def serial(self, item, value):
+        self.record(('serial', self.reference(item), value))
+
+    def pools(self, item, value):
+        self.record(('pools', self.reference(item), value))
+
+    def pool(self, name, size):
+        self.record(('pool', name, size))
+
+    def key_value(self, makefile, key, value):
+        try:
+            self.record(('key_value', makefile, key, self.encode(value)))
+        except Uncacheable as exception:
+            self.uncacheable(str(exception))
+
+    def environment(self, variable, value):
+        self.record(('environment', variable, value))
+
+    def build(self, filename):
+        self.record(('build', filename))
+
+    def lookup(self, name, found=False):
+        """
+        A name looked up in the model, a name that is not found is resolved when the fragment is replayed
+        """
+        self.names.add(name)
+        if not found:
+            self.lookups.add(name)
+
+    def input(self, filename):
+        """
+        A file read during evaluation, the fragment is only valid as long as it's unchanged
+        """
+        self.inputs[filename] = filesystem.cache.timestamp(filename)
+
+    def uncacheable(self, reason):
+        if self.cacheable and state.settings.verbose():
+            print("\nmodel cache: " + self.makefile + ": " + reason)
+        self.cacheable = False
+
+    def __getstate__(self):
+        return {
+            'makefile': self.makefile,
+            'operations': self.operations,
+            'targets': self.targets,
+            'inputs': self.inputs,
+            'lookups': self.lookups,
+            'names': self.names,
+            'cacheable': self.cacheable}
+
+    def __setstate__(self, values):
+        self.__dict__.update(values)
+        self.__index = {}
+        self.__identity = {}
+        self.__alive = []
+        self.__encoded = {}
+
+
+def location(makefile):
+    return state.cache_path('model', hashlib.sha1(makefile.encode()).hexdigest())
+
+
+def identity(makefile, content):
+    """
+    The fragment of a makefile depends on its content, its environment and our version
+    """
+    hashed = hashlib.sha256()
+    hashed.update(casual.__version__.encode())
+    hashed.update(FORMAT.encode())
+    hashed.update(makefile.encode())
+    hashed.update(content)
+    configuration(hashed)
+    return hashed.hexdigest()
+
+
+def configuration(hashed):
+    """
+    Adds what an evaluation depends on besides the makefile, the environment and the settings
+    """
+    extra = environment.get('CASUAL_MAKE_MODEL_CACHE_ENVIRONMENT', '').split(':')
+    for variable in sorted(os.environ):
+        if variable in ['CASUAL_MAKE_SETTING_SERIALIZED', 'CASUAL_MAKE_CLIENT', 'CASUAL_MAKE_SERVER_FD',
+                        'CASUAL_MAKE_PARALLEL_MODEL', 'CASUAL_MAKE_LAZY_MODEL']:
+            continue
+        if variable.startswith('CASUAL_') or variable in extra:
+            hashed.update((variable + '=' + os.environ[variable] + '\0').encode())
+
+    for setting in ['compiler_handler_module', 'debug', 'analyze', 'use_valgrind', 'dependency_step', 'unity']:
+        hashed.update((setting + '=' + str(state.settings.model[setting]) + '\0').encode())
+
+
+def load(makefile, fragment_key):
+    try:
+        with open(location(makefile), 'rb') as file:
+            stored = pickle.load(file)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+
+    if stored['key'] != fragment_key:
+        return None
+
+    stored_journal = stored['journal']
+    for filename, timestamp in stored_journal.inputs.items():
+        if filesystem.cache.timestamp(filename) != timestamp:
+            return None
+
+    return stored_journal
+
+
+def save(fragment_key, stored_journal):
+    path = location(stored_journal.makefile)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = path + '.' + str(os.getpid())
+    with open(temporary, 'wb') as file:
+        pickle.dump({'key': fragment_key, 'journal': stored_journal}, file, pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary, path)
+
+
+def replay(replayed):
+    """
+    Merge a recorded fragment into the model
+    """
+    import casual.make.entity.model as model
+
+    if lazy.current:
+        for name in replayed.names:
+            lazy.current.lookup(replayed.makefile, name)
+    dependency.instance().use(replayed.inputs)
+
+    targets = [None] * len(replayed.targets)
+
+    def resolve(index):
+        if targets[index] is None:
+            name, filename, makefile = replayed.targets[index]
+            found = None
+            if name in replayed.lookups:
+                found = model.store.get(name)
+            elif filename and not model.store.get(name, filename):
+                # registered by another makefile, with a filename relative to that makefile
+                for candidate in model.store.target_cache().get(name, {}).values():
+                    if candidate.filename() == filename:
+                        found = candidate
+                        break
+            targets[index] = found if found else model.register(name, filename, makefile)
+        return targets[index]
+
+    decoded = {}
+
+    def decode(value):
+        if isinstance(value, Reference):
+            return resolve(value.index)
+        if isinstance(value, list):
+            return [decode(item) for item in value]
+        if isinstance(value, tuple):
+            return tuple(decode(item) for item in value)
+        if isinstance(value, dict):
+            if id(value) not in decoded:
+                decoded[id(value)] = (value, {key: decode(item) for key, item in value.items()})
+            return decoded[id(value)][1]
+        return value
+
+    for operation in replayed.operations:
+        kind = operation[0]
+        if kind == 'register':
+            resolve(operation[1])
+        elif kind == 'dependency':
+            resolve(operation[1]).add_dependency([resolve(index) for index in operation[2]])
+        elif kind == 'remove':
+            resolve(operation[1]).remove_dependency([resolve(index) for index in operation[2]])
+        elif kind == 'recipe':
+            function = getattr(importlib.import_module(operation[2]), operation[3])
+            resolve(operation[1]).add_recipe(target.Recipe(function, decode(operation[4])))
+        elif kind == 'execute':
+            resolve(operation[1]).execute(operation[2])
+        elif kind == 'serial':
+            resolve(operation[1]).serial(operation[2])
+        elif kind == 'pools':
+            resolve(operation[1]).pools(operation[2])
+        elif kind == 'pool':
+            model.add_pool(operation[1], operation[2])
+        elif kind == 'key_value':
+            model.add_key_value(operation[1], operation[2], decode(operation[3]))
+        elif kind == 'environment':
+            os.environ[operation[1]] = operation[2]
+        elif kind == 'build':
+            model.evaluate(operation[1])
+
+
+def evaluate(filename, execute):
+    """
+    Evaluate the makefile with execute, or replay its fragment if nothing has changed
+    """
+    global journal
+
+    makefile = os.path.abspath(filename)
+    with open(makefile, 'rb') as file:
+        fragment_key = identity(makefile, file.read())
+
+    if journal:
+        journal.build(filename)
+
+    parent = journal
+    try:
+        cached = load(makefile, fragment_key)
+        if cached:
+            journal = None
+            replay(cached)
+            return
+
+        journal = Journal(makefile)
+        execute(filename)
+        if journal.cacheable:
+            save(fragment_key, journal)
+    finally:
+        journal = parent
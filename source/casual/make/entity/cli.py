@@ -27,8 +27,14 @@ def handle_arguments(arguments = None):
                         action="store_true", default=False)
     parser.add_argument("-f", "--force", help="force action to execute",
                         action="store_true", default=False)
-    parser.add_argument("--statistics", help="printout some statistics",
+    parser.add_argument("-j", "--jobs", help="number of local workers, default the processors available",
+                        type=int, default=None)
+    parser.add_argument("--max-load", help="start no new local action while the load average is at least LOAD",
+                        metavar="LOAD", type=float, default=None)
+    parser.add_argument("--statistics", help="printout statistics of the build",
                         action="store_true", default=False)
+    parser.add_argument("--statistics-json", help="write statistics of the build to the file, as JSON",
+                        metavar="FILE", default=None)
     parser.add_argument("--no-colors", help="no colors in printouts",
                         action="store_true", default=False)
     parser.add_argument("-i", "--ignore-errors",
@@ -39,6 +45,30 @@ def handle_arguments(arguments = None):
                         help="print some verbose output", action="store_true")
     parser.add_argument(
         "--version", help="print version number", action="store_true")
+    parser.add_argument("--model-cache", help="reuse the evaluated model of unchanged makefiles",
+                        action="store_true", default=False)
+    parser.add_argument("--parallel-model", help="evaluate the makefiles in parallel, in a pool of processes",
+                        action="store_true", default=False)
+    parser.add_argument("--lazy-model", help="evaluate only the makefiles the target needs, from an index of the last evaluation",
+                        action="store_true", default=False)
+    parser.add_argument("--dependency-step", help="generate header dependencies in a separate preprocessor run",
+                        action="store_true", default=False)
+    parser.add_argument("--content-hash", help="rebuild only when the content of an input has changed, not just the timestamp",
+                        action="store_true", default=False)
+    parser.add_argument("--rebuild-on-command-change", help="rebuild targets whose command has changed since the last build",
+                        action="store_true", default=False)
+    parser.add_argument("--unity", help="compile the sources of a link in batches, each batch a source that includes several sources",
+                        action="store_true", default=False)
+    parser.add_argument("--rerun-tests", help="run the tests even if they passed last time with the same executable, libraries and arguments",
+                        action="store_true", default=False)
+    parser.add_argument("--trace", help="write a timeline of the build to the file, as Chrome trace event JSON",
+                        metavar="FILE", default=None)
+    parser.add_argument("--watch", help="build again each time an input changes",
+                        action="store_true", default=False)
+    parser.add_argument("--server", help="keep the model of the makefile in the current directory between builds",
+                        action="store_true", default=False)
+    parser.add_argument("--client", help="let the server of the current directory build, if there is one",
+                        action="store_true", default=False)
 
     parser.add_argument(
         "extra_args", help="argument passed to action", nargs=argparse.REMAINDER)
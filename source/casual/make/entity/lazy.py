@@ -0,0 +1,195 @@
+"""
+Evaluates only the makefiles a goal needs. The index, kept in the cache directory, records for each
+makefile the makefiles it builds, the names of the targets it defines and the makefiles it requires:
+the makefiles of the targets its targets depend on, and of the names it looks up. A goal defined by a
+makefile needs that makefile, the makefiles it requires, and the makefiles that build them. The index
+is kept for the environment and the settings it was made with, as the fragments of the model cache.
+"""
+import hashlib
+import json
+import os
+
+import casual.make.entity.state as state
+import casual.make.tools.filesystem as filesystem
+
+# the version of the index, an index of another version is not used
+VERSION = 2
+
+
+def enabled():
+    return state.settings.lazy_model()
+
+
+def configuration():
+    """
+    The environment and the settings the makefiles are evaluated with, an index of another
+    configuration is not used, see cache.configuration()
+    """
+    import casual.make.entity.cache as cache
+
+    hashed = hashlib.sha256()
+    cache.configuration(hashed)
+    return hashed.hexdigest()
+
+
+def location(root):
+    return state.cache_path('makefiles', hashlib.sha1(root.encode()).hexdigest() + '.json')
+
+
+class Index(object):
+    """
+    The makefiles of the last evaluation of the root makefile
+    """
+
+    def __init__(self, root, makefiles=None, key=None):
+        self.root = root
+        self.makefiles = makefiles if makefiles else {}
+        # the configuration the makefiles are evaluated with, before they set any environment
+        self.key = key if key else configuration()
+        self.m_names = None
+
+    @staticmethod
+    def load(root):
+        key = configuration()
+        try:
+            with open(location(root)) as file:
+                content = json.load(file)
+            if content['version'] == VERSION and content['root'] == root and content['configuration'] == key:
+                return Index(root, content['makefiles'], key)
+        except (OSError, ValueError, KeyError):
+            pass
+        return Index(root, key=key)
+
+    def save(self):
+        path = location(self.root)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = path + '.' + str(os.getpid())
+        with open(temporary, 'w') as file:
+            json.dump({'version': VERSION, 'root': self.root, 'configuration': self.key,
+                       'makefiles': self.makefiles}, file)
+        os.replace(temporary, path)
+
+    def names(self):
+        """
+        The makefiles that define each name
+        """
+        if self.m_names is None:
+            self.m_names = {}
+            for makefile, entry in self.makefiles.items():
+                for name in entry['targets']:
+                    self.m_names.setdefault(name, []).append(makefile)
+        return self.m_names
+
+    def changed(self):
+        return [makefile for makefile, entry in self.makefiles.items()
+                if filesystem.cache.timestamp(makefile) != entry['timestamp']]
+
+    def needed(self, goal):
+        """
+        The makefiles to evaluate for the goal, and the makefiles that have changed since they were
+        indexed. None if all makefiles are needed.
+        """
+        if self.root not in self.makefiles or goal not in self.names():
+            return None
+
+        parents = {}
+        for makefile, entry in self.makefiles.items():
+            for child in entry['builds']:
+                parents.setdefault(child, []).append(makefile)
+
+        needed = set()
+        pending = self.names()[goal] + self.changed()
+        while pending:
+            makefile = pending.pop()
+            if makefile in needed:
+                continue
+            needed.add(makefile)
+            entry = self.makefiles.get(makefile)
+            if entry:
+                pending.extend(entry['requires'])
+            pending.extend(parents.get(makefile, []))
+        return needed
+
+
+class Evaluation(object):
+    """
+    The makefiles built and the names looked up by each makefile while the model is built
+    """
+
+    def __init__(self, index, needed):
+        self.index = index
+        self.needed = needed
+        self.m_builds = {}
+        self.m_names = {}
+        self.m_entries = {}
+
+    def wanted(self, makefile):
+        """
+        True if the makefile is evaluated, a makefile that is not indexed is always evaluated
+        """
+        return self.needed is None or makefile in self.needed or makefile not in self.index.makefiles
+
+    def build(self, parent, makefile):
+        if parent:
+            builds = self.m_builds.setdefault(parent, [])
+            if makefile not in builds:
+                builds.append(makefile)
+
+    def lookup(self, makefile, name):
+        if makefile:
+            self.m_names.setdefault(makefile, set()).add(name)
+
+    def update(self, targets, evaluated):
+        """
+        The entries of the evaluated makefiles, from the targets of the model.
+        Returns the makefiles they require that are not evaluated.
+        """
+        entries = {}
+        for makefile in evaluated:
+            entries[makefile] = {'timestamp': filesystem.cache.timestamp(makefile),
+                                 'builds': self.m_builds.get(makefile, []), 'targets': set(), 'requires': set()}
+
+        for target in targets:
+            entry = entries.get(target.makefile())
+            if entry is None or not target.has_recipes():
+                continue
+            entry['targets'].add(target.name())
+            for dependency in target.dependency():
+                if dependency.has_recipes() and dependency.makefile() and dependency.makefile() != target.makefile():
+                    entry['requires'].add(dependency.makefile())
+
+        names = {}
+        for makefile, entry in self.index.makefiles.items():
+            if makefile in entries:
+                continue
+            for name in entry['targets']:
+                names.setdefault(name, set()).add(makefile)
+        for makefile, entry in entries.items():
+            for name in entry['targets']:
+                names.setdefault(name, set()).add(makefile)
+        for makefile, looked_up in self.m_names.items():
+            if makefile in entries:
+                for name in looked_up:
+                    entries[makefile]['requires'].update(names.get(name, set()) - {makefile})
+
+        for entry in entries.values():
+            entry['targets'] = sorted(entry['targets'])
+            entry['requires'] = sorted(entry['requires'])
+        self.m_entries = entries
+
+        required = set()
+        for entry in entries.values():
+            required.update(entry['requires'])
+        return required - set(evaluated)
+
+    def save(self):
+        """
+        Updates the index with the evaluated makefiles, all makefiles are evaluated if nothing was needed
+        """
+        makefiles = dict(self.index.makefiles) if self.needed is not None else {}
+        makefiles.update(self.m_entries)
+        Index(self.index.root, makefiles, self.index.key).save()
+
+
+# the evaluation of the current build, if the lazy model is used
+current = None
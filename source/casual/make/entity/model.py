@@ -6,14 +6,25 @@ import sys
 
 from casual.make.entity.target import Target
 from casual.make.tools.executor import importCode
+import casual.make.entity.cache as cache
+import casual.make.entity.lazy as lazy
+import casual.make.entity.parallel as parallel
+import casual.make.entity.recipe as recipe
 import casual.make.entity.state as state
+import casual.make.tools.database as database
+import casual.make.tools.dependency as dependency
+import casual.make.tools.environment as environment
+
+
+# the slots of the pools unless declared otherwise, see api.Pool. None is only limited by the workers.
+POOLS = {'link': 4, 'test': None}
 
 
 # globals
 class Store(object):
     def __init__(self):
         # actual model
-        self.m_model = {'key_value': {}}
+        self.m_model = {'key_value': {}, 'pools': dict(POOLS)}
         # target cache
         self.m_target_cache = {}
         self.m_analyze_cache = {}
@@ -54,7 +65,11 @@ class Store(object):
             target = self.get(name.name(), name.filename())
             if target:
                 return target
+            if name.name() not in self.m_target_cache:
+                self.m_target_cache[name.name()] = {}
             self.m_target_cache[name.name()][name.filename()] = name
+            if cache.journal:
+                cache.journal.register(name, name.filename())
             return name
         else:
             target = self.get(name, filename)
@@ -65,12 +80,20 @@ class Store(object):
                     self.m_target_cache[name] = {}
                 self.m_target_cache[name][filename] = Target(
                     name, filename, makefile)
+                if cache.journal:
+                    cache.journal.register(self.m_target_cache[name][filename], filename)
                 return self.m_target_cache[name][filename]
 
 
 # instance of the global store
 store = Store()
 
+# the makefiles being evaluated, the innermost last
+makefiles = []
+
+# every makefile evaluated, in order
+evaluated = []
+
 
 def register(name, filename=None, makefile=None):
 
@@ -80,7 +103,12 @@ def register(name, filename=None, makefile=None):
 
 
 def get(name, filename=None, paths=None):
-    return store.get(name)
+    target = store.get(name)
+    if cache.journal:
+        cache.journal.lookup(name, found=target is not None)
+    if lazy.current:
+        lazy.current.lookup(current_makefile(), name)
+    return target
 
 
 def dump_model():
@@ -99,11 +127,39 @@ def add_key_value(makefile, key, value):
     """
     Add key, value in model
     """
+    if cache.journal:
+        cache.journal.key_value(makefile, key, value)
     if makefile not in store.model()['key_value']:
         store.model()['key_value'][makefile] = {}
     store.model()['key_value'][makefile][key] = value
 
 
+def add_pool(name, size):
+    """
+    Declare the pool with the number of slots
+    """
+    if not isinstance(size, int) or size < 1:
+        raise SystemError("pool " + name + " must have at least one slot, not " + str(size))
+    if cache.journal:
+        cache.journal.pool(name, size)
+    store.model()['pools'][name] = size
+
+
+def pools():
+    """
+    The slots of each pool, as declared and overridden by CASUAL_MAKE_POOLS, e.g. link=2,db_port=1
+    """
+    result = dict(store.model()['pools'])
+    for item in environment.get('CASUAL_MAKE_POOLS', '').split(','):
+        if not item.strip():
+            continue
+        name, separator, size = item.partition('=')
+        if not separator or not size.strip().isdigit() or int(size) < 1:
+            raise SystemError("CASUAL_MAKE_POOLS: " + item + " is not <pool>=<slots>")
+        result[name.strip()] = int(size)
+    return result
+
+
 def get_value(makefile, key):
     """
     Get value with key from model 
@@ -179,6 +235,8 @@ def analyze_dependency_tree(target):
     else:
         action_needed = False
         current_target = target
+        # content mode, see unchanged_content()
+        unchanged = None
 
         for child_target in current_target.dependency():
 
@@ -207,12 +265,34 @@ def analyze_dependency_tree(target):
                     max_timestamp = calculate_max_timestamp(current_target)
 
                     if current_target.filename() and timestamp < max_timestamp:
+                        if state.settings.content_hash():
+                            if unchanged is None:
+                                unchanged = database.instance().unchanged(current_target)
+                            if unchanged:
+                                # Newer, but the same content as at the last build
+                                continue
+
                         # The dependency files is newer.
                         # Need to run this step
                         current_target.execute(True)
                         action_needed = True
                         continue
 
+    if not action_needed and state.settings.rebuild_on_command_change() and target.filename():
+        signature = recipe.signature(target)
+        recorded = database.instance().command(target)
+        if recorded is None:
+            # built before the signatures were recorded, take it as it is
+            database.instance().record_command(target, signature)
+        elif recorded != signature:
+            target.execute(True)
+            action_needed = True
+
+    if not action_needed and state.settings.content_hash() and target.filename():
+        # up to date, make sure there is something to compare with next time
+        if not database.instance().recorded(target):
+            database.instance().record(target)
+
     store.analyze_cache()[target] = action_needed
     return action_needed
 
@@ -286,12 +366,163 @@ def construct_action_list(target):
     return normalize(flatten(target))
 
 
-def build():
+def construct_action_graph(target):
+    """
+    Construct the actions to take, each mapped to the actions it has to wait for.
+    An action waits for the nearest actions among its (transitive) dependencies.
+    """
+
+    def is_action(item):
+        return item.execute() and item.has_recipes()
+
+    prerequisites = {}
+
+    def nearest(item):
+        """
+        the nearest actions among the dependencies of item
+        """
+        if item in prerequisites:
+            return prerequisites[item]
+
+        result = {}
+        for dependency in item.dependency():
+            if is_action(dependency):
+                result[dependency] = True
+            else:
+                result.update(nearest(dependency))
+
+        prerequisites[item] = result
+        return result
+
+    graph = {}
+    stack = [target]
+    visited = set()
+    while stack:
+        item = stack.pop()
+        if item in visited:
+            continue
+        visited.add(item)
+
+        if is_action(item):
+            graph[item] = list(nearest(item))
+
+        stack.extend(item.dependency())
+
+    return graph
+
+
+def execute_makefile(filename):
+    """
+    Evaluate a makefile
+    """
+    with open(filename) as file:
+        importCode(file, filename, "makefile", 1)
+
+
+def evaluate(filename):
+    """
+    Evaluate a makefile, or replay its cached fragment if nothing has changed
+    """
+    if parallel.deferred:
+        # a worker, the makefile is evaluated by another worker, see entity/parallel.py
+        cache.journal.build(filename)
+        return
+
+    if lazy.current:
+        lazy.current.build(current_makefile(), os.path.abspath(filename))
+        if not lazy.current.wanted(os.path.abspath(filename)):
+            # not needed by the goal, see entity/lazy.py
+            if cache.journal:
+                cache.journal.build(filename)
+            return
+
+    makefiles.append(os.path.abspath(filename))
+    evaluated.append(os.path.abspath(filename))
+    try:
+        if parallel.current:
+            parallel.current.evaluate(filename, execute_makefile)
+        elif state.settings.model_cache():
+            cache.evaluate(filename, execute_makefile)
+        else:
+            execute_makefile(filename)
+    finally:
+        makefiles.pop()
+
+
+def current_makefile():
+    """
+    The makefile being evaluated
+    """
+    return makefiles[-1] if makefiles else None
+
+
+def reset():
+    """
+    A new model, with the global operations of the api registered, see api.register()
+    """
+    global store
+
+    # the first import registers in the model that is replaced
+    import casual.make.api as api
+
+    store = Store()
+    del makefiles[:]
+    del evaluated[:]
+    api.register()
+
+
+def evaluate_root(filename):
+    """
+    Evaluate the root makefile, and the makefiles it builds in parallel if enabled, see entity/parallel.py
+    """
+    workers = parallel.workers()
+    if not workers:
+        evaluate(filename)
+        return
+
+    parallel.current = parallel.Evaluation(workers)
+    try:
+        evaluate(filename)
+    finally:
+        parallel.current.shutdown()
+        parallel.current = None
+
+
+def build(goal=None):
     """
-    Build the model from a file
+    Build the model from a file. With the lazy model only the makefiles the goal needs are evaluated,
+    see entity/lazy.py
     """
+    reset()
 
     # Open the default name 'makefile.cmk'
     # Only supported option right now
-    with open("makefile.cmk") as file:
-        importCode(file, "makefile.cmk", "makefile", 1)
+    filename = "makefile.cmk"
+    if not lazy.enabled():
+        evaluate_root(filename)
+        dependency.instance().save(full=True)
+        return
+
+    index = lazy.Index.load(os.path.abspath(filename))
+    lazy.current = lazy.Evaluation(index, index.needed(goal) if goal else None)
+    try:
+        evaluate_root(filename)
+        targets = [target for targets in store.target_cache().values() for target in targets.values()]
+        missing = lazy.current.update(targets, evaluated)
+
+        if lazy.current.needed is not None and (missing or not store.get(goal)):
+            # a changed makefile needs makefiles that are not evaluated, evaluate all of them
+            reset()
+            lazy.current = lazy.Evaluation(index, None)
+            evaluate_root(filename)
+            targets = [target for targets in store.target_cache().values() for target in targets.values()]
+            lazy.current.update(targets, evaluated)
+
+        if state.settings.verbose() and lazy.current.needed is not None:
+            print("\nlazy model: " + str(len(evaluated)) + " of " + str(len(index.makefiles)) + " makefiles evaluated")
+        lazy.current.save()
+        full = lazy.current.needed is None
+    finally:
+        lazy.current = None
+
+    dependency.instance().save(full=full)
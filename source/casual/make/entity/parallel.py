@@ -0,0 +1,188 @@
+"""
+Evaluates the makefiles in a pool of processes. Each makefile is evaluated on its own, with a model
+of its own, and recorded as a fragment, see cache.Journal. The makefiles a fragment builds are not
+evaluated by the worker, they are submitted to the pool when the fragment is done. The fragments are
+replayed into the model in the order of a serial evaluation, names looked up from other makefiles
+are resolved when the fragment is replayed. A makefile is submitted with the environment of the makefile
+that builds it, if an earlier makefile has changed the environment by the time it's replayed, it's
+evaluated again with the environment of the serial evaluation.
+"""
+import concurrent.futures
+import multiprocessing
+import os
+
+import casual.make.entity.cache as cache
+import casual.make.entity.lazy as lazy
+import casual.make.entity.state as state
+import casual.make.tools.dependency as dependency
+import casual.make.tools.filesystem as filesystem
+import casual.make.tools.resources as resources
+import casual.make.tools.unity as unity
+
+# True in a worker, Build() records the makefile in the fragment instead of evaluating it
+deferred = False
+
+
+def workers():
+    """
+    The number of processes to evaluate with, 0 if the makefiles are evaluated one after another
+    """
+    if not state.settings.parallel_model() or 'fork' not in multiprocessing.get_all_start_methods():
+        return 0
+    count = state.settings.jobs() or resources.cpus()
+    return count if count > 1 else 0
+
+
+def builds(journal, variables):
+    """
+    The makefiles the fragment builds, in order, each with the environment it would be evaluated with
+    """
+    variables = dict(variables)
+    reply = []
+    for operation in journal.operations:
+        if operation[0] == 'environment':
+            variables[operation[1]] = operation[2]
+        elif operation[0] == 'build':
+            reply.append((operation[1], dict(variables)))
+    return reply
+
+
+def initialize():
+    global deferred
+    deferred = True
+    filesystem.cache.forked()
+
+
+def fragment(makefile, variables):
+    """
+    Evaluates the makefile in a worker. Returns the fragment, None if the makefile has to be
+    evaluated by the main process, the file metadata and dependency files the worker has read,
+    and the changes to the sources isolated from unity batches.
+    """
+    import casual.make.entity.model as model
+
+    inherited = dict(os.environ)
+    os.environ.clear()
+    os.environ.update(variables)
+    # the global operations of the api are not part of the fragment
+    model.reset()
+    filesystem.cache = filesystem.Cache()
+
+    reply = None
+    try:
+        with open(makefile, 'rb') as file:
+            key = cache.identity(makefile, file.read())
+
+        cached = cache.load(makefile, key) if state.settings.model_cache() else None
+        if cached:
+            reply = (key, cached, True)
+        else:
+            cache.journal = cache.Journal(makefile)
+            model.makefiles.append(makefile)
+            model.execute_makefile(makefile)
+            if cache.journal.cacheable:
+                reply = (key, cache.journal, False)
+    except Exception:
+        # the main process evaluates it again, and reports the error
+        reply = None
+    finally:
+        cache.journal = None
+        del model.makefiles[:]
+        os.environ.clear()
+        os.environ.update(inherited)
+
+    return reply, filesystem.cache.content(), dependency.instance().changes(), \
+        unity.current.take() if unity.current else []
+
+
+class Evaluation(object):
+    """
+    The makefiles submitted to the pool, and the fragments that are done
+    """
+
+    def __init__(self, count):
+        self.m_pool = concurrent.futures.ProcessPoolExecutor(
+            count, mp_context=multiprocessing.get_context('fork'), initializer=initialize)
+        self.m_futures = {}
+        self.m_makefiles = {}
+        self.m_variables = {}
+        self.m_replies = {}
+
+    def submit(self, makefile, variables):
+        if makefile in self.m_futures:
+            return
+        future = self.m_pool.submit(fragment, makefile, variables)
+        self.m_futures[makefile] = future
+        self.m_makefiles[future] = makefile
+        self.m_variables[makefile] = variables
+
+    def __discard(self, makefile):
+        future = self.m_futures.pop(makefile)
+        future.cancel()
+        del self.m_makefiles[future]
+        del self.m_variables[makefile]
+        self.m_replies.pop(makefile, None)
+
+    def __done(self, future):
+        makefile = self.m_makefiles[future]
+        reply, files, changes, isolated = future.result()
+        filesystem.cache.merge(files)
+        dependency.instance().merge(changes)
+        if isolated:
+            unity.instance().merge(isolated)
+            unity.instance().save()
+        self.m_replies[makefile] = reply
+
+        # the makefiles it builds are evaluated while waiting for the fragments before them
+        if reply:
+            for filename, variables in builds(reply[1], self.m_variables[makefile]):
+                if not lazy.current or lazy.current.wanted(os.path.abspath(filename)):
+                    self.submit(os.path.abspath(filename), variables)
+
+    def wait(self, makefile):
+        while makefile not in self.m_replies:
+            pending = [future for future, name in self.m_makefiles.items() if name not in self.m_replies]
+            done, dummy = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                self.__done(future)
+        return self.m_replies[makefile]
+
+    def evaluate(self, filename, execute):
+        """
+        Replays the fragment of the makefile into the model, a makefile without a fragment is evaluated with execute
+        """
+        makefile = os.path.abspath(filename)
+        variables = dict(os.environ)
+        if makefile in self.m_futures and self.m_variables[makefile] != variables:
+            # submitted early, the environment has been changed by a makefile evaluated since
+            self.__discard(makefile)
+        self.submit(makefile, variables)
+        reply = self.wait(makefile)
+
+        if not reply:
+            if state.settings.model_cache():
+                cache.evaluate(filename, execute)
+            else:
+                execute(filename)
+            return
+
+        key, journal, cached = reply
+        if cache.journal:
+            cache.journal.build(filename)
+
+        parent = cache.journal
+        cache.journal = None
+        try:
+            cache.replay(journal)
+        finally:
+            cache.journal = parent
+
+        if state.settings.model_cache() and not cached:
+            cache.save(key, journal)
+
+    def shutdown(self):
+        self.m_pool.shutdown(wait=True, cancel_futures=True)
+
+
+# the evaluation of the current build, if the makefiles are evaluated in parallel
+current = None
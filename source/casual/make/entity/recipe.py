@@ -1,3 +1,4 @@
+import hashlib
 import pprint
 
 import distutils.file_util
@@ -7,8 +8,12 @@ import time
 import sys
 
 from casual.make.entity.target import Target
+import casual.make.tools.artifact as artifact
+import casual.make.tools.database as database
 import casual.make.tools.executor as executor
+import casual.make.tools.filesystem as filesystem
 import casual.make.tools.output as output
+import casual.make.tools.remote as remote
 import casual.make.entity.state as state
 
 
@@ -54,6 +59,52 @@ def execute_dependency_generation(input):
         source, destination, context_directory, include_paths, dependency_file)
 
 
+def compile_directive(input):
+    """
+    The directive of a compile, including the precompiled header it uses, if any
+    """
+    if input.get('precompiled_header'):
+        wrapper, dummy = os.path.splitext(input['precompiled_header'].filename())
+        return input['directive'] + selector.precompiled_header_directive(wrapper)
+    return input['directive']
+
+
+def precompile(input):
+    """
+    Recipe for precompiling a header. The wrapper, that includes the header, is compiled
+    instead of the header, which would be the main file and e.g. warn about #pragma once.
+    The compiles include the wrapper, the compiler uses the precompiled header if it can.
+    """
+    header = input['source']
+    wrapper = input['wrapper']
+    destination = input['destination']
+    context_directory = os.path.dirname(destination.makefile())
+    dependency_file = os.path.join(context_directory, input['dependencyfile'])
+
+    content = '#include "' + header.filename() + '"\n'
+    if not state.settings.dry_run():
+        try:
+            with open(wrapper.filename()) as file:
+                current = file.read()
+        except OSError:
+            current = None
+        # the wrapper is only written when needed, it's a dependency of the precompiled header
+        if current != content:
+            executor.create_directory(os.path.dirname(wrapper.filename()))
+            with open(wrapper.filename(), 'w') as file:
+                file.write(content)
+            filesystem.cache.invalidate(wrapper.filename())
+
+    selector.execute_precompiled_header(
+        wrapper, destination, context_directory, input['include_paths'], input['directive'], dependency_file)
+
+    if not state.settings.dry_run() and os.path.exists(dependency_file):
+        # the dependency file is written after the precompiled header, which would be out of date
+        timestamp = os.stat(destination.filename()).st_mtime_ns
+        os.utime(dependency_file, ns=(timestamp, timestamp))
+        filesystem.cache.invalidate(dependency_file)
+
+
 def compile(input):
     """
     Recipe for compiling
@@ -62,10 +113,77 @@ def compile(input):
     destination = input['destination']
     include_paths = input['include_paths']
     context_directory = os.path.dirname(input['destination'].makefile())
-    directive = input['directive']
+    directive = compile_directive(input)
 
-    selector.execute_compile(
-        source, destination, context_directory, include_paths, directive)
+    dependency_file = None
+    if input.get('single_pass'):
+        # the compiler writes the dependency file as well
+        dependency_file = os.path.join(context_directory, input['dependencyfile'])
+
+    def execute():
+        if dependency_file:
+            selector.execute_compile(
+                source, destination, context_directory, include_paths, directive, dependency_file)
+        else:
+            selector.execute_compile(
+                source, destination, context_directory, include_paths, directive)
+
+    # the headers in a precompiled header are not in the dependency file, the cache key would miss them
+    if cacheable() and not input.get('precompiled_header'):
+        artifact.compile(compile_command(input), context_directory, source.filename(), destination.filename(),
+                         os.path.join(context_directory, input['dependencyfile']), input.get('single_pass'), execute)
+    else:
+        execute()
+
+
+def cacheable():
+    """
+    True if outputs are restored from, and stored in, the artifact cache
+    """
+    return artifact.enabled() and hasattr(selector, 'compile_command')
+
+
+def prefetch(targets):
+    """
+    Fetches the outputs of the compiles, with known headers, from the remote artifact cache ahead of the workers
+    """
+    if not cacheable() or not remote.enabled():
+        return
+
+    keys = []
+    for target in targets:
+        for recipe in target.recipe():
+            if recipe.function != compile or recipe.arguments().get('precompiled_header'):
+                continue
+            input = recipe.arguments()
+            if not input.get('single_pass'):
+                # the dependency file doesn't list the system headers, see artifact.compile
+                continue
+            context_directory = os.path.dirname(input['destination'].makefile())
+            key = artifact.direct(artifact.base('compile', compile_command(input), context_directory),
+                                  input['source'].filename(), os.path.join(context_directory, input['dependencyfile']), context_directory)
+            if key:
+                keys.append(key)
+
+    artifact.prefetch(keys)
+
+
+def cached_link(input, command, execute):
+    """
+    Links, or restores the linked file from the artifact cache
+    """
+    if not cacheable():
+        execute()
+        return
+
+    context_directory = os.path.dirname(input['destination'].makefile())
+    inputs = [os.path.join(context_directory, path) for path in retrieve_filenames(input['objects'])]
+    for library in input.get('libraries', []):
+        path = library_filename(library, input.get('library_paths', []), context_directory)
+        if path:
+            inputs.append(path)
+
+    artifact.link(command(input), context_directory, inputs, input['destination'].filename(), execute)
 
 
 def link(input):
@@ -81,8 +199,8 @@ def link(input):
     libraries = input['libraries']
     library_paths = input['library_paths']
 
-    selector.execute_link_library(
-        destination, context_directory, objects, library_paths, libraries)
+    cached_link(input, link_library_command, lambda: selector.execute_link_library(
+        destination, context_directory, objects, library_paths, libraries))
 
 
 def link_library(input):
@@ -98,8 +216,8 @@ def link_library(input):
     libraries = input['libraries']
     library_paths = input['library_paths']
 
-    selector.execute_link_library(
-        destination, context_directory, objects, library_paths, libraries)
+    cached_link(input, link_library_command, lambda: selector.execute_link_library(
+        destination, context_directory, objects, library_paths, libraries))
 
 
 def link_executable(input):
@@ -114,8 +232,8 @@ def link_executable(input):
     libraries = input['libraries']
     library_paths = input['library_paths']
 
-    selector.execute_link_executable(
-        destination, context_directory, objects, library_paths, libraries)
+    cached_link(input, link_executable_command, lambda: selector.execute_link_executable(
+        destination, context_directory, objects, library_paths, libraries))
 
 
 def link_archive(input):
@@ -127,7 +245,8 @@ def link_archive(input):
     objects = retrieve_filenames(input['objects'])
     context_directory = os.path.dirname(input['destination'].makefile())
 
-    selector.execute_link_archive(destination, context_directory, objects)
+    cached_link(input, link_archive_command, lambda: selector.execute_link_archive(
+        destination, context_directory, objects))
 
 
 def link_unittest(input):
@@ -141,8 +260,8 @@ def link_unittest(input):
     libraries = input['libraries']
     library_paths = input['library_paths']
 
-    selector.execute_link_executable(
-        destination, context_directory, objects, library_paths, libraries)
+    cached_link(input, link_executable_command, lambda: selector.execute_link_executable(
+        destination, context_directory, objects, library_paths, libraries))
 
 
 def test(input):
@@ -156,7 +275,13 @@ def test(input):
         cmd += extra_arguments.split()
 
     env = selector.local_library_path(library_paths)
-    executor.command(cmd, directory=context_directory, env=env)
+    if 'shard' in input:
+        # see tools/shard.py
+        index, count = input['shard']
+        env = dict(env, GTEST_SHARD_INDEX=str(index), GTEST_TOTAL_SHARDS=str(count))
+
+    # tests run in parallel, the output of each test is printed when it's done
+    executor.command(cmd, directory=context_directory, env=env, buffered=True)
 
 
 def install(input):
@@ -172,15 +297,12 @@ def install(input):
     if path[-1] != '/':
         path += '/'
     if not state.settings.dry_run():
-        try:
-            (filename, copied) = distutils.file_util.copy_file(
-                source, path, update=1, verbose=0)
-        except:
-            os.makedirs(path)
-            (filename, copied) = distutils.file_util.copy_file(
-                source, path, update=1, verbose=0)
+        executor.create_directory(path)
+        (filename, copied) = distutils.file_util.copy_file(
+            source, path, update=1, verbose=0)
 
         if copied:
+            filesystem.cache.invalidate(filename)
             sys.stdout.write(output.reformat(
                 'copy ' + source + ' ' + filename))
     else:
@@ -191,28 +313,166 @@ def clean(input):
     file = input['filename']
     context_directory = os.path.dirname(input['makefile'])
 
+    def remove(filename):
+        filename = os.path.abspath(filename)
+        if filesystem.cache.exists(filename):
+            sys.stdout.write(output.reformat("rm -f " + filename))
+            if not state.settings.dry_run():
+                os.remove(filename)
+                filesystem.cache.invalidate(filename)
+
     with executor.cd(context_directory):
         if isinstance(file, Target):
-            filename = file.filename()
-            if os.path.exists(filename):
-                sys.stdout.write(output.reformat("rm -f " + filename))
-                if not state.settings.dry_run():
-                    os.remove(filename)
+            remove(file.filename())
         elif isinstance(file, str):
-            if os.path.exists(file):
-                sys.stdout.write(output.reformat("rm -f " + file))
-                if not state.settings.dry_run():
-                    os.remove(file)
+            remove(file)
         else:
             for f in file:
                 if isinstance(f, str):
-                    filename = f
+                    remove(f)
                 else:
-                    filename = f.filename()
-                if os.path.exists(filename):
-                    sys.stdout.write(output.reformat("rm -f " + filename))
-                    if not state.settings.dry_run():
-                        os.remove(filename)
+                    remove(f.filename())
+
+
+def compile_command(input):
+    dependency_file = None
+    if input.get('single_pass'):
+        context_directory = os.path.dirname(input['destination'].makefile())
+        dependency_file = os.path.join(context_directory, input['dependencyfile'])
+    return selector.compile_command(
+        input['source'], input['destination'], input['include_paths'], compile_directive(input), dependency_file)
+
+
+def precompiled_header_command(input):
+    context_directory = os.path.dirname(input['destination'].makefile())
+    return selector.precompiled_header_command(
+        input['wrapper'], input['destination'], input['include_paths'], input['directive'],
+        os.path.join(context_directory, input['dependencyfile']))
+
+
+def dependency_generation_command(input):
+    context_directory = os.path.dirname(input['destination'].makefile())
+    dependency_file = os.path.join(context_directory, input['dependencyfile'])
+    return selector.dependency_generation_command(
+        input['source'], input['destination'], input['include_paths'], dependency_file)
+
+
+def link_library_command(input):
+    return selector.link_library_command(
+        input['destination'], retrieve_filenames(input['objects']), input['library_paths'], input['libraries'])
+
+
+def link_executable_command(input):
+    return selector.link_executable_command(
+        input['destination'], retrieve_filenames(input['objects']), input['library_paths'], input['libraries'])
+
+
+def link_archive_command(input):
+    return selector.link_archive_command(input['destination'], retrieve_filenames(input['objects']))
+
+
+# the command executed by each recipe, see signature()
+commands = {
+    compile: compile_command,
+    precompile: precompiled_header_command,
+    execute_dependency_generation: dependency_generation_command,
+    link: link_library_command,
+    link_library: link_library_command,
+    link_executable: link_executable_command,
+    link_unittest: link_executable_command,
+    link_archive: link_archive_command,
+}
+
+
+# the kind of action of each recipe, see kind()
+kinds = {
+    execute_dependency_generation: 'dependency',
+    compile: 'compile',
+    precompile: 'precompile',
+    link: 'link',
+    link_library: 'link',
+    link_executable: 'link',
+    link_unittest: 'link',
+    link_archive: 'archive',
+    test: 'test',
+    install: 'install',
+    clean: 'clean',
+}
+
+
+def kind(target):
+    """
+    The kind of action of the target, by its last recipe. E.g. a dependency generation followed by a compile is a compile.
+    """
+    if not target.recipe():
+        return None
+    function = target.recipe()[-1].function
+    return kinds.get(function, function.__name__)
+
+
+def signature(target):
+    """
+    Digest of the commands the recipes of the target executes.
+    Recipes without a known command, or compiler handlers without command builders, contributes with the recipe name.
+    """
+    hasher = hashlib.sha256()
+    for recipe in target.recipe():
+        builder = commands.get(recipe.function)
+        if builder and hasattr(selector, builder.__name__):
+            hasher.update(repr(builder(recipe.arguments())).encode())
+        else:
+            hasher.update((recipe.function.__module__ + '.' + recipe.function.__qualname__).encode())
+        hasher.update(b'\n')
+    return hasher.hexdigest()
+
+
+def library_filename(library, paths, context_directory):
+    """
+    The file of a linked library, the target's own file or the library resolved against the paths
+    """
+    if isinstance(library, Target):
+        if library.filename():
+            return library.filename()
+        library = library.name()
+    for path in paths:
+        found = [os.path.join(context_directory, path, 'lib' + library + suffix) for suffix in ['.so', '.dylib', '.a']]
+        found = [item for item in found if os.path.exists(item)]
+        if found:
+            return found[0]
+    return None
+
+
+def libraries(target, seen=None):
+    """
+    The libraries the linked target loads: the libraries of its link recipe and,
+    for the libraries built here, the libraries they link in turn
+    """
+    seen = set() if seen is None else seen
+    context_directory = os.path.dirname(target.makefile() or '')
+    result = []
+    for recipe in target.recipe():
+        input = recipe.arguments()
+        for library in input.get('libraries', []):
+            path = library_filename(library, input.get('library_paths', []), context_directory)
+            if path and path not in seen:
+                seen.add(path)
+                result.append(path)
+                if isinstance(library, Target):
+                    result.extend(libraries(library, seen))
+    return result
+
+
+def test_signature(target):
+    """
+    Digest of what the outcome of a test depends on: the content of the test executable and
+    the libraries it links, the extra arguments and the shard
+    """
+    input = target.recipe()[-1].arguments()
+    hasher = hashlib.sha256()
+    for path in [input['destination'].filename()] + libraries(input['destination']):
+        hasher.update((path + '\0' + str(database.instance().digest(path)) + '\n').encode())
+    hasher.update(repr((state.settings.extra_args(), input.get('shard'))).encode())
+    return hasher.hexdigest()
 
 
 def dispatch(target):
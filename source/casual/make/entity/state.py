@@ -2,6 +2,7 @@ import argparse
 import platform
 import subprocess
 import json
+import os
 import casual.make.tools.environment as env
 
 class Settings(object):
@@ -27,6 +28,17 @@ class Settings(object):
         self.model["ignore_errors"] = False
         self.model["verbose"] = False
         self.model["source_root"] = None
+        self.model["cache_directory"] = None
+        self.model["model_cache"] = False
+        self.model["parallel_model"] = False
+        self.model["lazy_model"] = False
+        self.model["dependency_step"] = False
+        self.model["content_hash"] = False
+        self.model["rebuild_on_command_change"] = False
+        self.model["rerun_tests"] = False
+        self.model["unity"] = False
+        self.model["jobs"] = None
+        self.model["max_load"] = None
 
         # remove when backward compatibility is not needed.
         self.compiler_handler = None
@@ -47,6 +59,17 @@ class Settings(object):
     def ignore_errors(self): return self.model["ignore_errors"]
     def verbose(self): return self.model["verbose"]
     def source_root(self): return self.model["source_root"]
+    def cache_directory(self): return self.model["cache_directory"]
+    def model_cache(self): return self.model["model_cache"]
+    def parallel_model(self): return self.model["parallel_model"]
+    def lazy_model(self): return self.model["lazy_model"]
+    def dependency_step(self): return self.model["dependency_step"]
+    def content_hash(self): return self.model["content_hash"]
+    def rebuild_on_command_change(self): return self.model["rebuild_on_command_change"]
+    def rerun_tests(self): return self.model["rerun_tests"]
+    def unity(self): return self.model["unity"]
+    def jobs(self): return self.model["jobs"]
+    def max_load(self): return self.model["max_load"]
 
     # serialize and deserialize to and from environment variable
     def serialize(self):
@@ -62,6 +85,19 @@ class Settings(object):
 settings = Settings()
 
 
+def cache_path(*parts):
+    """
+    Path in the cache directory, the directory is created if needed
+    """
+    directory = settings.cache_directory()
+    if not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+        # keep the cache out of version control
+        with open(os.path.join(directory, ".gitignore"), "w") as file:
+            file.write("*\n")
+    return os.path.join(directory, *parts)
+
+
 def environment(args):
     """
     update environment to manage application flow
@@ -116,6 +152,28 @@ def environment(args):
         settings.model["ignore_errors"] = True
     if args.verbose:
         settings.model["verbose"] = True
+    if args.model_cache or env.get("CASUAL_MAKE_MODEL_CACHE"):
+        settings.model["model_cache"] = True
+    if args.parallel_model or env.get("CASUAL_MAKE_PARALLEL_MODEL"):
+        settings.model["parallel_model"] = True
+    if args.lazy_model or env.get("CASUAL_MAKE_LAZY_MODEL"):
+        settings.model["lazy_model"] = True
+    if args.dependency_step:
+        settings.model["dependency_step"] = True
+    if args.content_hash or env.get("CASUAL_MAKE_CONTENT_HASH"):
+        settings.model["content_hash"] = True
+    if args.rebuild_on_command_change or env.get("CASUAL_MAKE_REBUILD_ON_COMMAND_CHANGE"):
+        settings.model["rebuild_on_command_change"] = True
+    if args.rerun_tests:
+        settings.model["rerun_tests"] = True
+    if args.unity or env.get("CASUAL_MAKE_UNITY"):
+        settings.model["unity"] = True
+    if args.jobs is not None:
+        if args.jobs < 1:
+            raise SystemError("the number of jobs has to be at least 1")
+        settings.model["jobs"] = args.jobs
+    if args.max_load is not None:
+        settings.model["max_load"] = args.max_load
 
     if not env.get("CASUAL_MAKE_SOURCE_ROOT"):
         # setup environment
@@ -130,5 +188,8 @@ def environment(args):
     else:
         settings.model["source_root"] = env.get("CASUAL_MAKE_SOURCE_ROOT")
 
+    settings.model["cache_directory"] = env.get("CASUAL_MAKE_CACHE_DIRECTORY") or \
+        os.path.join(settings.source_root(), ".casual-make")
+
     # serialize to setting to environment variable to be able to use spawn
     settings.serialize()
\ No newline at end of file
@@ -1,5 +1,9 @@
+import copy
 import os
 
+import casual.make.entity.cache as cache
+import casual.make.tools.filesystem as filesystem
+
 targetid = 0
 
 def nextid():
@@ -21,7 +25,9 @@ class Target(object):
         self._name = name
         self._makefile = None
         self._execute = False
+        self._requested = False
         self._serial = False
+        self._pools = []
         self._dependency = []
         self._recipe = []
         self._max = None
@@ -41,13 +47,9 @@ class Target(object):
                 self._filename = filename
 
         if self._filename:
-            if os.path.exists(self._filename):
-                self._timestamp = os.path.getmtime(self._filename)
-            else:
-                self._timestamp = 0
+            self._timestamp = filesystem.cache.timestamp(self._filename)
+            if not self._timestamp:
                 self._execute = True
-        else:
-            self._timestamp = 0
 
         self.hash = hash((self._name, self._filename, self._makefile))
 
@@ -122,10 +124,22 @@ class Target(object):
     def __hash__(self):
         return self.hash
 
+    def reference(self):
+        """
+        A copy without dependencies and recipes, cheap to send to another process
+        """
+        reference = copy.copy(self)
+        reference._dependency = []
+        reference._recipe = []
+        return reference
+
     def add_dependency(self, target):
         if not target:
             return self
 
+        if cache.journal:
+            cache.journal.dependency(self, target)
+
         if isinstance(target, list):
             self._dependency.extend(target)
         else:
@@ -133,10 +147,27 @@ class Target(object):
 
         return self
 
+    def remove_dependency(self, targets):
+        """
+        Removes the targets from the dependencies, e.g. objects compiled in a unity batch instead, see api.unity
+        """
+        if not targets:
+            return self
+
+        if cache.journal:
+            cache.journal.remove(self, targets)
+
+        removed = set(targets)
+        self._dependency = [dependency for dependency in self._dependency if dependency not in removed]
+        return self
+
     def add_recipe(self, recipe):
         if not recipe:
             return self
 
+        if cache.journal:
+            cache.journal.recipe(self, recipe)
+
         if isinstance(recipe, list):
             self._recipe.extend(recipe)
         else:
@@ -151,12 +182,44 @@ class Target(object):
         if not execute:
             return self._execute
 
+        if cache.journal:
+            cache.journal.execute(self, execute)
+
         self._execute = execute
+        self._requested = execute
         return self
 
+    def refresh(self):
+        """
+        The file has changed, only needed for a model that is kept between builds, see tools/daemon.py
+        """
+        if not self._filename:
+            return
+        self._timestamp = filesystem.cache.timestamp(self._filename)
+        self._execute = self._requested or not self._timestamp
+
     def serial(self, serial=None):
         if not serial:
             return self._serial
 
+        if cache.journal:
+            cache.journal.serial(self, serial)
+
         self._serial = serial
         return self
+
+    def pools(self, pools=None):
+        """
+        The pools the target holds a slot of while it's built, see api.Pool
+        """
+        if not pools:
+            return self._pools
+
+        if not isinstance(pools, list):
+            pools = [pools]
+
+        if cache.journal:
+            cache.journal.pools(self, pools)
+
+        self._pools = pools
+        return self
@@ -1,6 +1,7 @@
 import platform
 
 import casual.make.entity.target as target
+import casual.make.tools.artifact as artifact
 import casual.make.tools.environment as environment
 
 import os
@@ -20,6 +21,14 @@ def add_item_to_list(items, item):
     return new_list
 
 
+def dependency_directive(dependency_file):
+    """
+    The compiler writes the dependency file while compiling. With the artifact cache the system
+    headers are listed as well, the cache key of a compile covers the headers in it.
+    """
+    return ['-MD' if artifact.enabled() else '-MMD', '-MF', dependency_file]
+
+
 def verify_type(name):
     if not isinstance(name, str):
         raise SystemError("Can't call this method with " + str(type(name)))
@@ -27,6 +27,11 @@ def compose_paths(*args):
 
 build_configuration = selector.build_configuration()
 
+#
+# the header dependencies are written while compiling
+#
+COMPILE_GENERATES_DEPENDENCIES = True
+
 
 LIBRARY_PATH_OPTION = "-Wl,-rpath-link="
 
@@ -75,39 +80,71 @@ def normalize_paths(paths):
         raise SystemError("Error normlizing path: ", paths)
 
 
-def execute_compile(source, destination, context_directory, paths, directive):
+def compile_command(source, destination, paths, directive, dependency_file=None):
 
     cmd = build_configuration['compiler'] + build_configuration['compile_directives'] + [
         '-o', destination.filename(), source.filename()] + common.add_item_to_list(escape_space(paths), '-I')
+    if dependency_file:
+        cmd += common.dependency_directive(dependency_file)
+    return cmd
+
+
+def execute_compile(source, destination, context_directory, paths, directive, dependency_file=None):
+
+    cmd = compile_command(source, destination, paths, directive, dependency_file)
     executor.command(cmd, destination, context_directory)
 
 
-def execute_dependency_generation(source, destination, context_directory, paths, dependency_file):
+def dependency_generation_command(source, destination, paths, dependency_file):
 
     cmd = build_configuration['header_dependency_command'] + [source.filename(
     )] + common.add_item_to_list(escape_space(paths), '-I') + ['-MF', dependency_file]
+    return cmd
+
+
+def execute_dependency_generation(source, destination, context_directory, paths, dependency_file):
+
+    cmd = dependency_generation_command(source, destination, paths, dependency_file)
     executor.command(cmd, destination, context_directory,
                      show_command=True, show_output=False)
 
 
-def execute_link_library(destination, context_directory, objects, library_paths, libraries):
+def link_library_command(destination, objects, library_paths, libraries):
 
     cmd = build_configuration['library_linker'] + build_configuration['link_directives_lib'] + ['-o', destination.filename(
     )] + objects + library_paths_directive(escape_space(library_paths)) + common.add_item_to_list(libraries, '-l')
+    return cmd
+
+
+def execute_link_library(destination, context_directory, objects, library_paths, libraries):
+
+    cmd = link_library_command(destination, objects, library_paths, libraries)
     executor.command(cmd, destination, context_directory)
 
 
-def execute_link_executable(destination, context_directory, objects, library_paths, libraries):
+def link_executable_command(destination, objects, library_paths, libraries):
 
     cmd = build_configuration['executable_linker'] + build_configuration['link_directives_exe'] + ['-o', destination.filename(
     )] + objects + library_paths_directive(escape_space(library_paths)) + common.add_item_to_list(libraries, '-l')
+    return cmd
+
+
+def execute_link_executable(destination, context_directory, objects, library_paths, libraries):
+
+    cmd = link_executable_command(destination, objects, library_paths, libraries)
     executor.command(cmd, destination, context_directory)
 
 
-def execute_link_archive(destination, context_directory, objects):
+def link_archive_command(destination, objects):
 
     cmd = build_configuration['archive_linker'] + \
         [destination.filename()] + objects
+    return cmd
+
+
+def execute_link_archive(destination, context_directory, objects):
+
+    cmd = link_archive_command(destination, objects)
     executor.command(cmd, destination, context_directory)
 
 
@@ -0,0 +1,136 @@
+"""
+Worker agent, executes compiles shipped by casual-make, see tools/distribute.py.
+It executes any command it's given, only run it on a trusted network.
+
+    python3 -m casual.make.tools.agent --port 8090 --slots 8
+"""
+import argparse
+import http.server
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+import casual.make.tools.remote as remote
+from casual.make.tools.artifact import PLACEHOLDER
+
+
+def localize(value, root):
+    return value.replace(PLACEHOLDER + '/', root + '/')
+
+
+def inside(path, sandbox):
+    """
+    returns the path if it's in the sandbox, raises ValueError otherwise
+    """
+    if not os.path.abspath(path).startswith(sandbox + '/'):
+        raise ValueError('path outside the sandbox: ' + path)
+    return path
+
+
+def execute(request):
+    """
+    Executes the command of the request in a sandbox, with the files of the request.
+    Paths in the source root of the client are rewritten into the sandbox.
+    Returns the reply, the status and the outputs.
+    """
+    description = json.loads(request.pop('.command')[1])
+    sandbox = tempfile.mkdtemp(prefix='casual-make-agent-')
+    try:
+        for name, (mode, content) in request.items():
+            path = inside(localize(name, sandbox), sandbox)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file:
+                file.write(content)
+            os.chmod(path, mode)
+
+        outputs = {name: inside(localize(path, sandbox), sandbox) for name, path in description['outputs'].items()}
+        for path in outputs.values():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        directory = localize(description['directory'], sandbox)
+        os.makedirs(directory, exist_ok=True)
+        command = [localize(argument, sandbox) for argument in description['command']]
+        try:
+            process = subprocess.run(command, cwd=directory, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            status = {'code': process.returncode,
+                      'stderr': process.stderr.decode(errors='replace').replace(sandbox + '/', PLACEHOLDER + '/')}
+        except OSError as ex:
+            status = {'code': 127, 'stderr': str(ex)}
+
+        reply = {'.status': (0, json.dumps(status).encode())}
+        if status['code'] == 0:
+            for name, path in outputs.items():
+                with open(path, 'rb') as file:
+                    content = file.read()
+                if name == 'dependency':
+                    content = content.replace(sandbox.encode() + b'/', PLACEHOLDER.encode() + b'/')
+                reply[name] = (os.stat(path).st_mode & 0o777, content)
+        return reply
+    finally:
+        shutil.rmtree(sandbox, ignore_errors=True)
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """
+    GET /capacity replies with the number of slots, POST /execute executes a request
+    """
+
+    # set by server()
+    slots = None
+    semaphore = None
+
+    def reply(self, content, type='application/octet-stream'):
+        self.send_response(200)
+        self.send_header('Content-Type', type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        if self.path != '/capacity':
+            self.send_error(404)
+            return
+        self.reply(json.dumps({'slots': self.slots}).encode(), 'application/json')
+
+    def do_POST(self):
+        if self.path != '/execute':
+            self.send_error(404)
+            return
+        request = remote.unpack(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        try:
+            with self.semaphore:
+                reply = execute(request)
+        except (KeyError, ValueError) as ex:
+            self.send_error(400, str(ex))
+            return
+        self.reply(remote.pack(reply))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def server(slots, host='localhost', port=0):
+    """
+    Returns the server, port 0 picks a free port, see server.server_port
+    """
+    handler = type('Handler', (Handler,), {'slots': slots, 'semaphore': threading.Semaphore(slots)})
+    return http.server.ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='casual-make worker agent')
+    parser.add_argument('--host', help='address to listen on', default='localhost')
+    parser.add_argument('--port', help='port to listen on', type=int, default=8090)
+    parser.add_argument('--slots', help='number of concurrent compiles', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    instance = server(args.slots, args.host, args.port)
+    print('serving ' + str(args.slots) + ' slots on port ' + str(instance.server_port))
+    instance.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,451 @@
+import concurrent.futures
+import fcntl
+import hashlib
+import os
+import shutil
+import stat
+import subprocess
+import tempfile
+
+import casual.make.entity.state as state
+import casual.make.tools.database as database
+import casual.make.tools.dependency as dependency
+import casual.make.tools.environment as environment
+import casual.make.tools.executor as executor
+import casual.make.tools.output as output
+import casual.make.tools.remote as remote
+
+# the store is trimmed to this share of its size, so it isn't trimmed for each output
+TRIMMED = 0.9
+
+UNITS = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+# replaces the source root in keys and dependency files
+PLACEHOLDER = '$CASUAL_MAKE_SOURCE_ROOT'
+
+
+def size(value):
+    """
+    Parse a size, e.g. 500M or 5G
+    """
+    value = value.strip().upper()
+    if value and value[-1] in UNITS:
+        return int(float(value[:-1]) * UNITS[value[-1]])
+    return int(value)
+
+
+def portable(value):
+    """
+    The value, str or bytes, with the source root replaced. Keys and stored
+    dependency files are the same in every checkout.
+    """
+    root = state.settings.source_root()
+    if not root:
+        return value
+    if isinstance(value, bytes):
+        return value.replace(root.encode() + b'/', PLACEHOLDER.encode() + b'/')
+    return value.replace(root + '/', PLACEHOLDER + '/')
+
+
+def localize(value):
+    """
+    The value, bytes, with the source root of this checkout
+    """
+    root = state.settings.source_root()
+    if not root:
+        return value
+    return value.replace(PLACEHOLDER.encode() + b'/', root.encode() + b'/')
+
+
+def transfer(source, destination, name, convert):
+    """
+    Copies the file, the content of a dependency file is converted
+    """
+    if name == 'dependency':
+        with open(source, 'rb') as file:
+            content = convert(file.read())
+        with open(destination, 'wb') as file:
+            file.write(content)
+    else:
+        shutil.copy(source, destination)
+
+
+class Store(object):
+    """
+    Content addressed store of build outputs, the least recently used
+    entries are evicted when the store exceeds its size. The size of the
+    store is kept in a ledger, the entries are only scanned to trim it.
+    """
+
+    def __init__(self, directory, size):
+        self.m_directory = directory
+        self.m_size = size
+        self.m_ledger = os.path.join(directory, 'ledger')
+
+    def path(self, key):
+        return os.path.join(self.m_directory, key[:2], key)
+
+    def get(self, key, outputs):
+        """
+        Restores the outputs, name to path, stored under the key.
+        Returns the number of bytes restored, None if not stored
+        """
+        entry = self.path(key)
+        restored = 0
+        try:
+            for name, path in outputs.items():
+                executor.create_directory(os.path.dirname(path))
+                temporary = path + '.' + str(os.getpid())
+                transfer(os.path.join(entry, name), temporary, name, localize)
+                os.replace(temporary, path)
+                restored += os.path.getsize(path)
+            os.utime(entry)
+        except FileNotFoundError:
+            return None
+        return restored
+
+    def put(self, key, outputs):
+        """
+        Stores the outputs, name to path, under the key. Returns True if stored, False if already known
+        """
+        return self.__store(key, lambda name, path: transfer(outputs[name], path, name, portable), outputs)
+
+    def insert(self, key, files):
+        """
+        Stores the files, name to (mode, content), under the key
+        """
+        def write(name, path):
+            mode, content = files[name]
+            with open(path, 'wb') as file:
+                file.write(content)
+            os.chmod(path, mode)
+
+        return self.__store(key, write, files)
+
+    def files(self, key):
+        """
+        The files, name to (mode, content), stored under the key
+        """
+        entry = self.path(key)
+        files = {}
+        for name in os.listdir(entry):
+            path = os.path.join(entry, name)
+            with open(path, 'rb') as file:
+                files[name] = (stat.S_IMODE(os.stat(path).st_mode), file.read())
+        return files
+
+    def __store(self, key, write, names):
+        entry = self.path(key)
+        if os.path.isdir(entry):
+            os.utime(entry)
+            return False
+
+        bucket = os.path.dirname(entry)
+        os.makedirs(bucket, exist_ok=True)
+        temporary = tempfile.mkdtemp(prefix='.', dir=bucket)
+        try:
+            for name in names:
+                write(name, os.path.join(temporary, name))
+            used = sum(item.stat().st_size for item in os.scandir(temporary))
+            os.rename(temporary, entry)
+        except OSError:
+            # missing output, or stored by someone else meanwhile
+            shutil.rmtree(temporary, ignore_errors=True)
+            return False
+
+        self.__account(used)
+        return True
+
+    def __account(self, used):
+        """
+        Adds the bytes to the ledger, and trims the store if it exceeds its size
+        """
+        with open(os.open(self.m_ledger, os.O_RDWR | os.O_CREAT), 'r+') as ledger:
+            fcntl.flock(ledger, fcntl.LOCK_EX)
+            content = ledger.read()
+            # a store without a ledger is scanned once
+            total = int(content) + used if content else self.usage()[0]
+            if total > self.m_size:
+                total = self.trim()
+            ledger.seek(0)
+            ledger.truncate()
+            ledger.write(str(total))
+
+    def usage(self):
+        """
+        Scans the store, returns the total size and the entries, (modified, size, path)
+        """
+        entries = []
+        total = 0
+        with os.scandir(self.m_directory) as buckets:
+            for bucket in buckets:
+                if not bucket.is_dir():
+                    continue
+                with os.scandir(bucket.path) as iterator:
+                    for entry in iterator:
+                        if entry.name.startswith('.'):
+                            continue
+                        used = sum(item.stat().st_size for item in os.scandir(entry.path))
+                        entries.append((entry.stat().st_mtime_ns, used, entry.path))
+                        total += used
+        return total, entries
+
+    def trim(self):
+        """
+        Evicts the least recently used entries, returns the size of the store
+        """
+        total, entries = self.usage()
+        entries.sort()
+        for dummy, used, path in entries:
+            if total <= self.m_size * TRIMMED:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= used
+        return total
+
+
+# counters of the current process, see take()
+statistics = {'hits': 0, 'remote': 0, 'misses': 0, 'bytes': 0}
+
+
+def take():
+    """
+    Returns and resets the counters, workers hand them over to the parent
+    """
+    global statistics
+    result = statistics
+    statistics = {'hits': 0, 'remote': 0, 'misses': 0, 'bytes': 0}
+    return result
+
+
+def add(counters):
+    for name, value in counters.items():
+        statistics[name] += value
+
+
+def used():
+    return statistics['hits'] + statistics['misses'] > 0
+
+
+def report():
+    hits = str(statistics['hits']) + ' hits'
+    if remote.enabled():
+        hits += ' (' + str(statistics['remote']) + ' remote)'
+    return 'artifact cache: {}, {} misses, {:.1f} MB restored'.format(
+        hits, statistics['misses'], statistics['bytes'] / (1 << 20))
+
+
+# instance of the store, see instance()
+current = None
+
+
+def enabled():
+    return bool(environment.get('CASUAL_MAKE_ARTIFACT_CACHE') or remote.enabled()) and not state.settings.dry_run()
+
+
+def instance():
+    global current
+    if not current:
+        # with only a remote cache, the local store is kept in the cache directory
+        directory = environment.get('CASUAL_MAKE_ARTIFACT_CACHE') or state.cache_path('artifacts')
+        current = Store(directory, size(environment.get('CASUAL_MAKE_ARTIFACT_CACHE_SIZE', '5G')))
+    return current
+
+
+# digests of files in the current process, path to (identity, digest)
+digests = {}
+
+
+def digest(path):
+    """
+    Digest of the content of the file, None if it doesn't exist
+    """
+    try:
+        result = os.stat(path)
+    except OSError:
+        return None
+
+    identity = (result.st_mtime_ns, result.st_size, result.st_ino)
+    known = digests.get(path)
+    if known and known[0] == identity:
+        return known[1]
+
+    value = database.digest(path)
+    digests[path] = (identity, value)
+    return value
+
+
+def program(name):
+    """
+    Identity of the program, the compiler or linker, by its path, size and modification time
+    """
+    path = shutil.which(name)
+    if not path:
+        return name
+    result = os.stat(path)
+    return '{}:{}:{}'.format(path, result.st_size, result.st_mtime_ns)
+
+
+def base(kind, command, directory):
+    hasher = hashlib.sha256()
+    hasher.update(portable('{}\0{}\0{}\0{}/\n'.format(kind, program(command[0]), repr(command), directory)).encode())
+    return hasher
+
+
+def direct(hasher, source, dependency_file, directory):
+    """
+    Key from the digests of the source and the headers in the dependency file, None if not known
+    """
+    if not os.path.exists(dependency_file):
+        return None
+    hasher = hasher.copy()
+    for path in [source] + dependency.parse(dependency_file, directory):
+        value = digest(path)
+        if value is None:
+            return None
+        hasher.update(portable(path + '\0' + value + '\n').encode())
+    return hasher.hexdigest()
+
+
+def preprocess(command):
+    """
+    The compile command turned into a preprocessor run to stdout
+    """
+    result = []
+    arguments = iter(command)
+    for argument in arguments:
+        if argument in ['-o', '-MF']:
+            next(arguments, None)
+        elif argument not in ['-c', '-MMD', '-MD']:
+            result.append(argument)
+    return result + ['-E']
+
+
+def preprocessed(hasher, command, directory):
+    """
+    Key from the preprocessed source, None if the preprocessor fails
+    """
+    try:
+        reply = subprocess.run(preprocess(command), cwd=directory, stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    hasher = hasher.copy()
+    hasher.update(portable(reply.stdout))
+    return hasher.hexdigest()
+
+
+def restore(key, outputs, name):
+    restored = instance().get(key, outputs)
+    if restored is None and remote.enabled():
+        files = remote.instance().get(key)
+        if files and set(files) == set(outputs):
+            instance().insert(key, files)
+            restored = instance().get(key, outputs)
+            if restored is not None:
+                statistics['remote'] += 1
+    if restored is None:
+        return False
+    statistics['hits'] += 1
+    statistics['bytes'] += restored
+    if not state.settings.quiet():
+        output.print('cached ' + name, end='')
+    return True
+
+
+def store(key, outputs):
+    """
+    Stores the outputs in the local store, and uploads them to the remote cache
+    """
+    if instance().put(key, outputs) and remote.enabled():
+        remote.instance().put(key, instance().files(key))
+
+
+# fetches in progress, see prefetch()
+fetches = []
+
+
+def prefetch(keys):
+    """
+    Fetches the entries not in the local store from the remote cache, in the background
+    """
+    if not remote.enabled():
+        return
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+
+    def fetch(key):
+        files = remote.instance().get(key)
+        if files:
+            instance().insert(key, files)
+
+    for key in keys:
+        if not os.path.isdir(instance().path(key)):
+            fetches.append(pool.submit(fetch, key))
+    pool.shutdown(wait=False)
+
+
+def flush():
+    """
+    Waits for the uploads in progress, fetches not yet started are dropped
+    """
+    global fetches
+    for fetch in fetches:
+        fetch.cancel()
+    concurrent.futures.wait(fetches)
+    fetches = []
+    if remote.current:
+        remote.current.flush()
+
+
+def compile(command, directory, source, objectfile, dependency_file, single_pass, execute):
+    """
+    Restores the object, and the dependency file if the compiler writes it, from the store
+    if an earlier compile had the same input. Otherwise compiles and stores them.
+
+    The headers in the dependency file gives a key without running the preprocessor, if the
+    compiler writes it with the system headers, see platform/common.py. Otherwise, or if they are
+    not known, the preprocessed source is used.
+    """
+    # the object is restored last, it depends on the dependency file
+    outputs = {}
+    if single_pass:
+        outputs['dependency'] = dependency_file
+    outputs['object'] = objectfile
+
+    hasher = base('compile', command, directory)
+
+    key = direct(hasher, source, dependency_file, directory) if single_pass else None
+    if key and restore(key, outputs, source):
+        return
+
+    key = preprocessed(hasher, command, directory)
+    if not key or not restore(key, outputs, source):
+        statistics['misses'] += 1
+        execute()
+        if key:
+            store(key, outputs)
+
+    # next time the headers are known
+    key = direct(hasher, source, dependency_file, directory) if single_pass else None
+    if key:
+        store(key, outputs)
+
+
+def link(command, directory, inputs, destination, execute):
+    """
+    Restores the linked file from the store if an earlier link had the same input.
+    Otherwise links and stores it.
+    """
+    outputs = {'output': destination}
+
+    hasher = base('link', command, directory)
+    for path in inputs:
+        hasher.update(portable(path + '\0' + str(digest(path)) + '\n').encode())
+    key = hasher.hexdigest()
+
+    if restore(key, outputs, destination):
+        return
+
+    statistics['misses'] += 1
+    execute()
+    store(key, outputs)
@@ -0,0 +1,89 @@
+"""
+Reference server of the remote artifact cache, see tools/remote.py
+
+    python3 -m casual.make.tools.cacheserver --directory /var/cache/casual-make --port 8080
+"""
+import argparse
+import http.server
+import os
+import re
+import tempfile
+
+KEY = re.compile(r'^/([0-9a-f]{16,128})$')
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """
+    GET /<key> replies with the entry, PUT /<key> stores it
+    """
+
+    # set by serve()
+    directory = None
+
+    def path_of(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def key(self):
+        match = KEY.match(self.path)
+        if not match:
+            self.send_error(400, 'unknown key')
+            return None
+        return match.group(1)
+
+    def do_GET(self):
+        key = self.key()
+        if not key:
+            return
+        try:
+            with open(self.path_of(key), 'rb') as file:
+                content = file.read()
+        except FileNotFoundError:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_PUT(self):
+        key = self.key()
+        if not key:
+            return
+        content = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        path = self.path_of(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(content)
+        os.replace(temporary, path)
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def server(directory, host='localhost', port=0):
+    """
+    Returns the server, port 0 picks a free port, see server.server_port
+    """
+    handler = type('Handler', (Handler,), {'directory': os.path.abspath(directory)})
+    return http.server.ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='casual-make remote artifact cache')
+    parser.add_argument('--directory', help='where entries are stored', required=True)
+    parser.add_argument('--host', help='address to listen on', default='localhost')
+    parser.add_argument('--port', help='port to listen on', type=int, default=8080)
+    args = parser.parse_args()
+
+    instance = server(args.directory, args.host, args.port)
+    print('serving ' + args.directory + ' on port ' + str(instance.server_port))
+    instance.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,563 @@
+"""
+Resident build server, keeps the evaluated model between builds. Files are watched,
+only the targets of changed files are updated before a build. Each build is handled
+by a forked process, with the output to the terminal of the client.
+
+    casual-make --server
+    casual-make --client [target] [options]
+
+The same model is used to build each time a file changes.
+
+    casual-make --watch [target] [options]
+"""
+import hashlib
+import json
+import os
+import selectors
+import signal
+import socket
+import struct
+import sys
+import tempfile
+import time
+import traceback
+
+import casual
+import casual.make.entity.cache as cache
+import casual.make.entity.state as state
+import casual.make.tools.environment as environment
+import casual.make.tools.output as output
+
+LENGTH = struct.Struct('<I')
+
+# attempts to reach a server that is reloading its model
+ATTEMPTS = 3
+
+
+def socket_path():
+    """
+    The socket of the server of the current directory
+    """
+    name = 'server-' + hashlib.sha1(os.getcwd().encode()).hexdigest()[:16] + '.socket'
+    path = state.cache_path(name)
+    if len(path) < 100:
+        return path
+
+    # too long for a unix socket
+    directory = os.path.join(tempfile.gettempdir(), 'casual-make-' + str(os.getuid()))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    return os.path.join(directory, hashlib.sha1(path.encode()).hexdigest()[:16] + '.socket')
+
+
+def key():
+    """
+    The model of a server is only used by clients with the same environment and settings
+    """
+    hashed = hashlib.sha256()
+    hashed.update(casual.__version__.encode())
+    hashed.update(os.getcwd().encode())
+    cache.configuration(hashed)
+    return hashed.hexdigest()
+
+
+def receive(connection, size):
+    content = b''
+    while len(content) < size:
+        chunk = connection.recv(size - len(content))
+        if not chunk:
+            raise ConnectionError('connection closed')
+        content += chunk
+    return content
+
+
+def forward(arguments):
+    """
+    Lets the server build, with our standard streams and environment. Returns the exit status,
+    None if there is no server for the current directory and we have to build ourselves
+    """
+    if not hasattr(socket, 'send_fds'):
+        return None
+
+    request = json.dumps({
+        'key': key(),
+        'arguments': arguments,
+        'environment': dict(os.environ)}).encode()
+
+    path = socket_path()
+    for dummy in range(ATTEMPTS):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            try:
+                connection.connect(path)
+            except (FileNotFoundError, ConnectionRefusedError):
+                return None
+
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                socket.send_fds(connection, [LENGTH.pack(len(request))], [0, 1, 2])
+                connection.sendall(request)
+
+                reply = b''
+                while True:
+                    chunk = connection.recv(4096)
+                    if not chunk:
+                        break
+                    reply += chunk
+            except KeyboardInterrupt:
+                raise SystemError("\naborted due to ctrl-c\n")
+            except ConnectionError:
+                reply = b''
+
+        if not reply:
+            # the server is reloading its model
+            continue
+
+        reply = json.loads(reply)
+        if reply['status'] is None:
+            if state.settings.verbose():
+                output.error('server not used: ' + reply['reason'])
+            return None
+        return reply['status']
+
+    return None
+
+
+class Server(object):
+    """
+    Keeps the model of the makefile in the current directory, and builds it on request
+    """
+
+    def __init__(self, make):
+        # Need to import this after argparse
+        import casual.make.entity.model as model
+        import casual.make.entity.recipe as recipe
+        import casual.make.tools.filesystem as filesystem
+        import casual.make.tools.watch as watch
+
+        self.m_make = make
+        self.m_inherited = os.environ.pop('CASUAL_MAKE_SERVER_FD', None)
+        self.m_initial = dict(os.environ)
+        self.m_key = key()
+
+        output.print("building model: ", end="")
+        model.build()
+        output.print("done")
+
+        # set by the makefiles, see api.Environment
+        self.m_environment = {variable: value for variable, value in os.environ.items()
+                              if self.m_initial.get(variable) != value}
+
+        self.m_watcher = watch.create()
+        self.m_files = {}
+        self.m_directories = {}
+        self.m_pending = set()
+        self.m_reload = False
+
+        # modification times as of the model, a changed makefile reloads the model
+        self.m_makefiles = {path: filesystem.cache.timestamp(path) for path in model.evaluated}
+
+        # the compiles, by dependency file, the headers are updated when it changes
+        self.m_compiles = {}
+
+        for targets in model.store.target_cache().values():
+            for target in targets.values():
+                self.__add(target)
+                for item in target.recipe():
+                    if item.function in [recipe.compile, recipe.precompile]:
+                        arguments = item.arguments()
+                        path = os.path.join(os.path.dirname(arguments['destination'].makefile()),
+                                            arguments['dependencyfile'])
+                        self.m_compiles[path] = [target, arguments, filesystem.cache.timestamp(path)]
+
+    def __add(self, target):
+        path = target.filename()
+        if not path:
+            return
+        targets = self.m_files.setdefault(path, [])
+        if target not in targets:
+            targets.append(target)
+
+        directory = os.path.dirname(path)
+        if directory not in self.m_directories:
+            self.m_directories[directory] = set()
+            if not self.m_watcher or not self.m_watcher.watch(directory):
+                self.m_pending.add(directory)
+        self.m_directories[directory].add(path)
+
+    def __includes(self, dependency_file):
+        """
+        The dependency file has changed, the object depends on the headers in it
+        """
+        import casual.make.api as api
+
+        target, arguments, dummy = self.m_compiles[dependency_file]
+        # the dependency file and the precompiled header are not in the dependency file
+        dependency_target = [item for item in target.dependency() if item.filename() == dependency_file or
+                             item is arguments.get('precompiled_header')]
+
+        headers = api.includes(dependency_file, target.makefile())
+        for header in headers:
+            self.__add(header)
+        target.dependency((headers if headers else [arguments['source']]) + dependency_target)
+
+    def changed(self, paths):
+        """
+        Updates the targets of the paths. Returns True if an input, a file not written
+        by a build, has changed
+        """
+        import casual.make.tools.filesystem as filesystem
+
+        for path in paths:
+            filesystem.cache.invalidate(path)
+            if path in self.m_directories:
+                # created, removed or replaced
+                if self.m_watcher and not self.m_watcher.watched(path):
+                    self.m_pending.add(path)
+                for item in self.m_directories[path]:
+                    filesystem.cache.invalidate(item)
+
+        affected = False
+        for path in paths:
+            for item in [path] + list(self.m_directories.get(path, [])):
+                targets = self.m_files.get(item, [])
+                input = not any(target.has_recipes() for target in targets) and item not in self.m_compiles
+                for target in targets:
+                    timestamp = target.timestamp()
+                    target.refresh()
+                    if input and target.timestamp() != timestamp:
+                        affected = True
+                if item in self.m_makefiles and filesystem.cache.timestamp(item) != self.m_makefiles[item]:
+                    self.m_reload = True
+                    affected = True
+                compile = self.m_compiles.get(item)
+                if compile and filesystem.cache.timestamp(item) != compile[2]:
+                    compile[2] = filesystem.cache.timestamp(item)
+                    self.__includes(item)
+        return affected
+
+    def refresh(self):
+        """
+        Updates the model with the changes of the files, before a build.
+        Returns True if an input has changed
+        """
+        import casual.make.tools.filesystem as filesystem
+        import casual.make.tools.watch as watch
+
+        if not self.m_watcher:
+            # polled, every file is checked
+            filesystem.cache = filesystem.Cache()
+            return self.changed(list(self.m_directories))
+
+        try:
+            affected = self.changed(self.m_watcher.changes())
+        except watch.Overflow:
+            filesystem.cache = filesystem.Cache()
+            affected = self.changed(list(self.m_directories))
+
+        # directories that didn't exist, or can't be watched, are checked each time
+        pending = list(self.m_pending)
+        for directory in pending:
+            if self.m_watcher.watch(directory):
+                self.m_pending.discard(directory)
+        return self.changed(pending) or affected
+
+    def __listen(self):
+        if self.m_inherited:
+            # reloaded, the clients are waiting on the socket
+            return socket.socket(fileno=int(self.m_inherited))
+
+        path = socket_path()
+        if os.path.exists(path):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                try:
+                    probe.connect(path)
+                    raise SystemError('a server is already running in ' + os.getcwd())
+                except ConnectionRefusedError:
+                    os.unlink(path)
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        # builds run with our privileges
+        os.chmod(path, 0o600)
+        listener.listen(16)
+        return listener
+
+    def __reload(self, listener=None):
+        output.print('makefile changed, reloading the model')
+        initial = dict(self.m_initial)
+        if listener:
+            listener.set_inheritable(True)
+            initial['CASUAL_MAKE_SERVER_FD'] = str(listener.fileno())
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.execve(sys.executable, [sys.executable] + sys.argv, initial)
+
+    def __request(self, connection):
+        """
+        Returns the request and the standard streams of the client
+        """
+        connection.settimeout(5)
+        header, descriptors, dummy, dummy = socket.recv_fds(connection, LENGTH.size, 3)
+        try:
+            if len(descriptors) != 3:
+                raise ValueError('expected the standard streams')
+            header += receive(connection, LENGTH.size - len(header))
+            request = json.loads(receive(connection, LENGTH.unpack(header)[0]))
+        except (ValueError, OSError):
+            for descriptor in descriptors:
+                os.close(descriptor)
+            raise
+        connection.settimeout(None)
+        return request, descriptors
+
+    def __signals(self, selector):
+        """
+        A child that exits wakes up the selector, returns the pipe
+        """
+        wakeup, notify = os.pipe()
+        os.set_blocking(wakeup, False)
+        os.set_blocking(notify, False)
+        signal.set_wakeup_fd(notify)
+        signal.signal(signal.SIGCHLD, lambda number, frame: None)
+        signal.signal(signal.SIGTERM, lambda number, frame: sys.exit(0))
+        selector.register(wakeup, selectors.EVENT_READ, 'signal')
+        return wakeup, notify
+
+    def __reap(self, wakeup, pid):
+        """
+        Returns the exit status of the child, None if it's still running
+        """
+        try:
+            while os.read(wakeup, 512):
+                pass
+        except BlockingIOError:
+            pass
+        done, status = os.waitpid(pid, os.WNOHANG)
+        if not done:
+            return None
+        status = os.waitstatus_to_exitcode(status)
+        # killed by a signal, as a shell reports it
+        return status if status >= 0 else 128 - status
+
+    def __fork(self, arguments, environment, descriptors, closing):
+        """
+        Builds in a forked process, in a process group of its own. Returns the pid
+        """
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            self.__child(arguments, environment, descriptors, closing)
+        for descriptor in descriptors:
+            os.close(descriptor)
+        try:
+            os.setpgid(pid, pid)
+        except OSError:
+            # already done by the child
+            pass
+        return pid
+
+    def __child(self, arguments, environment, descriptors, closing):
+        """
+        The forked process that builds, with the standard streams and the environment of the client
+        """
+        import multiprocessing
+        import casual.make.entity.cli as cli
+        import casual.make.tools.color as color
+        import casual.make.tools.filesystem as filesystem
+
+        status = 1
+        try:
+            signal.set_wakeup_fd(-1)
+            for number in [signal.SIGCHLD, signal.SIGTERM]:
+                signal.signal(number, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            for item in closing:
+                if isinstance(item, int):
+                    os.close(item)
+                elif item:
+                    item.close()
+
+            os.setpgid(0, 0)
+            for index, descriptor in enumerate(descriptors):
+                os.dup2(descriptor, index)
+                os.close(descriptor)
+
+            if environment is not None:
+                os.environ.clear()
+                os.environ.update(environment)
+                os.environ.update(self.m_environment)
+                state.settings.deserialize()
+                color.color.active(not state.settings.no_colors())
+            filesystem.cache.forked()
+
+            output.print("building model: ", end="")
+            self.m_make(cli.handle_arguments(arguments))
+            status = 0
+        except SystemError as exception:
+            print(exception)
+        except SystemExit as exception:
+            status = exception.code if isinstance(exception.code, int) else 1
+        except KeyboardInterrupt:
+            pass
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            for process in multiprocessing.active_children():
+                process.terminate()
+                process.join()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+
+    def serve(self):
+        import casual.make.tools.dependency as dependency
+
+        listener = self.__listen()
+        selector = selectors.DefaultSelector()
+        selector.register(listener, selectors.EVENT_READ, 'listener')
+        if self.m_watcher:
+            selector.register(self.m_watcher, selectors.EVENT_READ, 'watcher')
+
+        wakeup, notify = self.__signals(selector)
+
+        # accepted clients, waiting in order, and the running child
+        waiting = []
+        running = None
+
+        def reply(connection, status, reason=None):
+            try:
+                connection.sendall(json.dumps({'status': status, 'reason': reason}).encode())
+            except OSError:
+                pass
+            try:
+                selector.unregister(connection)
+            except KeyError:
+                pass
+            connection.close()
+
+        def start():
+            nonlocal running
+            while waiting and not running:
+                connection, request, descriptors = waiting.pop(0)
+                if request['key'] != self.m_key:
+                    for descriptor in descriptors:
+                        os.close(descriptor)
+                    reply(connection, None, 'the environment or the settings differs from the server')
+                    continue
+
+                self.refresh()
+                if self.m_reload:
+                    self.__reload(listener)
+
+                closing = [listener, selector, self.m_watcher, wakeup, notify]
+                for item in waiting:
+                    closing += [item[0]] + item[2]
+                pid = self.__fork(request['arguments'], request['environment'], descriptors, closing)
+                running = (pid, connection)
+
+        output.print('serving ' + os.getcwd())
+        try:
+            while True:
+                for event, dummy in selector.select():
+                    if event.data == 'listener':
+                        connection, dummy = listener.accept()
+                        try:
+                            request, descriptors = self.__request(connection)
+                        except (ValueError, OSError, KeyError):
+                            connection.close()
+                            continue
+                        selector.register(connection, selectors.EVENT_READ, 'client')
+                        waiting.append((connection, request, descriptors))
+
+                    elif event.data == 'watcher':
+                        self.refresh()
+
+                    elif event.data == 'client':
+                        # the client is gone, e.g. ctrl-c
+                        connection = event.fileobj
+                        if running and running[1] is connection:
+                            selector.unregister(connection)
+                            os.killpg(running[0], signal.SIGTERM)
+                            continue
+                        for item in [item for item in waiting if item[0] is connection]:
+                            waiting.remove(item)
+                            for descriptor in item[2]:
+                                os.close(descriptor)
+                            reply(connection, None, 'client is gone')
+
+                    elif event.data == 'signal' and running:
+                        status = self.__reap(wakeup, running[0])
+                        if status is not None:
+                            reply(running[1], status)
+                            running = None
+                            dependency.instance().save()
+
+                start()
+                if self.m_reload and not running:
+                    self.__reload(listener)
+
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if running:
+                os.killpg(running[0], signal.SIGTERM)
+            selector.close()
+            listener.close()
+            try:
+                os.unlink(socket_path())
+            except FileNotFoundError:
+                pass
+
+    def watch(self, arguments):
+        """
+        Builds, and builds again when an input changes, until ctrl-c. A build that
+        is running when an input changes is cancelled.
+        """
+        import casual.make.tools.dependency as dependency
+
+        # quiet period after a change, a burst of saves gives one build
+        delay = float(environment.get('CASUAL_MAKE_WATCH_DELAY', '0.2'))
+
+        selector = selectors.DefaultSelector()
+        if self.m_watcher:
+            selector.register(self.m_watcher, selectors.EVENT_READ, 'watcher')
+        wakeup, notify = self.__signals(selector)
+
+        running = None
+        due = time.monotonic()
+        try:
+            while True:
+                if due is not None and time.monotonic() >= due and not running:
+                    due = None
+                    self.refresh()
+                    if self.m_reload:
+                        self.__reload()
+                    running = self.__fork(arguments, None, [], [selector, self.m_watcher, wakeup, notify])
+
+                timeout = None if due is None else max(due - time.monotonic(), 0)
+                if not self.m_watcher:
+                    # polled
+                    timeout = 1.0 if timeout is None else min(timeout, 1.0)
+
+                events = selector.select(timeout)
+                if not self.m_watcher or any(event.data == 'watcher' for event, dummy in events):
+                    if self.refresh():
+                        due = time.monotonic() + delay
+                        if running:
+                            output.print('changed, cancelling the build')
+                            os.killpg(running, signal.SIGTERM)
+
+                if running and any(event.data == 'signal' for event, dummy in events):
+                    if self.__reap(wakeup, running) is not None:
+                        running = None
+                        dependency.instance().save()
+                        if due is None:
+                            output.print('watching for changes')
+
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if running:
+                os.killpg(running, signal.SIGTERM)
+            selector.close()
@@ -0,0 +1,159 @@
+import hashlib
+import sqlite3
+import stat
+
+import casual.make.entity.state as state
+import casual.make.tools.filesystem as filesystem
+from casual.make.tools.history import key
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS file (path TEXT PRIMARY KEY, timestamp INTEGER, size INTEGER, inode INTEGER, digest TEXT)',
+    'CREATE TABLE IF NOT EXISTS build (target TEXT PRIMARY KEY, inputs TEXT, output TEXT)',
+    'CREATE TABLE IF NOT EXISTS command (target TEXT PRIMARY KEY, signature TEXT)',
+    'CREATE TABLE IF NOT EXISTS test (target TEXT PRIMARY KEY, signature TEXT)',
+]
+
+
+def digest(path):
+    """
+    Digest of the content of the file
+    """
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 16), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+class Database(object):
+    """
+    The build state, kept in sqlite in the cache directory.
+
+    Holds the content digest of files and, for each target, the digests of
+    its inputs and its output, and the signature of its command, at the
+    last successful build. For each test, the signature of the last run
+    that passed.
+    """
+
+    def __init__(self, path):
+        self.m_connection = sqlite3.connect(path)
+        for statement in SCHEMA:
+            self.m_connection.execute(statement)
+        self.m_digests = {}
+        # the digests of the inputs of the targets being built, see dispatched()
+        self.m_dispatched = {}
+
+    def execute(self, statement, parameters=()):
+        return self.m_connection.execute(statement, parameters)
+
+    def digest(self, path):
+        """
+        The content digest of the file, None if it does not exist.
+        The file is only read if its stat data changed since the digest was stored.
+        """
+        result = filesystem.cache.stat(path)
+        if not result:
+            return None
+        if stat.S_ISDIR(result.st_mode):
+            return ''
+
+        identity = (result.st_mtime_ns, result.st_size, result.st_ino)
+        known = self.m_digests.get(path)
+        if known and known[0] == identity:
+            return known[1]
+
+        row = self.execute('SELECT timestamp, size, inode, digest FROM file WHERE path = ?', (path,)).fetchone()
+        if row and row[:3] == identity:
+            value = row[3]
+        else:
+            value = digest(path)
+            self.execute('INSERT OR REPLACE INTO file VALUES (?, ?, ?, ?, ?)', (path,) + identity + (value,))
+
+        self.m_digests[path] = (identity, value)
+        return value
+
+    def inputs(self, target):
+        """
+        Digest of the dependencies of the target, dependencies without a file contributes with the name
+        """
+        hasher = hashlib.sha256()
+        for dependency in target.dependency():
+            if dependency.filename():
+                hasher.update((dependency.filename() + '\0' + str(self.digest(dependency.filename())) + '\n').encode())
+            else:
+                hasher.update((dependency.name() + '\n').encode())
+        return hasher.hexdigest()
+
+    def unchanged(self, target):
+        """
+        True if the inputs and the output of the target has the same content as at the last build
+        """
+        row = self.execute('SELECT inputs, output FROM build WHERE target = ?', (key(target),)).fetchone()
+        if not row:
+            return False
+        return row == (self.inputs(target), self.digest(target.filename()))
+
+    def recorded(self, target):
+        return self.execute('SELECT 1 FROM build WHERE target = ?', (key(target),)).fetchone() is not None
+
+    def dispatched(self, target):
+        """
+        Captures the content of the inputs as the target is dispatched to be built. An input
+        changed while it's built is then not recorded as the content it was built from.
+        """
+        self.m_dispatched[key(target)] = self.inputs(target)
+
+    def record(self, target):
+        """
+        Records the content of the inputs, as dispatched, and the output of a built target
+        """
+        inputs = self.m_dispatched.pop(key(target), None)
+        if state.settings.dry_run() or not target.filename():
+            return
+        output = self.digest(target.filename())
+        if output is None:
+            return
+        if inputs is None:
+            inputs = self.inputs(target)
+        self.execute('INSERT OR REPLACE INTO build VALUES (?, ?, ?)', (key(target), inputs, output))
+
+    def command(self, target):
+        """
+        The signature of the command at the last successful build, None if not known
+        """
+        row = self.execute('SELECT signature FROM command WHERE target = ?', (key(target),)).fetchone()
+        return row[0] if row else None
+
+    def record_command(self, target, signature):
+        if state.settings.dry_run():
+            return
+        self.execute('INSERT OR REPLACE INTO command VALUES (?, ?)', (key(target), signature))
+
+    def test(self, target):
+        """
+        The signature of the test when it last passed, None if not known
+        """
+        row = self.execute('SELECT signature FROM test WHERE target = ?', (key(target),)).fetchone()
+        return row[0] if row else None
+
+    def record_test(self, target, signature):
+        if state.settings.dry_run():
+            return
+        self.execute('INSERT OR REPLACE INTO test VALUES (?, ?)', (key(target), signature))
+
+    def forget_test(self, target):
+        self.execute('DELETE FROM test WHERE target = ?', (key(target),))
+
+    def save(self):
+        self.m_connection.commit()
+
+
+# instance of the global database, see instance()
+current = None
+
+
+def instance():
+    global current
+    if not current:
+        current = Database(state.cache_path('state.db'))
+    return current
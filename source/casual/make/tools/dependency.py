@@ -0,0 +1,197 @@
+import mmap
+import os
+import struct
+
+import casual.make.entity.state as state
+import casual.make.tools.filesystem as filesystem
+
+#
+# Binary layout, little endian:
+#
+#   header:  magic, version, number of strings, number of entries, offset of entries
+#   strings: (number of strings + 1) offsets into the string blob, followed by the blob
+#   entries: dependency file string, modification time (ns), number of headers, header strings
+#
+MAGIC = b'CMKD'
+VERSION = 1
+HEADER = struct.Struct('<4sIIII')
+ENTRY = struct.Struct('<IqI')
+OFFSET = struct.Struct('<I')
+
+
+def parse(dependency_file, directory):
+    """
+    Parse a make style dependency file, returns the absolute paths of the prerequisites
+    """
+    with open(dependency_file) as file:
+        files = file.read()
+    files = files.replace('\\\n', '\n')
+    paths = []
+    for f in (files.split()[1:]):
+        filename = f.rstrip()
+        if os.path.isabs(filename):
+            paths.append(filename)
+        else:
+            paths.append(os.path.abspath(os.path.join(directory, filename)))
+    return paths
+
+
+class Index(object):
+    """
+    Header dependencies of all objects, only dependency files that have
+    changed since the index was written are parsed. The dependency files that
+    are not used by a full evaluation, e.g. deleted or renamed, are dropped
+    """
+
+    def __init__(self, path):
+        self.m_path = path
+        self.m_map = None
+        self.m_strings = 0
+        self.m_entries = {}
+        self.m_interned = {}
+        self.m_updated = {}
+        self.m_used = set()
+        self.__load()
+
+    def __load(self):
+        try:
+            with open(self.m_path, 'rb') as file:
+                self.m_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # missing or empty
+            return
+
+        try:
+            magic, version, strings, entries, offset = HEADER.unpack_from(self.m_map, 0)
+            if magic != MAGIC or version != VERSION:
+                raise struct.error('unknown format')
+
+            self.m_strings = strings
+            for dummy in range(entries):
+                key, timestamp, count = ENTRY.unpack_from(self.m_map, offset)
+                self.m_entries[self.string(key)] = (timestamp, offset + ENTRY.size, count)
+                offset += ENTRY.size + count * OFFSET.size
+        except struct.error:
+            self.m_map.close()
+            self.m_map = None
+            self.m_entries = {}
+
+    def string(self, index):
+        try:
+            return self.m_interned[index]
+        except KeyError:
+            pass
+        start, end = struct.unpack_from('<II', self.m_map, HEADER.size + index * OFFSET.size)
+        blob = HEADER.size + (self.m_strings + 1) * OFFSET.size
+        value = self.m_map[blob + start:blob + end].decode()
+        self.m_interned[index] = value
+        return value
+
+    def __headers(self, entry):
+        timestamp, offset, count = entry
+        indices = struct.unpack_from('<' + str(count) + 'I', self.m_map, offset)
+        return [self.string(index) for index in indices]
+
+    def headers(self, dependency_file, directory):
+        """
+        Returns the absolute paths of the prerequisites in the dependency file
+        """
+        timestamp = filesystem.cache.timestamp(dependency_file)
+        if not timestamp:
+            return []
+        self.m_used.add(dependency_file)
+
+        updated = self.m_updated.get(dependency_file)
+        if updated and updated[0] == timestamp:
+            return updated[1]
+
+        entry = self.m_entries.get(dependency_file)
+        if entry and entry[0] == timestamp:
+            return self.__headers(entry)
+
+        paths = parse(dependency_file, directory)
+        self.m_updated[dependency_file] = (timestamp, paths)
+        return paths
+
+    def use(self, dependency_files):
+        """
+        Dependency files used without being looked up, e.g. by a replayed fragment of the model cache
+        """
+        self.m_used.update(dependency_files)
+
+    def changes(self):
+        """
+        The dependency files parsed and used since the index was written, to hand over to another process, see merge
+        """
+        changes = (self.m_updated, self.m_used)
+        self.m_updated = {}
+        self.m_used = set()
+        return changes
+
+    def merge(self, changes):
+        updated, used = changes
+        self.m_updated.update(updated)
+        self.m_used.update(used)
+
+    def save(self, full=False):
+        """
+        Writes the index, with full all makefiles are evaluated and the entries of the
+        dependency files that were not used are dropped
+        """
+        dropped = {key for key in self.m_entries if key not in self.m_used} if full else set()
+        self.m_used = set()
+        if not self.m_updated and not dropped:
+            return
+
+        strings = {}
+
+        def intern(value):
+            if value not in strings:
+                strings[value] = len(strings)
+            return strings[value]
+
+        entries = []
+        for key, entry in self.m_entries.items():
+            if key not in self.m_updated and key not in dropped:
+                entries.append((intern(key), entry[0], [intern(path) for path in self.__headers(entry)]))
+        for key, (timestamp, paths) in self.m_updated.items():
+            entries.append((intern(key), timestamp, [intern(path) for path in paths]))
+
+        blob = bytearray()
+        offsets = [0]
+        for value in strings:
+            blob += value.encode()
+            offsets.append(len(blob))
+
+        offset = HEADER.size + len(offsets) * OFFSET.size + len(blob)
+        content = bytearray(HEADER.pack(MAGIC, VERSION, len(strings), len(entries), offset))
+        content += struct.pack('<' + str(len(offsets)) + 'I', *offsets)
+        content += blob
+        for key, timestamp, paths in entries:
+            content += ENTRY.pack(key, timestamp, len(paths))
+            content += struct.pack('<' + str(len(paths)) + 'I', *paths)
+
+        os.makedirs(os.path.dirname(self.m_path), exist_ok=True)
+        temporary = self.m_path + '.' + str(os.getpid())
+        with open(temporary, 'wb') as file:
+            file.write(content)
+        os.replace(temporary, self.m_path)
+
+        if self.m_map:
+            self.m_map.close()
+        self.m_map = None
+        self.m_entries = {}
+        self.m_interned = {}
+        self.m_updated = {}
+        self.__load()
+
+
+# instance of the global index, see instance()
+current = None
+
+
+def instance():
+    global current
+    if not current:
+        current = Index(state.cache_path('dependency.index'))
+    return current
@@ -0,0 +1,275 @@
+import json
+import os
+import queue
+import stat
+import subprocess
+import threading
+import time
+import urllib.request
+
+import casual.make.entity.recipe as recipe
+import casual.make.entity.state as state
+import casual.make.tools.artifact as artifact
+import casual.make.tools.dependency as dependency
+import casual.make.tools.environment as environment
+import casual.make.tools.executor as executor
+import casual.make.tools.output as output
+import casual.make.tools.remote as remote
+
+
+class Unavailable(Exception):
+    """
+    The agent could not be reached, or failed to reply
+    """
+    pass
+
+
+class Failed(Exception):
+    """
+    The compile failed on the agent, e.g. a header that is new since the dependency file
+    was written. The compile is handled locally, the local compiler tells if it's an error.
+    """
+    pass
+
+
+class Agent(object):
+    """
+    A worker agent, see tools/agent.py
+    """
+
+    def __init__(self, address, timeout):
+        self.m_url = address if '://' in address else 'http://' + address
+        self.m_timeout = timeout
+        self.address = address
+        self.slots = 0
+        self.broken = False
+        try:
+            self.slots = json.loads(self.request('/capacity'))['slots']
+        except (Unavailable, ValueError, KeyError) as ex:
+            self.unavailable(ex)
+
+    def unavailable(self, ex):
+        if not self.broken:
+            output.error('agent ' + self.address + ' not used: ' + str(ex))
+        self.broken = True
+
+    def request(self, path, data=None):
+        try:
+            with urllib.request.urlopen(self.m_url + path, data=data, timeout=self.m_timeout) as reply:
+                return reply.read()
+        except (OSError, ValueError) as ex:
+            raise Unavailable(str(ex))
+
+    def execute(self, files):
+        """
+        Executes the command in the files, returns the status and the outputs
+        """
+        try:
+            return remote.unpack(self.request('/execute', remote.pack(files)))
+        except (ValueError, UnicodeDecodeError) as ex:
+            raise Unavailable(str(ex))
+
+
+def dependency_file(input):
+    return os.path.join(os.path.dirname(input['destination'].makefile()), input['dependencyfile'])
+
+
+def accepts(action):
+    """
+    True if the action can be shipped to an agent, a compile in the source root
+    that doesn't use a precompiled header
+    """
+    recipes = action.recipe()
+    if action.serial() or len(recipes) != 1 or recipes[0].function != recipe.compile:
+        return False
+    if recipes[0].arguments().get('precompiled_header'):
+        return False
+    if not hasattr(recipe.selector, 'compile_command'):
+        return False
+    input = recipes[0].arguments()
+    root = state.settings.source_root() + '/'
+    return input['destination'].makefile().startswith(root)
+
+
+def preprocessor(command, objectfile):
+    """
+    The compile command turned into a preprocessor run to stdout, that writes the dependency
+    file, if any, with the object as target
+    """
+    result = []
+    arguments = iter(command)
+    for argument in arguments:
+        if argument == '-o':
+            next(arguments, None)
+        elif argument != '-c':
+            result.append(argument)
+    if '-MF' in result:
+        result += ['-MT', objectfile]
+    return result + ['-E']
+
+
+def preprocessed(command, source, path):
+    """
+    The compile command for the preprocessed source at path, without the dependency file
+    """
+    result = []
+    arguments = iter(command)
+    for argument in arguments:
+        if argument == '-MF':
+            next(arguments, None)
+        elif argument not in ['-MMD', '-MD']:
+            result.append(path if argument == source else argument)
+    return result
+
+
+def ship(agent, input):
+    """
+    Compiles on the agent. With a dependency file the source and the headers in the source
+    root are shipped, headers outside the source root, e.g. system headers, has to be present
+    on the agent. Without one, e.g. in a clean build, the source is preprocessed locally,
+    which writes the dependency file, and the preprocessed source is shipped.
+    """
+    context_directory = os.path.dirname(input['destination'].makefile())
+    command = recipe.compile_command(input)
+    source = input['source'].filename()
+    shipped = command
+    files = {}
+
+    # the object is written last, it depends on the dependency file
+    outputs = {}
+    if os.path.exists(dependency_file(input)):
+        if input.get('single_pass'):
+            outputs['dependency'] = dependency_file(input)
+
+        root = state.settings.source_root() + '/'
+        for path in [source] + dependency.parse(dependency_file(input), context_directory):
+            if path.startswith(root):
+                with open(path, 'rb') as file:
+                    files[artifact.portable(path)] = (stat.S_IMODE(os.stat(path).st_mode), file.read())
+    else:
+        if input.get('single_pass'):
+            executor.create_directory(os.path.dirname(dependency_file(input)))
+        try:
+            reply = subprocess.run(preprocessor(command, input['destination'].filename()), cwd=context_directory,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+        except (OSError, subprocess.CalledProcessError) as ex:
+            raise Failed(str(ex))
+        # the language is told by the extension of the preprocessed source
+        path = source + ('.i' if source.endswith('.c') else '.ii')
+        files[artifact.portable(path)] = (0o644, reply.stdout)
+        shipped = preprocessed(command, source, path)
+    outputs['object'] = input['destination'].filename()
+
+    files['.command'] = (0, json.dumps({
+        'command': [artifact.portable(str(argument)) for argument in shipped],
+        'directory': artifact.portable(context_directory + '/'),
+        'outputs': {name: artifact.portable(path) for name, path in outputs.items()}
+    }).encode())
+
+    executor.show(command)
+    reply = agent.execute(files)
+    status = json.loads(reply['.status'][1])
+    if status['code'] != 0:
+        raise Failed(artifact.localize(status['stderr'].encode()).decode())
+
+    for name, path in outputs.items():
+        mode, content = reply[name]
+        if name == 'dependency':
+            content = artifact.localize(content)
+        executor.create_directory(os.path.dirname(path))
+        temporary = path + '.' + str(os.getpid()) + '.' + str(threading.get_ident())
+        with open(temporary, 'wb') as file:
+            file.write(content)
+        os.chmod(temporary, mode)
+        os.replace(temporary, path)
+
+
+def execute(agent, task):
+    """
+    Compiles the task on the agent, returns False if the agent or an input is not
+    available, or the compile failed, and the task has to be handled locally
+    """
+    input = task.recipe()[0].arguments()
+
+    def compile():
+        ship(agent, input)
+
+    if agent.broken:
+        return False
+    try:
+        if recipe.cacheable():
+            artifact.compile(recipe.compile_command(input), os.path.dirname(input['destination'].makefile()),
+                             input['source'].filename(), input['destination'].filename(),
+                             dependency_file(input), input.get('single_pass'), compile)
+        else:
+            compile()
+        return True
+    except Unavailable as ex:
+        agent.unavailable(ex)
+    except Failed as ex:
+        if state.settings.verbose():
+            output.print('compiling ' + input['source'].filename() + ' locally, failed on agent ' +
+                         agent.address + ': ' + str(ex))
+    except FileNotFoundError:
+        # a header is gone, let the local compiler tell
+        pass
+    return False
+
+
+class Agents(object):
+    """
+    The agents compiles are shipped to, each slot of an agent is served by a thread
+    that replies to the handler like the local workers. A task that could not be
+    shipped is replied with None, the handler dispatches it to a local worker.
+    """
+
+    def __init__(self, addresses, reply_queue):
+        timeout = float(environment.get('CASUAL_MAKE_AGENT_TIMEOUT', '300'))
+        self.m_agents = [Agent(address, timeout) for address in addresses]
+        self.m_queue = queue.Queue()
+        self.m_reply_queue = reply_queue
+        self.m_threads = []
+
+        for agent in self.m_agents:
+            for index in range(agent.slots):
+                thread = threading.Thread(target=self.__worker, args=(agent, agent.address + ' ' + str(index + 1)),
+                                          daemon=True)
+                thread.start()
+                self.m_threads.append(thread)
+
+    def capacity(self):
+        return sum(agent.slots for agent in self.m_agents if not agent.broken)
+
+    def submit(self, task):
+        self.m_queue.put(task)
+
+    def stop(self):
+        for dummy in self.m_threads:
+            self.m_queue.put(None)
+        self.m_threads = []
+
+    def __worker(self, agent, slot):
+        while True:
+            task = self.m_queue.get()
+            if task is None:
+                return
+
+            start = time.time()
+            try:
+                ok = True if execute(agent, task) else None
+            except SystemError as ex:
+                if not state.settings.ignore_errors():
+                    output.error(str(ex))
+                ok = False
+            self.m_reply_queue.put((task.id, ok, start, time.time() - start, None, slot, {}))
+
+
+def enabled():
+    return bool(environment.get('CASUAL_MAKE_AGENTS')) and not state.settings.dry_run()
+
+
+def addresses():
+    """
+    The agents, host:port separated with comma
+    """
+    return [address.strip() for address in environment.get('CASUAL_MAKE_AGENTS').split(',') if address.strip()]
@@ -5,9 +5,14 @@ import errno
 import re
 import sys
 import casual.make.tools.environment as environment
+import casual.make.tools.filesystem as filesystem
 import casual.make.tools.output as output
+import casual.make.tools.resources as resources
 import casual.make.entity.state as state
 
+# the peak resident memory, in bytes, of the commands executed since last take_peak_memory()
+peak_memory = 0
+
 
 def importCode(file, filename, name, add_to_sys_modules=0):
     """ code can be any object containing code -- string, file object, or
@@ -41,13 +46,16 @@ def cd(newdir):
 def create_directory(directory):
     """ 
     We need this construction to avoid race conditions using multiple processes
-    That is instead of checking first.
+    That is instead of checking first, the cached metadata only saves the system call.
     """
+    if filesystem.cache.is_directory(directory):
+        return
     try:
         os.makedirs(directory)
     except OSError as e:
         if e.errno != errno.EEXIST:
             raise
+    filesystem.cache.invalidate(directory)
 
 
 def execute_raw(command):
@@ -55,26 +63,93 @@ def execute_raw(command):
     return subprocess.check_output(command).rstrip()
 
 
-def execute(command, show_command=True, show_output=True, env=None):
+def show(command):
+    """
+    Prints the command, unless quiet
+    """
+    if state.settings.quiet():
+        return
+    if state.settings.raw_format():
+        output.print(' '.join(str(v) for v in command), format=False)
+    else:
+        output.print(' '.join(str(v) for v in command), end='')
 
-    try:
-        if show_command and not state.settings.quiet():
-            if state.settings.raw_format():
-                output.print(' '.join(str(v) for v in command), format=False)
-            else:
-                output.print(' '.join(str(v) for v in command), end='')
 
-        out = None if show_output else subprocess.DEVNULL
+def take_peak_memory():
+    global peak_memory
+    peak = peak_memory
+    peak_memory = 0
+    return peak
+
+
+def run(command, stdout, stderr, env):
+    """
+    Runs the command, returns what was written to the one pipe of stdout and stderr.
+    Raises CalledProcessError if it fails. The peak memory of the command, and the
+    commands it waited for, is taken from wait4
+    """
+    global peak_memory
+    if not hasattr(os, 'wait4'):
+        reply = subprocess.run(command, stdout=stdout, stderr=stderr, check=True, env=env)
+        return reply.stdout if stdout == subprocess.PIPE else reply.stderr
+
+    with subprocess.Popen(command, stdout=stdout, stderr=stderr, env=env) as process:
+        pipe = process.stdout if stdout == subprocess.PIPE else process.stderr
+        captured = pipe.read()
+        dummy, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+    peak_memory = max(peak_memory, resources.rss(usage.ru_maxrss))
+    if process.returncode != 0:
+        if stdout == subprocess.PIPE:
+            raise subprocess.CalledProcessError(process.returncode, command, output=captured)
+        raise subprocess.CalledProcessError(process.returncode, command, stderr=captured)
+    return captured
+
+
+def block(command, captured):
+    """
+    Prints the command, unless quiet, and its output at once
+    """
+    text = ''
+    if command and not state.settings.quiet():
+        if state.settings.raw_format():
+            text = ' '.join(str(v) for v in command)
+        else:
+            text = output.reformat(' '.join(str(v) for v in command))
+        if not text.endswith('\n'):
+            text += '\n'
+    text += captured.decode(errors='replace')
+    sys.stdout.write(text)
+    sys.stdout.flush()
 
-        err = subprocess.PIPE
 
+def execute(command, show_command=True, show_output=True, env=None, buffered=False):
+
+    try:
         if env:
             # append to global env
             env = dict(os.environ, **env)
 
+        if buffered and not state.settings.dry_run():
+            # the output of commands running in parallel would be mixed
+            captured = b''
+            try:
+                captured = run(command, subprocess.PIPE, subprocess.STDOUT, env)
+            except subprocess.CalledProcessError as ex:
+                captured = ex.output
+                raise
+            finally:
+                block(command if show_command else None, captured if show_output else b'')
+            return
+
+        if show_command:
+            show(command)
+
+        out = None if show_output else subprocess.DEVNULL
+
         if not state.settings.dry_run():
-            reply = subprocess.run(command, stdout=out,
-                                   stderr=err, check=True, env=env)
+            run(command, out, subprocess.PIPE, env)
 
     except KeyboardInterrupt:
         # todo: abort living subprocess here
@@ -89,12 +164,14 @@ def execute(command, show_command=True, show_output=True, env=None):
         raise SystemError("aborting due to errors")
 
 
-def command(cmd, name=None, directory=None, show_command=True, show_output=True, env=None):
+def command(cmd, name=None, directory=None, show_command=True, show_output=True, env=None, buffered=False):
 
     if directory:
         with cd(directory):
             if name:
                 create_directory(os.path.dirname(name.filename()))
-            execute(cmd, show_command, show_output, env=env)
+            execute(cmd, show_command, show_output, env=env, buffered=buffered)
+            if name:
+                filesystem.cache.invalidate(name.filename())
     else:
-        execute(cmd, show_command, show_output, env=env)
+        execute(cmd, show_command, show_output, env=env, buffered=buffered)
@@ -0,0 +1,143 @@
+import concurrent.futures
+import os
+import stat
+
+import casual.make.tools.environment as environment
+
+
+class Cache(object):
+    """
+    Caches the metadata of files, one os.stat per path.
+
+    The first lookup in a directory lists it with os.scandir, hence lookups
+    of files that doesn't exist are answered without touching the filesystem.
+    """
+
+    def __init__(self):
+        self.m_stat = {}
+        self.m_directory = {}
+        self.m_stats = 0
+        self.m_scans = 0
+        self.m_pool = None
+
+    def stats(self):
+        """
+        Number of os.stat and os.scandir performed
+        """
+        return self.m_stats + self.m_scans
+
+    def __listing(self, directory):
+        try:
+            return self.m_directory[directory]
+        except KeyError:
+            pass
+
+        self.m_scans += 1
+        try:
+            with os.scandir(directory if directory else '.') as entries:
+                listing = set(entry.name for entry in entries)
+        except (FileNotFoundError, NotADirectoryError):
+            listing = set()
+        except OSError:
+            # not readable, let os.stat decide
+            listing = None
+
+        self.m_directory[directory] = listing
+        return listing
+
+    def __known(self, path):
+        """
+        returns False if the path is known not to exist
+        """
+        directory, name = os.path.split(path)
+        if not name:
+            return True
+        listing = self.__listing(directory)
+        return listing is None or name in listing
+
+    def stat(self, path):
+        try:
+            return self.m_stat[path]
+        except KeyError:
+            pass
+
+        result = None
+        if self.__known(path):
+            self.m_stats += 1
+            result = query(path)
+
+        self.m_stat[path] = result
+        return result
+
+    def exists(self, path):
+        return self.stat(path) is not None
+
+    def is_directory(self, path):
+        result = self.stat(path)
+        return result is not None and stat.S_ISDIR(result.st_mode)
+
+    def timestamp(self, path):
+        """
+        modification time in nanoseconds, 0 if the file does not exist
+        """
+        result = self.stat(path)
+        return result.st_mtime_ns if result else 0
+
+    def prefetch(self, paths):
+        """
+        Stat the paths concurrently, worthwhile on filesystems with high latency
+        """
+        if not threads():
+            return
+
+        pending = [path for path in paths if path not in self.m_stat and self.__known(path)]
+        if len(pending) < 2:
+            return
+
+        if not self.m_pool:
+            self.m_pool = concurrent.futures.ThreadPoolExecutor(max_workers=threads())
+
+        for path, result in zip(pending, self.m_pool.map(query, pending)):
+            self.m_stats += 1
+            self.m_stat[path] = result
+
+    def forked(self):
+        """
+        The threads of the pool are not inherited by a forked process
+        """
+        self.m_pool = None
+
+    def content(self):
+        """
+        The metadata and directory listings known, to hand over to another process, see merge
+        """
+        return self.m_stat, self.m_directory
+
+    def merge(self, content):
+        stats, directories = content
+        for path, result in stats.items():
+            self.m_stat.setdefault(path, result)
+        for directory, listing in directories.items():
+            self.m_directory.setdefault(directory, listing)
+
+    def invalidate(self, path):
+        """
+        The file has been written or removed
+        """
+        self.m_stat.pop(path, None)
+        self.m_directory.pop(os.path.dirname(path), None)
+
+
+def query(path):
+    try:
+        return os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+def threads():
+    return int(environment.get("CASUAL_MAKE_STAT_THREADS", "0"))
+
+
+# instance of the global cache
+cache = Cache()
@@ -1,43 +1,121 @@
 from multiprocessing import Queue, Process
 from queue import Empty
 
-import multiprocessing as mp
+import heapq
+
+import casual.make.entity.model as model
 import casual.make.entity.recipe as recipe
 import casual.make.entity.state as state
+from casual.make.entity.target import Target, Recipe
 
+import casual.make.tools.artifact as artifact
+import casual.make.tools.database as database
+import casual.make.tools.distribute as distribute
+import casual.make.tools.executor as executor
+import casual.make.tools.filesystem as filesystem
+import casual.make.tools.history as history
 import casual.make.tools.output as out
+import casual.make.tools.resources as resources
+import casual.make.tools.shard as shard
+import casual.make.tools.trace as trace
 import sys
 import os
+import time
+
+
+class Task(object):
+    """
+    What a worker needs to handle an action. The targets in the recipe
+    arguments are references, without dependencies and recipes, so the
+    graph stays in the parent process.
+    """
+
+    def __init__(self, target, references):
+        self.id = target.hash
+        self.target = references.get(target)
+        self.recipes = [Recipe(item.function, references.convert(item.arguments()))
+                        for item in target.recipe()]
+
+    def recipe(self):
+        return self.recipes
+
+    def makefile(self):
+        return self.target.makefile()
+
+    def filename(self):
+        return self.target.filename()
+
+
+class References(object):
+    """
+    Converts targets to references, each target is converted once
+    """
 
+    def __init__(self):
+        self.m_references = {}
+
+    def get(self, target):
+        try:
+            return self.m_references[target.hash]
+        except KeyError:
+            reference = target.reference()
+            self.m_references[target.hash] = reference
+            return reference
+
+    def convert(self, value):
+        if isinstance(value, Target):
+            return self.get(value)
+        if isinstance(value, list):
+            return [self.convert(item) for item in value]
+        if isinstance(value, tuple):
+            return tuple(self.convert(item) for item in value)
+        if isinstance(value, dict):
+            return {key: self.convert(item) for key, item in value.items()}
+        return value
 
-def worker(input, output):
+
+def worker(input, output, slot):
     while True:
         try:
             item = input.get(True, 1)
 
             if item == terminate_process():
+                artifact.flush()
                 break
 
+            start = time.time()
             recipe.dispatch(item)
-            output.put((item, True))
+            output.put((item.id, True, start, time.time() - start, executor.take_peak_memory(), slot,
+                        artifact.take()))
         except SystemError as ex:
             if state.settings.verbose():
-                out.error('\nprocessed makefile: ' + str(item.makefile))
+                out.error('\nprocessed makefile: ' + str(item.makefile()))
             if state.settings.verbose():
-                out.error('processed filename: ' + str(item.filename))
+                out.error('processed filename: ' + str(item.filename()))
             if not state.settings.ignore_errors():
                 out.error(str(ex))
-            output.put((item, False))
-            break
+            output.put((item.id, False, start, time.time() - start, executor.take_peak_memory(), slot,
+                        artifact.take()))
+            if not state.settings.ignore_errors():
+                break
         except PermissionError as ex:
-            out.error(str(item))
-            out.error(ex)
-            output.put((item, False))
-            break
+            out.error(str(item.target))
+            out.error(str(ex))
+            output.put((item.id, False, start, time.time() - start, executor.take_peak_memory(), slot,
+                        artifact.take()))
+            if not state.settings.ignore_errors():
+                break
         except Empty:
             pass
 
 
+def workers():
+    """
+    The number of local workers, -j or the processors available
+    """
+    return state.settings.jobs() or resources.cpus()
+
+
 def terminate_children(process):
     for p in process:
         if p.is_alive():
@@ -56,6 +134,8 @@ def serial(actions):
     for item in actions:
         try:
             recipe.dispatch(item)
+            if item.filename():
+                filesystem.cache.invalidate(item.filename())
         except SystemError as ex:
             if state.settings.verbose():
                 out.error('\nprocessed makefile: ' + str(item.makefile))
@@ -65,6 +145,208 @@ def serial(actions):
                 raise
 
 
+def unittest(action):
+    return action.recipe() and action.recipe()[-1].function == recipe.test
+
+
+def tested(action):
+    """
+    True if the action is a test that passed last time with the same signature, see recipe.test_signature
+    """
+    if state.settings.force() or state.settings.rerun_tests() or not unittest(action):
+        return False
+    if database.instance().test(action) != recipe.test_signature(action):
+        return False
+    if not state.settings.quiet():
+        out.print('cached ' + action.recipe()[-1].arguments()['destination'].filename())
+    return True
+
+
+def dispatched(action):
+    """
+    Captures the content of the inputs of an action that is about to be built
+    """
+    if state.settings.content_hash():
+        database.instance().dispatched(action)
+
+
+def built(action):
+    """
+    Records the build state of a successfully built action
+    """
+    if state.settings.content_hash():
+        database.instance().record(action)
+    if state.settings.rebuild_on_command_change() and action.filename():
+        database.instance().record_command(action, recipe.signature(action))
+    if unittest(action):
+        database.instance().record_test(action, recipe.test_signature(action))
+
+
+def failed(action):
+    """
+    A failed test has to run again, even if it passed with the same signature before
+    """
+    if unittest(action):
+        database.instance().forget_test(action)
+
+
+class Schedule:
+    """
+    Keeps track of the actions in a graph whose prerequisites are all done.
+    With a history, the actions that failed last time are dispatched first,
+    then the actions with the longest remaining chain of dependents.
+    Raises SystemError, naming the actions, if the graph has a cycle.
+    """
+
+    def __init__(self, graph, history=None):
+        self.pending = {}
+        self.dependents = {action: [] for action in graph}
+        self.ready = []
+        self.history = history
+        self.critical = {}
+
+        for action, prerequisites in graph.items():
+            self.pending[action] = len(prerequisites)
+            for prerequisite in prerequisites:
+                self.dependents[prerequisite].append(action)
+
+        order = self.__order(graph)
+        if history:
+            self.critical = self.__critical_path(order)
+
+        for action, count in self.pending.items():
+            if count == 0:
+                self.push(action)
+
+    def __order(self, graph):
+        """
+        The actions, prerequisites before their dependents
+        """
+        pending = dict(self.pending)
+        order = [action for action, count in pending.items() if count == 0]
+        for action in order:
+            for dependent in self.dependents[action]:
+                pending[dependent] -= 1
+                if pending[dependent] == 0:
+                    order.append(dependent)
+
+        if len(order) < len(pending):
+            # each action left waits for another action left, follow them until one repeats
+            path = [next(action for action, count in pending.items() if count > 0)]
+            while path.count(path[-1]) < 2:
+                path.append(next(prerequisite for prerequisite in graph[path[-1]] if pending[prerequisite] > 0))
+            cycle = path[path.index(path[-1]):]
+            raise SystemError('dependency cycle: ' + ' -> '.join(action.name() for action in cycle))
+        return order
+
+    def __critical_path(self, order):
+        """
+        The duration of each action plus the longest chain of its dependents
+        """
+        estimate = self.history.estimate()
+
+        critical = {}
+        for action in reversed(order):
+            duration = self.history.duration(action)
+            if duration is None:
+                duration = estimate
+            critical[action] = duration + max(
+                (critical[dependent] for dependent in self.dependents[action]), default=0.0)
+        return critical
+
+    def priority(self, action):
+        # lower is dispatched first, ties in declaration order
+        if not self.history:
+            return (False, 0.0)
+        return (not self.history.failed(action), -self.critical.get(action, 0.0))
+
+    def push(self, action):
+        heapq.heappush(self.ready, (self.priority(action), action._targetid, action))
+
+    def pop(self):
+        return heapq.heappop(self.ready)[2]
+
+    def done(self, action):
+        for dependent in self.dependents[action]:
+            self.pending[dependent] -= 1
+            if self.pending[dependent] == 0:
+                self.push(dependent)
+
+
+class Governor:
+    """
+    Admits actions to the local workers while the machine can take them: the load
+    average is below --max-load, and the peak memory the history has recorded for the
+    running actions and the action fits in the memory available when the build started.
+    An action is always admitted when nothing else is running locally.
+    """
+
+    def __init__(self, history=None, max_load=None, available=None):
+        self.history = history
+        self.max_load = max_load
+        self.available = available
+        self.default = history.memory_estimate() if history else None
+        self.reserved = {}
+
+    def expected(self, action):
+        """
+        The expected peak memory of the action in bytes, 0 if nothing is known
+        """
+        memory = self.history.memory(action) if self.history else None
+        return memory or self.default or 0
+
+    def admit(self, action):
+        if not self.reserved:
+            return True
+        if self.max_load is not None:
+            load = resources.load()
+            if load is not None and load >= self.max_load:
+                return False
+        if self.available is not None:
+            return sum(self.reserved.values()) + self.expected(action) <= self.available
+        return True
+
+    def started(self, action):
+        self.reserved[action.hash] = self.expected(action)
+
+    def done(self, action):
+        self.reserved.pop(action.hash, None)
+
+
+class Pools:
+    """
+    The slots of the pools, an action holds a slot of each of its pools while it runs.
+    Serial actions hold the slot of the pool 'serial', a pool that is not declared
+    has one slot and a pool of size None has no limit.
+    """
+
+    def __init__(self, sizes):
+        self.sizes = dict(sizes, serial=1)
+        self.used = {}
+
+    @staticmethod
+    def of(action):
+        return action.pools() + ['serial'] if action.serial() else action.pools()
+
+    def full(self, action):
+        """
+        Returns the first pool of the action without a free slot, None if the action can run
+        """
+        for pool in self.of(action):
+            size = self.sizes.get(pool, 1)
+            if size is not None and self.used.get(pool, 0) >= size:
+                return pool
+        return None
+
+    def acquire(self, action):
+        for pool in self.of(action):
+            self.used[pool] = self.used.get(pool, 0) + 1
+
+    def release(self, action):
+        for pool in self.of(action):
+            self.used[pool] -= 1
+
+
 class Handler:
     def __init__(self):
         self.processes = []
@@ -72,37 +354,131 @@ class Handler:
         # Create queues
         self.task_queue = Queue()
         self.reply_queue = Queue()
+        self.references = References()
+        self.agents = None
 
     def __enter__(self):
-        for dummy in range(mp.cpu_count()):
+        for index in range(workers()):
             process = Process(target=worker, args=(
-                self.task_queue, self.reply_queue))
+                self.task_queue, self.reply_queue, 'worker ' + str(index + 1)))
             process.daemon = True
             process.start()
             self.processes.append(process)
+
+        if distribute.enabled() and not state.settings.serial():
+            # after the workers are forked, the agents are served by threads
+            self.agents = distribute.Agents(distribute.addresses(), self.reply_queue)
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         self.__empty()
+        if self.agents:
+            self.agents.stop()
+        artifact.flush()
+        if not exc_type:
+            # let the workers finish their uploads
+            terminate_children(self.processes)
+        history.instance().save()
+        if database.current:
+            database.current.save()
 
-    def __parallel(self, actions):
+    def __parallel(self, graph, progress):
         """
-        Handle actions in parallel
+        Dispatch each action as soon as all its prerequisites are done and its
+        pools have free slots. Local workers are only given an action the
+        governor admits. Slow tests are split in shards.
         """
-        actions.sort(key=lambda x: x._targetid)
+        shards = shard.Shards(history.instance(), len(self.processes))
+        graph = shards.split(graph)
+        schedule = Schedule(graph, history.instance())
+        governor = Governor(history.instance(), state.settings.max_load(), resources.memory())
+        pools = Pools(model.pools())
+
+        running = {}
+        # the actions running on agents, and the actions that has to be handled locally
+        remote = set()
+        local = set()
+        # the actions waiting for a slot, by the pool that is full
+        postponed = {}
+
+        def remote_slot(action):
+            return self.agents and len(remote) < self.agents.capacity() and \
+                action not in local and distribute.accepts(action)
 
         try:
-            # Submit actions
-            for action in actions:
-                self.task_queue.put(action, True)
+            while schedule.ready or running or postponed:
+
+                # Submit ready actions to free workers, compiles to agents when they have free slots
+                deferred = []
+                while schedule.ready and (len(running) - len(remote) < len(self.processes) or
+                                          (self.agents and len(remote) < self.agents.capacity())):
+                    action = schedule.pop()
+                    if tested(action):
+                        schedule.done(action)
+                        continue
+                    pool = pools.full(action)
+                    if pool:
+                        postponed.setdefault(pool, []).append(action)
+                        continue
+
+                    if remote_slot(action):
+                        remote.add(action.hash)
+                        dispatched(action)
+                        self.agents.submit(Task(action, self.references))
+                    elif len(running) - len(remote) < len(self.processes) and governor.admit(action):
+                        dispatched(action)
+                        self.task_queue.put(Task(action, self.references), True)
+                        governor.started(action)
+                    else:
+                        # only agents are free, or the machine is busy
+                        deferred.append(action)
+                        if not (self.agents and len(remote) < self.agents.capacity()):
+                            break
+                        continue
+                    running[action.hash] = action
+                    pools.acquire(action)
+
+                for action in deferred:
+                    schedule.push(action)
+
+                if not running:
+                    # the ready actions were tests that already passed
+                    continue
+
+                (identity, ok, start, duration, memory, slot, counters) = self.reply_queue.get(True)
+                artifact.add(counters)
 
-            while actions:
-                (action, ok) = self.reply_queue.get(True)
+                action = running.pop(identity)
+                remote.discard(identity)
+                governor.done(action)
+                pools.release(action)
+                for pool in Pools.of(action):
+                    for item in postponed.pop(pool, []):
+                        schedule.push(item)
+                if ok is None:
+                    # not handled by the agent
+                    local.add(action)
+                    schedule.push(action)
+                    continue
 
-                actions.remove(action)
+                if not shards.sharded(action):
+                    history.instance().record(action, duration, ok, memory)
+                shards.done(action, duration, ok)
+                trace.instance().action(action, slot, start, duration, ok)
+                if action.filename():
+                    filesystem.cache.invalidate(action.filename())
+                if ok:
+                    built(action)
+                else:
+                    failed(action)
                 if not ok and not state.settings.ignore_errors():
                     raise SystemError("error building...")
 
+                schedule.done(action)
+
+                if progress:
+                    progress()
+
         except KeyboardInterrupt:
             print("\nCaught KeyboardInterrupt, terminating workers")
             self.__empty()
@@ -128,25 +504,36 @@ class Handler:
             except:
                 pass
 
-        for dummy in range(mp.cpu_count()):
+        for dummy in range(len(self.processes)):
             self.task_queue.put(terminate_process(), True)
 
-    def handle(self, actions):
+    def handle(self, graph, progress=None):
         """
-        Handle the action list in parallel or in serial
+        Handle the action graph, see model.construct_action_graph, in parallel or in serial
         """
-        def has_serial(item):
-            return item.serial()
-
-        def has_parallel(item):
-            return not has_serial(item)
-
         if state.settings.serial():
-            serial(actions)
+            trace.instance().slots(1)
+            schedule = Schedule(graph, history.instance())
+            while schedule.ready:
+                action = schedule.pop()
+                if tested(action):
+                    schedule.done(action)
+                    continue
+                start = time.time()
+                dispatched(action)
+                try:
+                    serial([action])
+                except SystemError:
+                    failed(action)
+                    history.instance().record(action, time.time() - start, False, executor.take_peak_memory())
+                    trace.instance().action(action, 'serial', start, time.time() - start, False)
+                    raise
+                history.instance().record(action, time.time() - start, True, executor.take_peak_memory())
+                trace.instance().action(action, 'serial', start, time.time() - start, True)
+                built(action)
+                schedule.done(action)
+                if progress:
+                    progress()
         else:
-            serial_actions = list(filter(has_serial, actions))
-
-            parallel_actions = list(filter(has_parallel, actions))
-
-            self.__parallel(parallel_actions)
-            serial(serial_actions)
+            trace.instance().slots(len(self.processes) + (self.agents.capacity() if self.agents else 0))
+            self.__parallel(graph, progress)
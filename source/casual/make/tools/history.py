@@ -0,0 +1,96 @@
+import json
+import os
+
+import casual.make.entity.state as state
+
+
+def key(target):
+    """
+    The filename of the target, several targets can share the filename though, e.g. a unittest and its executable
+    """
+    if not target.filename():
+        return target.name()
+    if target.name() == target.filename():
+        return target.filename()
+    return target.filename() + '|' + target.name()
+
+
+class History(object):
+    """
+    The duration, peak memory and outcome of each action in earlier runs
+    """
+
+    def __init__(self, path):
+        self.m_path = path
+        self.m_updated = False
+        try:
+            with open(path) as file:
+                self.m_actions = json.load(file)
+        except (OSError, ValueError):
+            self.m_actions = {}
+
+    def duration(self, target):
+        """
+        Returns the recorded duration in seconds, None if unknown
+        """
+        entry = self.m_actions.get(key(target))
+        return entry['duration'] if entry else None
+
+    def failed(self, target):
+        entry = self.m_actions.get(key(target))
+        return entry['failed'] if entry else False
+
+    def memory(self, target):
+        """
+        Returns the recorded peak resident memory in bytes, None if unknown
+        """
+        entry = self.m_actions.get(key(target))
+        return entry.get('memory') if entry else None
+
+    def memory_estimate(self):
+        """
+        Peak memory to assume for actions without history, None if no memory is recorded
+        """
+        values = [entry['memory'] for entry in self.m_actions.values() if entry.get('memory')]
+        if not values:
+            return None
+        return sum(values) / len(values)
+
+    def estimate(self):
+        """
+        Duration to assume for actions without history
+        """
+        if not self.m_actions:
+            return 1.0
+        return sum(entry['duration'] for entry in self.m_actions.values()) / len(self.m_actions)
+
+    def record(self, target, duration, ok, memory=None):
+        if state.settings.dry_run():
+            return
+        entry = self.m_actions.setdefault(key(target), {'duration': duration, 'failed': False})
+        entry['failed'] = not ok
+        if ok:
+            entry['duration'] = duration
+            if memory:
+                entry['memory'] = memory
+        self.m_updated = True
+
+    def save(self):
+        if not self.m_updated:
+            return
+        temporary = self.m_path + '.' + str(os.getpid())
+        with open(temporary, 'w') as file:
+            json.dump(self.m_actions, file)
+        os.replace(temporary, self.m_path)
+        self.m_updated = False
+
+
+# instance of the global history, see instance()
+current = None
+
+
+def instance():
+    global current
+    if not current:
+        current = History(state.cache_path('history.json'))
+    return current
@@ -32,8 +32,12 @@ reformat.ingore_filters = [
 reformat.filters = [
     [re.compile(r'(^(g|c|clang)\+\+).* -o (\S+\.o) (\S+\.cc|\S+\.cpp|\S+\.c).*'),
      lambda match: color_module.color.green('compile: ') + color_module.color.white(match.group(4)) + '\n'],
+    [re.compile(r'(^(g|c|clang)\+\+).* -x c\+\+-header -o (\S+) .*'),
+     lambda match: color_module.color.green('precompile: ') + color_module.color.white(match.group(3)) + '\n'],
     [re.compile(r'(^(g|c|clang)\+\+).* -E .*?(\S+\.cc|\S+\.cpp|\S+\.c).*'),
      lambda match: color_module.color.green('dependency: ') + color_module.color.white(match.group(3)) + '\n'],
+    [re.compile(r'^cached (.*)'),
+     lambda match: color_module.color.green('cached: ') + color_module.color.white(match.group(1)) + '\n'],
     [re.compile(r'(^ar) \S+ (\S+\.a).*'),
      lambda match: color_module.color.blue('archive: ') + color_module.color.white(match.group(2)) + '\n'],
     [re.compile(r'(^(g|c|clang)\+\+).* -o (\S+).*(?:(\S+\.o) ).*'),
@@ -66,6 +70,8 @@ reformat.filters = [
      lambda match: color_module.color.red('processed command: ', bright=True) + match.group(1) + color_module.color.blue(match.group(2)) + match.group(3)],
     [re.compile(r'^[^ ]*processed (.*?): (.*)'),
      lambda match: color_module.color.red('processed ' + match.group(1) + ': ', bright=True) + match.group(2)],
+    [re.compile(r'^[^ ]*artifact cache: (.*)'),
+     lambda match: color_module.color.cyan('artifact cache: ' + match.group(1))],
     [re.compile(r'^[^ ]*progress: (.*)'),
      lambda match: color_module.color.cyan('progress: ' + match.group(1))],
 ]
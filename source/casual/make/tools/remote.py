@@ -0,0 +1,132 @@
+import concurrent.futures
+import struct
+import urllib.error
+import urllib.request
+
+import casual.make.tools.environment as environment
+import casual.make.tools.output as output
+
+#
+# An entry is a sequence of files: length of name, mode, length of content, name, content
+#
+FILE = struct.Struct('<III')
+
+# consecutive failures before the client stops using the server
+FAILURES = 3
+
+
+def pack(files):
+    """
+    Packs files, name to (mode, content), into an entry
+    """
+    content = bytearray()
+    for name, (mode, data) in files.items():
+        encoded = name.encode()
+        content += FILE.pack(len(encoded), mode, len(data)) + encoded + data
+    return bytes(content)
+
+
+def unpack(content):
+    files = {}
+    offset = 0
+    while offset < len(content):
+        length, mode, size = FILE.unpack_from(content, offset)
+        offset += FILE.size
+        name = content[offset:offset + length].decode()
+        offset += length
+        files[name] = (mode, content[offset:offset + size])
+        offset += size
+    return files
+
+
+class Client(object):
+    """
+    Client of a remote artifact cache, entries are fetched with GET <url>/<key>
+    and stored with PUT <url>/<key>.
+
+    A slow or unavailable server is not used for the rest of the build,
+    the actions are executed locally instead.
+    """
+
+    def __init__(self, url, timeout):
+        self.m_url = url.rstrip('/')
+        self.m_timeout = timeout
+        self.m_failures = 0
+        self.m_uploads = None
+        self.m_pending = []
+
+    def available(self):
+        return self.m_failures < FAILURES
+
+    def __failed(self, ex):
+        self.m_failures += 1
+        if not self.available():
+            output.error('remote artifact cache not used: ' + str(ex))
+
+    def __request(self, key, data=None):
+        method = 'PUT' if data is not None else 'GET'
+        request = urllib.request.Request(self.m_url + '/' + key, data=data, method=method)
+        with urllib.request.urlopen(request, timeout=self.m_timeout) as reply:
+            return reply.read()
+
+    def get(self, key):
+        """
+        Returns the files, name to (mode, content), stored under the key, None if not stored
+        """
+        if not self.available():
+            return None
+        try:
+            content = self.__request(key)
+        except urllib.error.HTTPError as ex:
+            if ex.code != 404:
+                self.__failed(ex)
+            return None
+        except (OSError, ValueError) as ex:
+            self.__failed(ex)
+            return None
+        self.m_failures = 0
+        try:
+            return unpack(content)
+        except (struct.error, UnicodeDecodeError):
+            return None
+
+    def put(self, key, files):
+        """
+        Stores the files, name to (mode, content), under the key in the background
+        """
+        if not self.available():
+            return
+        if not self.m_uploads:
+            self.m_uploads = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+        self.m_pending.append(self.m_uploads.submit(self.__upload, key, pack(files)))
+
+    def __upload(self, key, content):
+        if not self.available():
+            return
+        try:
+            self.__request(key, content)
+        except (OSError, ValueError) as ex:
+            self.__failed(ex)
+
+    def flush(self):
+        """
+        Waits for the uploads in progress
+        """
+        concurrent.futures.wait(self.m_pending)
+        self.m_pending = []
+
+
+# instance of the client, see instance()
+current = None
+
+
+def enabled():
+    return bool(environment.get('CASUAL_MAKE_REMOTE_CACHE'))
+
+
+def instance():
+    global current
+    if not current:
+        current = Client(environment.get('CASUAL_MAKE_REMOTE_CACHE'),
+                         float(environment.get('CASUAL_MAKE_REMOTE_CACHE_TIMEOUT', '2')))
+    return current
@@ -0,0 +1,112 @@
+import math
+import os
+import sys
+
+# cgroup v1 reports an unlimited memory limit as a huge number
+UNLIMITED = 1 << 60
+
+
+def read(path):
+    """
+    Returns the content of the file, stripped, None if it can't be read
+    """
+    try:
+        with open(path) as file:
+            return file.read().strip()
+    except OSError:
+        return None
+
+
+def cgroups():
+    """
+    The cgroup v2 directory of the process and its ancestors, innermost first
+    """
+    content = read('/proc/self/cgroup')
+    if content is None:
+        return []
+    for line in content.splitlines():
+        hierarchy, dummy, path = line.split(':', 2)
+        if hierarchy == '0':
+            directory = os.path.join('/sys/fs/cgroup', path.lstrip('/'))
+            directories = []
+            while directory.startswith('/sys/fs/cgroup'):
+                directories.append(directory)
+                directory = os.path.dirname(directory)
+            return directories
+    return []
+
+
+def quota(directories=None, v1='/sys/fs/cgroup/cpu'):
+    """
+    The number of processors the cgroup cpu quota allows, None if there is no quota
+    """
+    limits = []
+    for directory in cgroups() if directories is None else directories:
+        content = read(os.path.join(directory, 'cpu.max'))
+        if content:
+            value, period = content.split()
+            if value != 'max':
+                limits.append(int(value) / int(period))
+
+    value = read(os.path.join(v1, 'cpu.cfs_quota_us'))
+    period = read(os.path.join(v1, 'cpu.cfs_period_us'))
+    if value and period and int(value) > 0:
+        limits.append(int(value) / int(period))
+
+    return min(limits) if limits else None
+
+
+def cpus():
+    """
+    The number of processors to use: the processors the process may run on, limited by the cgroup cpu quota
+    """
+    try:
+        count = len(os.sched_getaffinity(0))
+    except AttributeError:
+        count = os.cpu_count() or 1
+    limit = quota()
+    if limit:
+        count = min(count, max(1, math.ceil(limit)))
+    return count
+
+
+def load():
+    """
+    The load average of the last minute, None if not known
+    """
+    try:
+        return os.getloadavg()[0]
+    except (AttributeError, OSError):
+        return None
+
+
+def memory(directories=None, meminfo='/proc/meminfo', v1='/sys/fs/cgroup/memory'):
+    """
+    Bytes of memory available, of the system and the cgroup, None if not known
+    """
+    available = []
+    content = read(meminfo)
+    if content:
+        for line in content.splitlines():
+            if line.startswith('MemAvailable:'):
+                available.append(int(line.split()[1]) * 1024)
+
+    for directory in cgroups() if directories is None else directories:
+        limit = read(os.path.join(directory, 'memory.max'))
+        current = read(os.path.join(directory, 'memory.current'))
+        if limit and current and limit != 'max':
+            available.append(max(0, int(limit) - int(current)))
+
+    limit = read(os.path.join(v1, 'memory.limit_in_bytes'))
+    current = read(os.path.join(v1, 'memory.usage_in_bytes'))
+    if limit and current and int(limit) < UNLIMITED:
+        available.append(max(0, int(limit) - int(current)))
+
+    return min(available) if available else None
+
+
+def rss(maxrss):
+    """
+    ru_maxrss in bytes, it's in kilobytes except on macOS
+    """
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
@@ -0,0 +1,90 @@
+import casual.make.entity.recipe as recipe
+import casual.make.tools.environment as environment
+
+from casual.make.entity.target import Target, Recipe
+
+
+def threshold():
+    """
+    Seconds a test shard should take at least, see CASUAL_MAKE_TEST_SHARD_DURATION
+    """
+    return float(environment.get('CASUAL_MAKE_TEST_SHARD_DURATION', '10'))
+
+
+class Shards(object):
+    """
+    Splits the tests that took long last time in gtest shards, each shard is an action
+    of its own. When all shards of a test are done, the test is recorded in the history
+    with the sum of their durations, the test is split the same way next time.
+    """
+
+    def __init__(self, history, workers):
+        self.m_history = history
+        self.m_workers = workers
+        # the test of each shard, and the shards left, duration and outcome of each test
+        self.m_tests = {}
+        self.m_pending = {}
+
+    def count(self, action):
+        """
+        The number of shards to split the action in, 1 if it's not a test worth splitting
+        """
+        recipes = action.recipe()
+        if len(recipes) != 1 or recipes[0].function != recipe.test or 'shard' in recipes[0].arguments():
+            return 1
+        duration = self.m_history.duration(action)
+        if not duration:
+            return 1
+        return max(1, min(self.m_workers, int(duration // threshold())))
+
+    def shard(self, test, index, count):
+        arguments = dict(test.recipe()[0].arguments(), shard=(index, count))
+        target = Target(test.name() + ' ' + str(index + 1) + '/' + str(count), makefile=test.makefile())
+        target.add_recipe(Recipe(recipe.test, arguments)).pools(test.pools())
+        if test.serial():
+            target.serial(True)
+        self.m_tests[target.hash] = test
+        return target
+
+    def split(self, graph):
+        """
+        Returns the action graph with the tests to split replaced by their shards
+        """
+        replaced = {}
+        for action in graph:
+            count = self.count(action)
+            if count > 1:
+                replaced[action] = [self.shard(action, index, count) for index in range(count)]
+                self.m_pending[action.hash] = [count, 0.0, True]
+        if not replaced:
+            return graph
+
+        result = {}
+        for action, prerequisites in graph.items():
+            expanded = [item for prerequisite in prerequisites for item in replaced.get(prerequisite, [prerequisite])]
+            for item in replaced.get(action, [action]):
+                result[item] = expanded
+        return result
+
+    def sharded(self, action):
+        """
+        Is the action a shard of a test, recorded by done() and not by itself
+        """
+        return action.hash in self.m_tests
+
+    def done(self, action, duration, ok):
+        """
+        Records the test of the action when it's the last of its shards
+        """
+        test = self.m_tests.get(action.hash)
+        if not test:
+            return
+        pending = self.m_pending[test.hash]
+        pending[0] -= 1
+        pending[1] += duration
+        pending[2] = pending[2] and ok
+        if not ok:
+            # failed tests are dispatched first, even if the build is aborted
+            self.m_history.record(test, pending[1], False)
+        elif pending[0] == 0 and pending[2]:
+            self.m_history.record(test, pending[1], True)
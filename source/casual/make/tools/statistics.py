@@ -0,0 +1,74 @@
+import json
+
+# number of the slowest actions in the report
+SLOWEST = 10
+
+
+def collect(trace, store, stats):
+    """
+    The statistics of the run, from the trace and the model, as plain values that can be written as JSON
+    """
+    phases = [{'name': phase['name'], 'wall': phase['duration'], 'cpu': phase['cpu']} for phase in trace.phases()]
+
+    targets = [target for targets in store.target_cache().values() for target in targets.values()]
+
+    kinds = {}
+    for action in trace.actions():
+        entry = kinds.setdefault(action['kind'], {'count': 0, 'total': 0.0, 'mean': 0.0})
+        entry['count'] += 1
+        entry['total'] += action['duration']
+    for entry in kinds.values():
+        entry['mean'] = entry['total'] / entry['count']
+
+    slowest = sorted(trace.actions(), key=lambda action: action['duration'], reverse=True)[:SLOWEST]
+
+    # busy slot time of the total slot time while the actions were executed
+    efficiency = None
+    execute = [phase['duration'] for phase in trace.phases() if phase['name'] == 'execute']
+    if execute and execute[0] > 0 and trace.slots() and trace.actions():
+        efficiency = sum(action['duration'] for action in trace.actions()) / (execute[0] * trace.slots())
+
+    return {
+        'phases': phases,
+        'targets': len(targets),
+        'edges': sum(len(target.dependency()) for target in targets),
+        'stats': stats,
+        'actions': len(trace.actions()),
+        'failed': len([action for action in trace.actions() if not action['ok']]),
+        'kinds': kinds,
+        'slowest': [{'name': action['name'], 'kind': action['kind'], 'slot': action['slot'],
+                     'duration': action['duration']} for action in slowest],
+        'slots': trace.slots(),
+        'efficiency': efficiency}
+
+
+def text(statistics):
+    """
+    The statistics as lines of text
+    """
+    lines = ['statistics:']
+    lines.append('  {:<18}{:>10}{:>10}'.format('phase', 'wall', 'cpu'))
+    for phase in statistics['phases']:
+        lines.append('  {:<18}{:>9.3f}s{:>9.3f}s'.format(phase['name'], phase['wall'], phase['cpu']))
+
+    lines.append('  targets: {}, edges: {}, stats: {}'.format(
+        statistics['targets'], statistics['edges'], statistics['stats']))
+    lines.append('  actions: {}, failed: {}'.format(statistics['actions'], statistics['failed']))
+    for kind, entry in sorted(statistics['kinds'].items(), key=lambda item: str(item[0])):
+        lines.append('    {:<16}{:>6}  total {:.3f}s, mean {:.3f}s'.format(
+            str(kind) + ':', entry['count'], entry['total'], entry['mean']))
+
+    if statistics['slowest']:
+        lines.append('  slowest:')
+        for action in statistics['slowest']:
+            lines.append('    {:>8.3f}s  {} ({}, {})'.format(
+                action['duration'], action['name'], action['kind'], action['slot']))
+
+    if statistics['efficiency'] is not None:
+        lines.append('  parallel efficiency: {:.0%} of {} slots'.format(statistics['efficiency'], statistics['slots']))
+    return lines
+
+
+def save(statistics, path):
+    with open(path, 'w') as file:
+        json.dump(statistics, file, indent=2)
@@ -0,0 +1,108 @@
+from contextlib import contextmanager
+import json
+import os
+import time
+
+import casual.make.entity.recipe as recipe
+
+
+def cpu():
+    """
+    Processor time of this process and its terminated children, e.g. the workers and the compilers they ran
+    """
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+class Trace(object):
+    """
+    The phases of a run, and the actions handled with the slot, worker or agent, that handled them
+    """
+
+    def __init__(self):
+        self.m_phases = []
+        self.m_actions = []
+        self.m_slots = 0
+
+    def phases(self):
+        return self.m_phases
+
+    def actions(self):
+        return self.m_actions
+
+    def slots(self, slots=None):
+        """
+        The number of actions that can be handled at the same time
+        """
+        if slots is None:
+            return self.m_slots
+        self.m_slots = slots
+        return self.m_slots
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        processor = cpu()
+        try:
+            yield
+        finally:
+            self.m_phases.append({'name': name, 'start': start, 'duration': time.time() - start,
+                                  'cpu': cpu() - processor})
+
+    def action(self, target, slot, start, duration, ok):
+        self.m_actions.append({
+            'name': target.name(),
+            'filename': target.filename(),
+            'kind': recipe.kind(target),
+            'slot': slot,
+            'start': start,
+            'duration': duration,
+            'ok': ok})
+
+    def events(self):
+        """
+        Chrome trace events, the phases on the first thread and each slot on a thread of its own
+        """
+        items = self.m_phases + self.m_actions
+        if not items:
+            return []
+        origin = min(item['start'] for item in items)
+
+        def microseconds(value):
+            return int(value * 1000000)
+
+        threads = {'casual-make': 0}
+        events = []
+        for phase in self.m_phases:
+            events.append({'name': phase['name'], 'cat': 'phase', 'ph': 'X', 'pid': os.getpid(), 'tid': 0,
+                           'ts': microseconds(phase['start'] - origin), 'dur': microseconds(phase['duration'])})
+
+        for action in self.m_actions:
+            thread = threads.setdefault(action['slot'], len(threads))
+            events.append({'name': action['name'], 'cat': action['kind'], 'ph': 'X', 'pid': os.getpid(), 'tid': thread,
+                           'ts': microseconds(action['start'] - origin), 'dur': microseconds(action['duration']),
+                           'args': {'filename': action['filename'], 'status': 'ok' if action['ok'] else 'failed'}})
+
+        for name, thread in threads.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': thread, 'args': {'name': name}})
+            events.append({'name': 'thread_sort_index', 'ph': 'M', 'pid': os.getpid(), 'tid': thread,
+                           'args': {'sort_index': thread}})
+        return events
+
+    def save(self, path):
+        """
+        Writes the trace as Chrome trace event JSON, see chrome://tracing or ui.perfetto.dev
+        """
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': self.events(), 'displayTimeUnit': 'ms'}, file)
+
+
+# instance of the trace of the current run, see instance()
+current = None
+
+
+def instance():
+    global current
+    if not current:
+        current = Trace()
+    return current
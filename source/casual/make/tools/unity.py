@@ -0,0 +1,161 @@
+import bisect
+import hashlib
+import json
+import os
+
+import casual.make.entity.state as state
+import casual.make.tools.environment as environment
+import casual.make.tools.filesystem as filesystem
+
+
+def threshold():
+    """
+    Seconds of compile time, of the sources compiled one by one, to put in a batch, see CASUAL_MAKE_UNITY_DURATION
+    """
+    return float(environment.get('CASUAL_MAKE_UNITY_DURATION', '30'))
+
+
+def pack(durations, limit):
+    """
+    Splits the items, in order, in batches that takes at most limit seconds.
+    durations is a list of (item, seconds), an item that takes longer than limit gets a batch of its own.
+    """
+    batches = []
+    total = 0.0
+    for item, duration in durations:
+        if batches and total + duration <= limit:
+            batches[-1].append(item)
+            total += duration
+        else:
+            batches.append([item])
+            total = duration
+    return batches
+
+
+def content(directory, sources):
+    """
+    The batch source in the directory, that includes the sources
+    """
+    return ''.join('#include "' + os.path.relpath(source, directory) + '"\n' for source in sources)
+
+
+def write(path, value):
+    """
+    Writes the file if the content differs, an unchanged batch source keeps its timestamp
+    """
+    try:
+        with open(path) as file:
+            if file.read() == value:
+                return
+    except OSError:
+        pass
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file:
+        file.write(value)
+    filesystem.cache.invalidate(path)
+
+
+def location(prefix):
+    """
+    The layout of the batches with the prefix
+    """
+    return state.cache_path('unity', hashlib.sha1(prefix.encode()).hexdigest() + '.json')
+
+
+def boundaries(path, durations, limit):
+    """
+    The first source of each batch, as packed the first time or when the limit has changed,
+    see pack(). A source that is added or removed later only changes its own batch.
+    """
+    try:
+        with open(path) as file:
+            layout = json.load(file)
+        if layout['limit'] == limit:
+            return layout['boundaries']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    reply = [batch[0] for batch in pack(durations, limit)]
+    if not state.settings.dry_run():
+        write(path, json.dumps({'limit': limit, 'boundaries': reply}))
+    return reply
+
+
+def split(sources, boundaries):
+    """
+    The sorted sources in a batch for each boundary, a source before the first boundary is in the first batch
+    """
+    batches = [[] for dummy in boundaries]
+    for source in sources:
+        batches[max(bisect.bisect_right(boundaries, source) - 1, 0)].append(source)
+    return batches
+
+
+class Isolation(object):
+    """
+    The sources taken out of each batch since the batch was built with them. An edited source
+    is compiled on its own, and stays out of the batch until the batch object is removed, e.g. by
+    clean, so the next edit of it doesn't compile the batch again. The changes made by a worker of
+    the parallel model are merged, and saved, by the main process, see take() and merge().
+    """
+
+    def __init__(self, path):
+        self.m_path = path
+        self.m_updated = False
+        self.m_changes = []
+        try:
+            with open(path) as file:
+                self.m_batches = json.load(file)
+        except (OSError, ValueError):
+            self.m_batches = {}
+
+    def isolated(self, batch):
+        return self.m_batches.get(batch, [])
+
+    def isolate(self, batch, source):
+        sources = self.m_batches.setdefault(batch, [])
+        if source not in sources:
+            sources.append(source)
+            self.m_updated = True
+            self.m_changes.append(('isolate', batch, source))
+
+    def reset(self, batch):
+        if self.m_batches.pop(batch, None) is not None:
+            self.m_updated = True
+            self.m_changes.append(('reset', batch))
+
+    def take(self):
+        """
+        Returns and forgets the changes since the last take
+        """
+        changes = self.m_changes
+        self.m_changes = []
+        return changes
+
+    def merge(self, changes):
+        for change in changes:
+            if change[0] == 'isolate':
+                self.isolate(change[1], change[2])
+            else:
+                self.reset(change[1])
+        self.m_changes = []
+
+    def save(self):
+        if not self.m_updated or state.settings.dry_run():
+            return
+        temporary = self.m_path + '.' + str(os.getpid())
+        with open(temporary, 'w') as file:
+            json.dump(self.m_batches, file)
+        os.replace(temporary, self.m_path)
+        self.m_updated = False
+
+
+# instance of the global isolation, see instance()
+current = None
+
+
+def instance():
+    global current
+    if not current:
+        current = Isolation(state.cache_path('unity.json'))
+    return current
@@ -0,0 +1,129 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+
+#
+# inotify(7)
+#
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+    IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+EVENT = struct.Struct('iIII')
+
+
+class Overflow(Exception):
+    """
+    Events were lost, everything has to be checked
+    """
+    pass
+
+
+class Watcher(object):
+    """
+    Watches directories for changes of the files in them, with inotify
+    """
+
+    def __init__(self, library):
+        self.m_library = library
+        self.m_fd = library.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.m_fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1')
+        self.m_directories = {}
+        self.m_descriptors = {}
+
+    def fileno(self):
+        return self.m_fd
+
+    def watched(self, directory):
+        return directory in self.m_descriptors
+
+    def watch(self, directory):
+        """
+        Returns False if the directory can't be watched, e.g. it doesn't exist (yet)
+        """
+        if directory in self.m_descriptors:
+            return True
+        descriptor = self.m_library.inotify_add_watch(self.m_fd, os.fsencode(directory), MASK)
+        if descriptor < 0:
+            return False
+        self.m_directories[descriptor] = directory
+        self.m_descriptors[directory] = descriptor
+        return True
+
+    def changes(self):
+        """
+        Returns the paths changed since last time, raises Overflow if events were lost
+        """
+        paths = set()
+        overflow = False
+        while True:
+            try:
+                content = os.read(self.m_fd, 1 << 16)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(content):
+                descriptor, mask, dummy, length = EVENT.unpack_from(content, offset)
+                name = content[offset + EVENT.size:offset + EVENT.size + length].rstrip(b'\0')
+                offset += EVENT.size + length
+
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                directory = self.m_directories.get(descriptor)
+                if directory is None:
+                    continue
+                if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                    # gone, has to be watched again when it's back
+                    self.__forget(descriptor)
+                    paths.add(directory)
+                elif name:
+                    paths.add(os.path.join(directory, os.fsdecode(name)))
+
+        if overflow:
+            raise Overflow()
+        return paths
+
+    def __forget(self, descriptor):
+        directory = self.m_directories.pop(descriptor, None)
+        if directory is not None:
+            self.m_descriptors.pop(directory, None)
+            self.m_library.inotify_rm_watch(self.m_fd, descriptor)
+
+    def close(self):
+        os.close(self.m_fd)
+
+
+def create():
+    """
+    Returns a watcher, None if the platform lacks inotify and the files has to be polled
+    """
+    try:
+        library = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        library.inotify_init1
+    except (OSError, AttributeError):
+        return None
+    try:
+        return Watcher(library)
+    except OSError as ex:
+        if ex.errno in [errno.EMFILE, errno.ENOSYS, errno.ENOMEM]:
+            return None
+        raise
@@ -0,0 +1,154 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+import unittest.mock
+
+import casual.make.entity.state as state
+import casual.make.entity.cli as cli
+
+# recipes needs a compiler handler
+state.environment(cli.handle_arguments([]))
+
+import casual.make.api as api
+import casual.make.entity.model as model
+import casual.make.tools.agent as agent
+import casual.make.tools.database as database
+import casual.make.tools.dependency as dependency
+import casual.make.tools.distribute as distribute
+import casual.make.tools.filesystem as filesystem
+import casual.make.tools.handler as handler
+import casual.make.tools.history as history
+
+from casual.make.entity.target import Target
+
+from casual.make.tools.artifact import PLACEHOLDER
+
+
+def request(command, outputs, files):
+    files['.command'] = (0, json.dumps({
+        'command': command, 'directory': PLACEHOLDER + '/source/', 'outputs': outputs}).encode())
+    return files
+
+
+class TestAgent(unittest.TestCase):
+
+    def test_execute_in_sandbox(self):
+        reply = agent.execute(request(
+            ['cp', 'a.cpp', PLACEHOLDER + '/obj/a.o'], {'object': PLACEHOLDER + '/obj/a.o'},
+            {PLACEHOLDER + '/source/a.cpp': (0o644, b'content')}))
+
+        self.assertEqual(json.loads(reply['.status'][1])['code'], 0)
+        self.assertEqual(reply['object'], (0o644, b'content'))
+
+    def test_failed_command(self):
+        reply = agent.execute(request(['false'], {'object': PLACEHOLDER + '/obj/a.o'}, {}))
+        self.assertNotEqual(json.loads(reply['.status'][1])['code'], 0)
+        self.assertNotIn('object', reply)
+
+    def test_path_outside_sandbox(self):
+        with self.assertRaises(ValueError):
+            agent.execute(request(['true'], {}, {PLACEHOLDER + '/../a.cpp': (0o644, b'')}))
+
+    def test_capacity_and_execute_over_http(self):
+        server = agent.server(2)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            remote = distribute.Agent('localhost:' + str(server.server_port), 5)
+            self.assertEqual(remote.slots, 2)
+            reply = remote.execute(request(
+                ['cp', 'a.cpp', PLACEHOLDER + '/obj/a.o'], {'object': PLACEHOLDER + '/obj/a.o'},
+                {PLACEHOLDER + '/source/a.cpp': (0o644, b'content')}))
+            self.assertEqual(reply['object'], (0o644, b'content'))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+
+class TestDistribute(unittest.TestCase):
+    """
+    Compiles handled by the handler, with an agent in this process
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = dict(state.settings.model)
+        state.settings.model['source_root'] = self.directory.name
+        state.settings.model['cache_directory'] = self.path('.casual-make')
+        state.settings.model['jobs'] = 1
+        database.current = None
+        dependency.current = None
+        history.current = None
+        filesystem.cache = filesystem.Cache()
+
+        self.server = agent.server(1)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.environment = {name: os.environ.pop(name, None) for name in ['CASUAL_MAKE_AGENTS', 'CASUAL_MAKE_ARTIFACT_CACHE']}
+        os.environ['CASUAL_MAKE_AGENTS'] = 'localhost:' + str(self.server.server_port)
+
+        self.write('a.h', '#define A 1\n')
+        self.write('a.cpp', '#include "a.h"\nint a() { return A; }\n')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        for name, value in self.environment.items():
+            os.environ.pop(name, None)
+            if value is not None:
+                os.environ[name] = value
+        state.settings.model = self.settings
+        dependency.current = None
+        history.current = None
+        filesystem.cache = filesystem.Cache()
+        self.directory.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def write(self, name, content):
+        with open(self.path(name), 'w') as file:
+            file.write(content)
+
+    def build(self):
+        """
+        Compiles a.cpp, returns the status codes of the compiles on the agent
+        """
+        model.reset()
+        model.makefiles.append(self.path('makefile.cmk'))
+        objectfile = api.Compile('a.cpp').execute(True)
+        model.makefiles.pop()
+
+        codes = []
+
+        def execute(request):
+            reply = executed(request)
+            codes.append(json.loads(reply['.status'][1])['code'])
+            return reply
+
+        executed = agent.execute
+        with unittest.mock.patch.object(agent, 'execute', execute):
+            with handler.Handler() as instance:
+                instance.handle(model.construct_action_graph(Target('root').add_dependency(objectfile)))
+        return codes
+
+    def test_clean_build_ships_the_preprocessed_source(self):
+        self.assertEqual(self.build(), [0])
+        self.assertTrue(os.path.exists(self.path('obj/a.o')))
+        self.assertIn(self.path('a.h'), dependency.parse(self.path('obj/a.d'), self.directory.name))
+
+    def test_new_header_missing_on_the_agent_compiles_locally(self):
+        self.build()
+        os.remove(self.path('obj/a.o'))
+
+        # the dependency file doesn't know b.h, it isn't shipped
+        self.write('b.h', '#define B 2\n')
+        self.write('a.cpp', '#include "a.h"\n#include "b.h"\nint a() { return A + B; }\n')
+        self.assertEqual(self.build(), [1])
+        self.assertTrue(os.path.exists(self.path('obj/a.o')))
+        self.assertIn(self.path('b.h'), dependency.parse(self.path('obj/a.d'), self.directory.name))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,282 @@
+import os
+import sys
+import tempfile
+import unittest
+import unittest.mock
+
+import casual.make.entity.state as state
+import casual.make.entity.cli as cli
+
+# the api needs a compiler handler
+state.environment(cli.handle_arguments([]))
+
+import casual.make.api as api
+import casual.make.entity.model as model
+import casual.make.entity.recipe as recipe
+import casual.make.tools.dependency as dependency
+import casual.make.tools.executor as executor
+import casual.make.tools.history as history
+import casual.make.tools.unity as unity
+
+from casual.make.tools.executor import cd
+
+
+class TestAttribution(unittest.TestCase):
+    """
+    The makefile each target is registered for
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = dict(state.settings.model)
+        state.settings.model['cache_directory'] = self.path('.casual-make')
+        dependency.current = None
+        # helper modules, imported by the makefiles
+        sys.path.insert(0, self.directory.name)
+
+    def tearDown(self):
+        sys.path.remove(self.directory.name)
+        sys.modules.pop('attribution_helper', None)
+        state.settings.model = self.settings
+        dependency.current = None
+        self.directory.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def write(self, name, content):
+        os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+        with open(self.path(name), 'w') as file:
+            file.write(content)
+
+    def build(self):
+        with cd(self.directory.name):
+            model.build()
+
+    def test_nested_build(self):
+        self.write('makefile.cmk', "from casual.make.api import *\n"
+                                   "LinkLibrary('bin/before', [Compile('before.cpp')], [])\n"
+                                   "Build('sub/makefile.cmk')\n"
+                                   "LinkLibrary('bin/after', [Compile('after.cpp')], [])\n")
+        self.write('sub/makefile.cmk', "from casual.make.api import *\n"
+                                       "LinkLibrary('bin/sub', [Compile('sub.cpp')], [])\n")
+        self.build()
+
+        for name, makefile in [('before', 'makefile.cmk'), ('sub', 'sub/makefile.cmk'), ('after', 'makefile.cmk')]:
+            self.assertEqual(model.get(name).makefile(), self.path(makefile))
+        self.assertEqual(model.get('obj/sub.o').filename(), self.path('sub/obj/sub.o'))
+        self.assertEqual(model.get('obj/after.o').filename(), self.path('obj/after.o'))
+
+    def test_helper_module(self):
+        self.write('attribution_helper.py', "from casual.make.api import *\n"
+                                            "def library(name, sources):\n"
+                                            "    return LinkLibrary(name, [Compile(source) for source in sources], [])\n")
+        self.write('makefile.cmk', "from casual.make.api import *\n"
+                                   "Build('sub/makefile.cmk')\n")
+        self.write('sub/makefile.cmk', "import attribution_helper\n"
+                                       "attribution_helper.library('bin/sub', ['sub.cpp'])\n")
+        self.build()
+
+        self.assertEqual(model.get('sub').makefile(), self.path('sub/makefile.cmk'))
+        self.assertEqual(model.get('obj/sub.o').filename(), self.path('sub/obj/sub.o'))
+
+    def test_compile_many(self):
+        self.write('makefile.cmk', "from casual.make.api import *\n"
+                                   "Build('sub/makefile.cmk')\n")
+        self.write('sub/makefile.cmk', "from casual.make.api import *\n"
+                                       "IncludePaths(['include'])\n"
+                                       "LinkLibrary('bin/sub', CompileMany(['a.cpp', 'b.cpp']), [])\n")
+        self.build()
+
+        for name in ['a', 'b']:
+            target = model.get('obj/' + name + '.o')
+            self.assertEqual(target.makefile(), self.path('sub/makefile.cmk'))
+            self.assertEqual(target.filename(), self.path('sub/obj/' + name + '.o'))
+            self.assertEqual(target.recipe()[-1].arguments()['source'].filename(), self.path('sub/' + name + '.cpp'))
+            self.assertEqual(target.recipe()[-1].arguments()['include_paths'],
+                             model.include_paths(self.path('sub/makefile.cmk')))
+
+    def test_outside_a_makefile(self):
+        model.reset()
+        target = api.Compile('outside.cpp')
+        self.assertEqual(target.makefile(), os.path.abspath(__file__))
+
+
+class TestCompile(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = dict(state.settings.model)
+        state.settings.model['cache_directory'] = self.directory.name
+        # -MD instead of -MMD with the artifact cache
+        self.artifacts = os.environ.pop('CASUAL_MAKE_ARTIFACT_CACHE', None)
+        dependency.current = None
+        model.makefiles.append('/project/makefile.cmk')
+
+    def tearDown(self):
+        model.makefiles.pop()
+        state.settings.model = self.settings
+        if self.artifacts is not None:
+            os.environ['CASUAL_MAKE_ARTIFACT_CACHE'] = self.artifacts
+        dependency.current = None
+        self.directory.cleanup()
+
+    def command(self, target):
+        with unittest.mock.patch.object(executor, 'command') as command:
+            target.recipe()[-1].function(target.recipe()[-1].arguments())
+        return command.call_args[0][0]
+
+    def test_compile_writes_the_dependency_file(self):
+        target = api.Compile('source/a.cpp')
+
+        self.assertEqual([item.function for item in target.recipe()], [recipe.compile])
+        self.assertTrue(target.recipe()[0].arguments()['single_pass'])
+        command = self.command(target)
+        self.assertEqual(command[command.index('-MMD'):command.index('-MMD') + 3],
+                         ['-MMD', '-MF', '/project/obj/source/a.d'])
+
+    def test_dependency_step(self):
+        state.settings.model['dependency_step'] = True
+        target = api.Compile('source/b.cpp')
+
+        self.assertEqual([item.function for item in target.recipe()],
+                         [recipe.execute_dependency_generation, recipe.compile])
+        self.assertFalse(target.recipe()[-1].arguments().get('single_pass'))
+        self.assertNotIn('-MMD', self.command(target))
+
+
+class TestPrecompiledHeader(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = dict(state.settings.model)
+        state.settings.model['cache_directory'] = self.directory.name
+        dependency.current = None
+        model.reset()
+        model.makefiles.append('/project/makefile.cmk')
+
+    def tearDown(self):
+        model.makefiles.pop()
+        state.settings.model = self.settings
+        dependency.current = None
+        self.directory.cleanup()
+
+    def test_compiles_use_precompiled_header(self):
+        api.IncludePaths(['include'])
+        precompiled = api.PrecompiledHeader('include/common.h')
+        used = api.Compile('source/a.cpp')
+        other = api.Compile('source/b.cpp', directive=['-DOTHER'])
+
+        directory = os.path.dirname(precompiled.filename())
+        self.assertEqual(os.path.dirname(directory), '/project/obj/pch')
+        self.assertEqual(os.path.basename(precompiled.filename()), 'common.h.gch')
+        arguments = precompiled.recipe()[-1].arguments()
+        self.assertEqual(arguments['wrapper'].filename(), directory + '/common.h')
+        self.assertEqual(arguments['include_paths'], model.include_paths('/project/makefile.cmk'))
+
+        self.assertIn(precompiled, used.dependency())
+        self.assertEqual(recipe.compile_directive(used.recipe()[-1].arguments())[-2:],
+                         ['-include', directory + '/common.h'])
+
+        self.assertNotIn(precompiled, other.dependency())
+        self.assertEqual(recipe.compile_directive(other.recipe()[-1].arguments()), ['-DOTHER'])
+
+    def test_headers_and_directives_are_precompiled_apart(self):
+        plain = api.PrecompiledHeader('include/common.h')
+        other = api.PrecompiledHeader('include/common.h', directive=['-DOTHER'])
+        elsewhere = api.PrecompiledHeader('other/common.h', directive=['-DOTHER'])
+
+        self.assertEqual(len({plain.filename(), other.filename(), elsewhere.filename()}), 3)
+        for precompiled in [plain, other, elsewhere]:
+            self.assertEqual(len(precompiled.recipe()), 1)
+        self.assertIs(api.PrecompiledHeader('include/common.h'), plain)
+        self.assertEqual(len(plain.recipe()), 1)
+
+        # each compile uses the last one declared with its directive
+        self.assertIn(plain, api.Compile('source/a.cpp').dependency())
+        self.assertIn(elsewhere, api.Compile('source/b.cpp', directive=['-DOTHER']).dependency())
+
+
+class TestUnity(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.makefile = os.path.join(self.directory.name, 'makefile.cmk')
+        self.settings = dict(state.settings.model)
+        state.settings.model['cache_directory'] = os.path.join(self.directory.name, '.casual-make')
+        dependency.current = None
+        model.reset()
+        model.makefiles.append(self.makefile)
+        state.settings.model['unity'] = True
+        history.current = history.History(os.path.join(self.directory.name, 'history.json'))
+        unity.current = unity.Isolation(os.path.join(self.directory.name, 'unity.json'))
+
+    def tearDown(self):
+        model.makefiles.pop()
+        state.settings.model = self.settings
+        dependency.current = None
+        history.current = None
+        unity.current = None
+        self.directory.cleanup()
+
+    def link(self, sources):
+        """
+        Links the sources in a new model, returns the names of the linked objects
+        """
+        model.reset()
+        model.makefiles.append(self.makefile)
+        library = api.LinkLibrary('bin/common', api.CompileMany(sources), [])
+        return [target.name() for target in library.recipe()[0].arguments()['objects']]
+
+    def batch(self, name):
+        """
+        The content of the batch source
+        """
+        with open(os.path.join(self.directory.name, name[:-len('.o')] + '.cpp')) as file:
+            return file.read()
+
+    def test_link_batches(self):
+        objects = api.CompileMany(['source/a.cpp', 'source/b.cpp', 'source/c.cpp'])
+        other = api.Compile('source/d.cpp', directive=['-DOTHER'])
+        library = api.LinkLibrary('bin/common', objects + [other], [])
+
+        linked = library.recipe()[0].arguments()['objects']
+        self.assertEqual(len(linked), 2)
+        self.assertRegex(linked[0].name(), r'^obj/unity/common\.[0-9a-f]{8}\.1\.o$')
+        self.assertEqual(linked[1].name(), 'obj/source/d.o')
+        self.assertNotIn(objects[0], api.compile_target.dependency())
+        self.assertIn(linked[0], api.compile_target.dependency())
+
+        self.assertEqual(self.batch(linked[0].name()), ''.join('#include "../../source/' + name + '"\n'
+                                                               for name in ['a.cpp', 'b.cpp', 'c.cpp']))
+
+    def test_edited_source_is_taken_out(self):
+        sources = ['source/a.cpp', 'source/b.cpp', 'source/c.cpp']
+        batch = self.link(sources)[0]
+        path = os.path.join(self.directory.name, batch)
+        unity.current.isolate(path, os.path.join(self.directory.name, 'source', 'a.cpp'))
+        unity.write(path, '')
+
+        self.assertEqual(self.link(sources), ['obj/source/a.o', batch])
+
+    def test_batches_are_kept_when_sources_are_added(self):
+        os.environ['CASUAL_MAKE_UNITY_DURATION'] = '20'
+        try:
+            sources = ['source/a.cpp', 'source/b.cpp', 'source/c.cpp', 'source/d.cpp']
+            for target in api.CompileMany(sources):
+                history.current.record(target, 10.0, True)
+
+            first, second = self.link(sources)
+            self.assertTrue(first.endswith('.1.o') and second.endswith('.2.o'))
+            content = self.batch(second)
+
+            # the new source goes in the batch it sorts into, the durations don't move the others
+            history.current.record(model.store.get('obj/source/a.o'), 1.0, True)
+            self.assertEqual(self.link(sources + ['source/bb.cpp']), [first, second])
+            self.assertIn('bb.cpp', self.batch(first))
+            self.assertEqual(self.batch(second), content)
+        finally:
+            del os.environ['CASUAL_MAKE_UNITY_DURATION']
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import os
+import tempfile
+import unittest
+
+import casual.make.platform.common as common
+import casual.make.tools.artifact as artifact
+
+
+class TestArtifact(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as file:
+            file.write(content)
+        return path
+
+    def test_put_and_get(self):
+        store = artifact.Store(os.path.join(self.directory.name, 'store'), 1 << 20)
+        objectfile = self.write('a.o', 'object')
+        store.put('abcdef', {'object': objectfile})
+
+        os.remove(objectfile)
+        self.assertEqual(store.get('abcdef', {'object': objectfile}), len('object'))
+        with open(objectfile) as file:
+            self.assertEqual(file.read(), 'object')
+
+    def test_unknown_key(self):
+        store = artifact.Store(os.path.join(self.directory.name, 'store'), 1 << 20)
+        self.assertIsNone(store.get('abcdef', {'object': self.write('a.o', '')}))
+
+    def test_least_recently_used_is_evicted(self):
+        # room for two entries of 10 bytes
+        store = artifact.Store(os.path.join(self.directory.name, 'store'), 25)
+        objectfile = self.write('a.o', '0123456789')
+
+        store.put('aa1', {'object': objectfile})
+        os.utime(store.path('aa1'), ns=(0, 0))
+        store.put('bb2', {'object': objectfile})
+        self.assertTrue(os.path.exists(store.path('aa1')))
+
+        store.put('cc3', {'object': objectfile})
+        self.assertFalse(os.path.exists(store.path('aa1')))
+        self.assertTrue(os.path.exists(store.path('bb2')))
+        self.assertTrue(os.path.exists(store.path('cc3')))
+        self.assertEqual(store.usage()[0], 20)
+
+    def test_large_artifact_is_kept(self):
+        # larger than a bucket's share of the size
+        store = artifact.Store(os.path.join(self.directory.name, 'store'), 1000)
+        linked = self.write('a.so', 'x' * 500)
+        objectfile = self.write('a.o', '0123456789')
+
+        store.put('aa1', {'library': linked})
+        for index in range(10):
+            store.put('bb' + str(index), {'object': objectfile})
+        self.assertTrue(os.path.exists(store.path('aa1')))
+
+    def test_ledger_counts_what_is_stored(self):
+        directory = os.path.join(self.directory.name, 'store')
+        objectfile = self.write('a.o', '0123456789')
+        artifact.Store(directory, 1000).put('aa1', {'object': objectfile})
+        os.remove(os.path.join(directory, 'ledger'))
+
+        # a store without a ledger is scanned
+        store = artifact.Store(directory, 1000)
+        store.put('bb2', {'object': objectfile})
+        store.put('bb2', {'object': objectfile})
+        with open(os.path.join(directory, 'ledger')) as file:
+            self.assertEqual(file.read(), '20')
+
+    def test_preprocess_command(self):
+        command = ['g++', '-O3', '-c', '-o', 'obj/a.o', 'a.cpp', '-Iinclude', '-MMD', '-MF', 'obj/a.d']
+        self.assertEqual(artifact.preprocess(command), ['g++', '-O3', 'a.cpp', '-Iinclude', '-E'])
+        command[-3] = '-MD'
+        self.assertEqual(artifact.preprocess(command), ['g++', '-O3', 'a.cpp', '-Iinclude', '-E'])
+
+    def test_dependency_file_lists_system_headers_with_the_cache(self):
+        variable = os.environ.pop('CASUAL_MAKE_ARTIFACT_CACHE', None)
+        try:
+            self.assertEqual(common.dependency_directive('obj/a.d'), ['-MMD', '-MF', 'obj/a.d'])
+            os.environ['CASUAL_MAKE_ARTIFACT_CACHE'] = self.directory.name
+            self.assertEqual(common.dependency_directive('obj/a.d'), ['-MD', '-MF', 'obj/a.d'])
+        finally:
+            os.environ.pop('CASUAL_MAKE_ARTIFACT_CACHE')
+            if variable is not None:
+                os.environ['CASUAL_MAKE_ARTIFACT_CACHE'] = variable
+
+    def test_direct_key_only_from_the_compile_dependency_file(self):
+        artifact.current = artifact.Store(os.path.join(self.directory.name, 'store'), 1 << 20)
+        try:
+            source = self.write('a.cpp', 'int a();')
+            dependency_file = self.write('a.d', 'a.o: a.cpp\n')
+            objectfile = self.write('a.o', 'object')
+            # the preprocessor fails
+            command = ['false', '-c', source]
+            key = artifact.direct(artifact.base('compile', command, self.directory.name), source,
+                                  dependency_file, self.directory.name)
+            artifact.current.put(key, {'dependency': dependency_file, 'object': objectfile})
+
+            compiled = []
+            artifact.compile(command, self.directory.name, source, objectfile, dependency_file, False,
+                             lambda: compiled.append(True))
+            self.assertEqual(compiled, [True])
+
+            artifact.compile(command, self.directory.name, source, objectfile, dependency_file, True,
+                             lambda: compiled.append(True))
+            self.assertEqual(compiled, [True])
+        finally:
+            artifact.current = None
+
+    def test_size(self):
+        self.assertEqual(artifact.size('512'), 512)
+        self.assertEqual(artifact.size('2k'), 2048)
+        self.assertEqual(artifact.size('5G'), 5 << 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
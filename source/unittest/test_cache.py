@@ -0,0 +1,98 @@
+import unittest
+
+import casual.make.entity.state as state
+import casual.make.entity.cli as cli
+
+# recipes needs a compiler handler
+state.environment(cli.handle_arguments([]))
+
+import casual.make.entity.cache as cache
+import casual.make.entity.model as model
+import casual.make.entity.recipe as recipe
+import casual.make.tools.dependency as dependency
+
+from casual.make.entity.target import Recipe
+
+
+def record(journal, function):
+    cache.journal = journal
+    try:
+        function()
+    finally:
+        cache.journal = None
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        model.store = model.Store()
+
+    def test_replay_reproduces_fragment(self):
+
+        def makefile():
+            source = model.register('a.cpp', 'a.cpp', '/project/makefile.cmk')
+            target = model.register('a.o', 'obj/a.o', '/project/makefile.cmk')
+            target.add_dependency(source).add_recipe(
+                Recipe(recipe.compile, {'source': source, 'destination': target, 'directive': []}))
+            model.add_key_value('/project/makefile.cmk', 'include_paths', ['include'])
+            target.pools('link')
+            model.add_pool('db_port', 1)
+
+        journal = cache.Journal('/project/makefile.cmk')
+        record(journal, makefile)
+        self.assertTrue(journal.cacheable)
+
+        model.store = model.Store()
+        cache.replay(journal)
+
+        target = model.store.get('a.o', 'obj/a.o')
+        self.assertEqual(target.filename(), '/project/obj/a.o')
+        self.assertEqual(target.dependency(), [model.store.get('a.cpp', 'a.cpp')])
+        self.assertEqual(target.recipe()[0].function, recipe.compile)
+        self.assertIs(target.recipe()[0].arguments()['destination'], target)
+        self.assertEqual(model.include_paths('/project/makefile.cmk'), ['include'])
+        self.assertEqual(target.pools(), ['link'])
+        self.assertEqual(model.pools()['db_port'], 1)
+
+    def test_replay_uses_dependency_files(self):
+        journal = cache.Journal('/project/makefile.cmk')
+        journal.inputs['/project/obj/a.d'] = 1
+
+        dependency.current = dependency.Index('/nonexistent/dependency.index')
+        try:
+            cache.replay(journal)
+            self.assertIn('/project/obj/a.d', dependency.current.m_used)
+        finally:
+            dependency.current = None
+
+    def test_local_recipe_is_uncacheable(self):
+
+        def makefile():
+            def local(arguments):
+                pass
+            model.register('custom').add_recipe(Recipe(local, {}))
+
+        journal = cache.Journal('/project/makefile.cmk')
+        record(journal, makefile)
+        self.assertFalse(journal.cacheable)
+
+    def test_failed_lookup_resolves_by_name(self):
+
+        def makefile():
+            library = model.get('common')
+            self.assertIsNone(library)
+            model.register('app', 'bin/app', '/project/app/makefile.cmk').add_dependency(
+                model.register('common'))
+
+        journal = cache.Journal('/project/app/makefile.cmk')
+        record(journal, makefile)
+
+        model.store = model.Store()
+        library = model.register('common', '/project/lib/libcommon.so', '/project/lib/makefile.cmk')
+        cache.replay(journal)
+
+        self.assertEqual(model.store.get('app', 'bin/app').dependency(), [library])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,232 @@
+import os
+import signal
+import tempfile
+import threading
+import time
+import unittest
+
+import casual.make.entity.state as state
+import casual.make.entity.cli as cli
+
+# the model needs a compiler handler
+state.environment(cli.handle_arguments([]))
+
+import casual.make.entity.model as model
+import casual.make.tools.daemon as daemon
+import casual.make.tools.dependency as dependency
+import casual.make.tools.filesystem as filesystem
+
+from casual.make.tools.executor import cd
+
+MAKEFILE = "from casual.make.api import *\n" \
+           "LinkLibrary('bin/a', [Compile('a.cpp')], [])\n"
+
+
+class Project(object):
+    """
+    A makefile with a compiled source, in a temporary directory with a cache directory of its own
+    """
+
+    def __init__(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = dict(state.settings.model)
+        state.settings.model['cache_directory'] = self.path('.casual-make')
+        dependency.current = None
+        filesystem.cache = filesystem.Cache()
+        # a model of its own
+        model.store = model.Store()
+        del model.evaluated[:]
+
+        self.write('makefile.cmk', MAKEFILE, 1)
+        self.write('a.cpp', 'int a() { return 1; }', 1)
+        self.write('a.h', 'int a();', 1)
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def write(self, name, content, seconds):
+        """
+        Writes the file, modified the given seconds after the epoch
+        """
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file:
+            file.write(content)
+        os.utime(path, ns=(seconds * 10**9, seconds * 10**9))
+        return path
+
+    def server(self, make=None):
+        with cd(self.directory.name):
+            return daemon.Server(make)
+
+    def cleanup(self):
+        state.settings.model = self.settings
+        dependency.current = None
+        filesystem.cache = filesystem.Cache()
+        self.directory.cleanup()
+
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        self.project = Project()
+        # the object and its dependency file are up to date
+        self.project.write('obj/a.d', 'obj/a.o: a.cpp\n', 2)
+        self.project.write('obj/a.o', 'object', 3)
+        self.server = self.project.server()
+        self.source = model.store.get('a.cpp', self.project.path('a.cpp'))
+        self.object = model.store.get('obj/a.o', self.project.path('obj/a.o'))
+
+    def tearDown(self):
+        if self.server.m_watcher:
+            self.server.m_watcher.close()
+        self.project.cleanup()
+
+    def test_changed_input_refreshes_its_target(self):
+        self.assertFalse(self.object.execute())
+
+        path = self.project.write('a.cpp', 'int a() { return 2; }', 4)
+        self.assertTrue(self.server.changed([path]))
+        self.assertEqual(self.source.timestamp(), 4 * 10**9)
+        self.assertFalse(self.server.m_reload)
+
+    def test_changed_output_is_not_an_input(self):
+        os.remove(self.project.path('obj/a.o'))
+        self.assertFalse(self.server.changed([self.project.path('obj/a.o')]))
+        self.assertTrue(self.object.execute())
+
+        # built again
+        self.project.write('obj/a.o', 'object', 5)
+        self.assertFalse(self.server.changed([self.project.path('obj/a.o')]))
+        self.assertFalse(self.object.execute())
+        self.assertEqual(self.object.timestamp(), 5 * 10**9)
+
+    def test_changed_dependency_file_updates_the_headers(self):
+        path = self.project.write('obj/a.d', 'obj/a.o: a.cpp a.h\n', 4)
+        self.assertFalse(self.server.changed([path]))
+        self.assertIn(self.project.path('a.h'), [item.filename() for item in self.object.dependency()])
+
+        # the header is an input of the model now
+        header = self.project.write('a.h', 'int a(); int b();', 5)
+        self.assertTrue(self.server.changed([header]))
+
+    def test_changed_makefile_reloads(self):
+        self.assertFalse(self.server.changed([self.project.path('makefile.cmk')]))
+
+        path = self.project.write('makefile.cmk', MAKEFILE + '\n', 4)
+        self.assertTrue(self.server.changed([path]))
+        self.assertTrue(self.server.m_reload)
+
+    def test_refresh_checks_the_directories(self):
+        self.assertFalse(self.server.refresh())
+        self.project.write('a.cpp', 'int a() { return 2; }', 4)
+        self.assertTrue(self.server.refresh())
+        self.assertFalse(self.server.refresh())
+
+
+def log(path, entry):
+    with open(path, 'a') as file:
+        file.write(entry + ' ' + repr(time.monotonic()) + '\n')
+
+
+class TestWatching(unittest.TestCase):
+
+    def setUp(self):
+        self.project = Project()
+        # the builds log outside the watched directories
+        self.output = tempfile.TemporaryDirectory()
+        self.log = os.path.join(self.output.name, 'builds')
+        self.handlers = {number: signal.getsignal(number) for number in [signal.SIGCHLD, signal.SIGTERM]}
+        self.delay = os.environ.get('CASUAL_MAKE_WATCH_DELAY')
+
+    def tearDown(self):
+        signal.set_wakeup_fd(-1)
+        for number, handler in self.handlers.items():
+            signal.signal(number, handler)
+        if self.delay is None:
+            os.environ.pop('CASUAL_MAKE_WATCH_DELAY', None)
+        else:
+            os.environ['CASUAL_MAKE_WATCH_DELAY'] = self.delay
+        self.output.cleanup()
+        self.project.cleanup()
+
+    def entries(self, kind):
+        try:
+            with open(self.log) as file:
+                lines = [line.split() for line in file]
+        except FileNotFoundError:
+            return []
+        return [float(seconds) for entry, seconds in lines if entry == kind]
+
+    def wait(self, kind, count):
+        deadline = time.monotonic() + 10
+        while len(self.entries(kind)) < count:
+            self.assertLess(time.monotonic(), deadline, 'no ' + kind + ' ' + str(count))
+            time.sleep(0.02)
+
+    def watch(self, make, changes):
+        """
+        Watches, with make as the build, until changes is done
+        """
+        server = self.project.server(make)
+
+        def run():
+            try:
+                changes()
+            finally:
+                # ctrl-c
+                os.kill(os.getpid(), signal.SIGINT)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        try:
+            with cd(self.project.directory.name):
+                server.watch([])
+        finally:
+            thread.join()
+            if server.m_watcher:
+                server.m_watcher.close()
+
+    def test_burst_of_changes_gives_one_build_after_the_delay(self):
+        os.environ['CASUAL_MAKE_WATCH_DELAY'] = '0.4'
+        written = []
+
+        def changes():
+            self.wait('build', 1)
+            for seconds in [10, 11, 12]:
+                written.append(time.monotonic())
+                self.project.write('a.cpp', 'int a() { return ' + str(seconds) + '; }', seconds)
+                time.sleep(0.1)
+            self.wait('build', 2)
+            # no more builds
+            time.sleep(0.6)
+
+        self.watch(lambda arguments: log(self.log, 'build'), changes)
+
+        builds = self.entries('build')
+        self.assertEqual(len(builds), 2)
+        self.assertGreaterEqual(builds[1], written[-1] + 0.4)
+
+    def test_change_cancels_the_running_build(self):
+        os.environ['CASUAL_MAKE_WATCH_DELAY'] = '0.05'
+
+        def make(arguments):
+            log(self.log, 'start')
+            time.sleep(10)
+            log(self.log, 'end')
+
+        def changes():
+            self.wait('start', 1)
+            self.project.write('a.cpp', 'int a() { return 2; }', 10)
+            self.wait('start', 2)
+
+        started = time.monotonic()
+        self.watch(make, changes)
+
+        self.assertEqual(len(self.entries('start')), 2)
+        self.assertEqual(self.entries('end'), [])
+        self.assertLess(time.monotonic() - started, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
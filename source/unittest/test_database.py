@@ -0,0 +1,78 @@
+import os
+import tempfile
+import unittest
+
+import casual.make.tools.database as database
+import casual.make.tools.filesystem as filesystem
+
+from casual.make.entity.target import Target
+
+
+class TestDatabase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = database.Database(os.path.join(self.directory.name, 'state.db'))
+        self.source = self.write('a.cpp', 'int main() {}')
+        self.output = self.write('a.o', 'object')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as file:
+            file.write(content)
+        filesystem.cache.invalidate(path)
+        return path
+
+    def target(self):
+        return Target('a.o', self.output).add_dependency(Target('a.cpp', self.source))
+
+    def test_touch_is_unchanged(self):
+        self.database.record(self.target())
+
+        os.utime(self.source, ns=(0, 0))
+        filesystem.cache.invalidate(self.source)
+        self.assertTrue(self.database.unchanged(self.target()))
+
+    def test_content_is_changed(self):
+        self.database.record(self.target())
+
+        self.write('a.cpp', 'int main() { return 1;}')
+        self.assertFalse(self.database.unchanged(self.target()))
+
+    def test_changed_while_built_is_changed(self):
+        self.database.dispatched(self.target())
+        self.write('a.cpp', 'int main() { return 1;}')
+        self.database.record(self.target())
+
+        self.assertFalse(self.database.unchanged(self.target()))
+
+    def test_not_recorded_is_changed(self):
+        self.assertFalse(self.database.recorded(self.target()))
+        self.assertFalse(self.database.unchanged(self.target()))
+
+    def test_digest_reused_while_stat_is_unchanged(self):
+        value = self.database.digest(self.source)
+        self.database.m_digests = {}
+        self.database.execute('UPDATE file SET digest = ?', ('stored',))
+        self.assertEqual(self.database.digest(self.source), 'stored')
+        self.assertNotEqual(value, 'stored')
+
+    def test_command_signature(self):
+        self.assertIsNone(self.database.command(self.target()))
+        self.database.record_command(self.target(), 'signature')
+        self.assertEqual(self.database.command(self.target()), 'signature')
+
+    def test_passed_test(self):
+        test = Target('test-a', self.output)
+        self.assertIsNone(self.database.test(test))
+        self.database.record_test(test, 'signature')
+        self.assertEqual(self.database.test(test), 'signature')
+        self.database.forget_test(test)
+        self.assertIsNone(self.database.test(test))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import tempfile
+import unittest
+
+import casual.make.tools.dependency as dependency
+import casual.make.tools.filesystem as filesystem
+
+
+class TestDependency(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.dependency_file = os.path.join(self.directory.name, 'a.d')
+        self.write('obj/a.o: a.cpp \\\n include/a.h /usr/include/b.h\n')
+        self.index = os.path.join(self.directory.name, 'dependency.index')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, content):
+        with open(self.dependency_file, 'w') as file:
+            file.write(content)
+        filesystem.cache.invalidate(self.dependency_file)
+
+    def test_parse(self):
+        self.assertEqual(dependency.parse(self.dependency_file, '/project'),
+                         ['/project/a.cpp', '/project/include/a.h', '/usr/include/b.h'])
+
+    def test_index_survives_save(self):
+        index = dependency.Index(self.index)
+        headers = index.headers(self.dependency_file, '/project')
+        index.save()
+
+        loaded = dependency.Index(self.index)
+        self.assertEqual(loaded.headers(self.dependency_file, '/project'), headers)
+        self.assertFalse(loaded.m_updated)
+
+    def test_changed_dependency_file_is_parsed(self):
+        index = dependency.Index(self.index)
+        index.headers(self.dependency_file, '/project')
+        index.save()
+
+        self.write('obj/a.o: a.cpp\n')
+        os.utime(self.dependency_file, ns=(1, 1))
+        filesystem.cache.invalidate(self.dependency_file)
+
+        loaded = dependency.Index(self.index)
+        self.assertEqual(loaded.headers(self.dependency_file, '/project'), ['/project/a.cpp'])
+
+    def test_unused_dependency_file_is_dropped(self):
+        renamed = os.path.join(self.directory.name, 'b.d')
+        index = dependency.Index(self.index)
+        index.headers(self.dependency_file, '/project')
+        index.save()
+
+        os.rename(self.dependency_file, renamed)
+        filesystem.cache.invalidate(self.dependency_file)
+        filesystem.cache.invalidate(renamed)
+
+        loaded = dependency.Index(self.index)
+        loaded.headers(renamed, '/project')
+        loaded.save()
+        self.assertIn(self.dependency_file, dependency.Index(self.index).m_entries)
+
+        loaded = dependency.Index(self.index)
+        loaded.headers(renamed, '/project')
+        loaded.save(full=True)
+        self.assertEqual(list(dependency.Index(self.index).m_entries), [renamed])
+
+    def test_used_dependency_file_is_kept(self):
+        index = dependency.Index(self.index)
+        index.headers(self.dependency_file, '/project')
+        index.save()
+
+        loaded = dependency.Index(self.index)
+        loaded.use([self.dependency_file])
+        loaded.save(full=True)
+        self.assertIn(self.dependency_file, dependency.Index(self.index).m_entries)
+
+        # looked up by a worker of the parallel model
+        worker = dependency.Index(self.index)
+        worker.headers(self.dependency_file, '/project')
+        handed = dependency.Index(self.index)
+        handed.merge(worker.changes())
+        handed.save(full=True)
+        self.assertIn(self.dependency_file, dependency.Index(self.index).m_entries)
+
+    def test_missing_dependency_file(self):
+        index = dependency.Index(self.index)
+        self.assertEqual(index.headers(os.path.join(self.directory.name, 'missing.d'), '/project'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
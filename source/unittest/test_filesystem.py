@@ -0,0 +1,67 @@
+import os
+import tempfile
+import unittest
+
+import casual.make.tools.filesystem as filesystem
+
+
+class TestFilesystem(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'file')
+        with open(self.path, 'w') as file:
+            file.write('content')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_stat_once(self):
+        cache = filesystem.Cache()
+        self.assertEqual(cache.timestamp(self.path), os.stat(self.path).st_mtime_ns)
+        stats = cache.stats()
+        self.assertTrue(cache.exists(self.path))
+        self.assertEqual(cache.stats(), stats)
+
+    def test_missing_file_from_listing(self):
+        cache = filesystem.Cache()
+        cache.exists(self.path)
+        stats = cache.stats()
+        self.assertFalse(cache.exists(os.path.join(self.directory.name, 'missing')))
+        self.assertEqual(cache.timestamp(os.path.join(self.directory.name, 'missing')), 0)
+        self.assertEqual(cache.stats(), stats)
+
+    def test_missing_directory(self):
+        cache = filesystem.Cache()
+        self.assertFalse(cache.exists(os.path.join(self.directory.name, 'obj', 'a.o')))
+        self.assertFalse(cache.is_directory(os.path.join(self.directory.name, 'obj')))
+        self.assertTrue(cache.is_directory(self.directory.name))
+
+    def test_invalidate(self):
+        cache = filesystem.Cache()
+        created = os.path.join(self.directory.name, 'created')
+        self.assertFalse(cache.exists(created))
+        with open(created, 'w') as file:
+            file.write('content')
+        self.assertFalse(cache.exists(created))
+        cache.invalidate(created)
+        self.assertTrue(cache.exists(created))
+
+    def test_prefetch(self):
+        os.environ['CASUAL_MAKE_STAT_THREADS'] = '2'
+        try:
+            cache = filesystem.Cache()
+            other = os.path.join(self.directory.name, 'other')
+            with open(other, 'w') as file:
+                file.write('content')
+            cache.prefetch([self.path, other])
+            stats = cache.stats()
+            self.assertTrue(cache.exists(self.path))
+            self.assertTrue(cache.exists(other))
+            self.assertEqual(cache.stats(), stats)
+        finally:
+            del os.environ['CASUAL_MAKE_STAT_THREADS']
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,202 @@
+import os
+import queue
+import tempfile
+import unittest
+
+import casual.make.entity.state as state
+import casual.make.entity.cli as cli
+
+# recipes needs a compiler handler
+state.environment(cli.handle_arguments([]))
+
+import casual.make.entity.model as model
+import casual.make.entity.recipe as recipe
+import casual.make.tools.database as database
+import casual.make.tools.filesystem as filesystem
+import casual.make.tools.handler as handler
+import casual.make.tools.history as history
+
+from casual.make.entity.target import Target, Recipe
+
+
+def action(name, dependencies=[]):
+    return Target(name).add_recipe(Recipe(print, {})).execute(True).add_dependency(dependencies)
+
+
+class TestHandler(unittest.TestCase):
+
+    def setUp(self):
+        # the state database is kept out of the source tree
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = dict(state.settings.model)
+        state.settings.model['cache_directory'] = self.directory.name
+        database.current = database.Database(os.path.join(self.directory.name, 'state.db'))
+
+    def tearDown(self):
+        database.current = None
+        state.settings.model = self.settings
+        self.directory.cleanup()
+
+    def test_action_graph_skips_targets_without_recipes(self):
+        first = action('first')
+        header = Target('header').add_dependency(first)
+        second = action('second', [header])
+        root = Target('root').add_dependency(second)
+
+        graph = model.construct_action_graph(root)
+        self.assertEqual(graph, {second: [first], first: []})
+
+    def test_schedule_releases_dependents(self):
+        first = action('first')
+        second = action('second')
+        third = action('third', [first, second])
+        schedule = handler.Schedule({third: [first, second], first: [], second: []})
+
+        self.assertEqual(schedule.pop(), first)
+        self.assertEqual(schedule.pop(), second)
+        self.assertFalse(schedule.ready)
+
+        schedule.done(first)
+        self.assertFalse(schedule.ready)
+        schedule.done(second)
+        self.assertEqual(schedule.pop(), third)
+
+    def test_worker_keeps_going_with_ignore_errors(self):
+        def denied(input):
+            raise PermissionError('denied')
+
+        references = handler.References()
+        tasks = queue.Queue()
+        replies = queue.Queue()
+        for target in [Target('first').add_recipe(Recipe(denied, {})), action('second')]:
+            tasks.put(handler.Task(target, references))
+        tasks.put(handler.terminate_process())
+
+        state.settings.model['ignore_errors'] = True
+        handler.worker(tasks, replies, 'worker 1')
+        self.assertEqual([replies.get_nowait()[1] for dummy in range(2)], [False, True])
+
+    def test_schedule_names_a_cycle(self):
+        first = action('first')
+        second = action('second')
+        third = action('third')
+        graph = {first: [], second: [first, third], third: [second]}
+
+        with self.assertRaisesRegex(SystemError, 'dependency cycle: (second -> third -> second|third -> second -> third)'):
+            handler.Schedule(graph)
+
+    def test_schedule_follows_the_critical_path(self):
+        short = action('short')
+        linked = action('linked', [short])
+        single = action('single')
+        head = action('head')
+        middle = action('middle', [head])
+        tail = action('tail', [middle])
+        graph = {short: [], linked: [short], single: [], head: [], middle: [head], tail: [middle]}
+
+        recorded = history.History('/nonexistent/history.json')
+        for target, duration in [(short, 1.0), (linked, 1.0), (single, 3.0), (head, 2.0), (middle, 5.0), (tail, 5.0)]:
+            recorded.record(target, duration, True)
+
+        # the longest remaining chain first: 12 seconds from head, 3 from single, 2 from short
+        schedule = handler.Schedule(graph, recorded)
+        self.assertEqual([schedule.pop() for dummy in range(3)], [head, single, short])
+
+        # an action that failed last time goes ahead
+        recorded.record(short, 1.0, False)
+        schedule = handler.Schedule(graph, recorded)
+        self.assertEqual([schedule.pop() for dummy in range(3)], [short, head, single])
+
+    def test_task_carries_references(self):
+        source = Target('a.cpp')
+        objectfile = Target('a.o').add_dependency(source).add_recipe(
+            Recipe(print, {'source': source, 'destination': [source]}))
+
+        references = handler.References()
+        task = handler.Task(objectfile, references)
+
+        self.assertEqual(task.id, objectfile.hash)
+        self.assertEqual(task.target.dependency(), [])
+        self.assertEqual(task.target.recipe(), [])
+        arguments = task.recipe()[0].arguments()
+        self.assertEqual(arguments['source'].name(), 'a.cpp')
+        self.assertIs(arguments['source'], arguments['destination'][0])
+        self.assertIs(arguments['source'], references.get(source))
+
+    def test_governor_admits_what_fits_in_memory(self):
+        first = action('first')
+        second = action('second')
+        unknown = action('unknown')
+        recorded = history.History('/nonexistent/history.json')
+        recorded.record(first, 1.0, True, 600)
+        recorded.record(second, 1.0, True, 200)
+
+        governor = handler.Governor(recorded, available=1000)
+        self.assertEqual(governor.expected(unknown), 400)
+
+        self.assertTrue(governor.admit(first))
+        governor.started(first)
+        self.assertTrue(governor.admit(second))
+        governor.started(second)
+        self.assertFalse(governor.admit(unknown))
+        governor.done(first)
+        self.assertTrue(governor.admit(unknown))
+
+    def test_governor_always_admits_when_idle(self):
+        governor = handler.Governor(max_load=0.0, available=0)
+        first = action('first')
+        self.assertTrue(governor.admit(first))
+        governor.started(first)
+        self.assertFalse(governor.admit(action('second')))
+
+    def test_pools_limit_the_actions(self):
+        pools = handler.Pools({'link': 2})
+        links = [action('link' + str(index)).pools('link') for index in range(3)]
+        test = action('test').pools(['test', 'db_port'])
+        install = action('install').serial(True)
+
+        pools.acquire(links[0])
+        pools.acquire(links[1])
+        self.assertEqual(pools.full(links[2]), 'link')
+        self.assertEqual(pools.full(test), None)
+        pools.acquire(test)
+        self.assertEqual(pools.full(action('other').pools('db_port')), 'db_port')
+        self.assertEqual(pools.full(install), None)
+
+        pools.release(links[0])
+        self.assertEqual(pools.full(links[2]), None)
+
+    def test_test_signature_follows_linked_libraries(self):
+        with tempfile.TemporaryDirectory() as directory:
+            def write(name, content):
+                path = os.path.join(directory, name)
+                with open(path, 'w') as file:
+                    file.write(content)
+                filesystem.cache.invalidate(path)
+                return path
+
+            common = Target('common', write('libcommon.so', 'library'))
+            common.add_recipe(Recipe(recipe.link_library, {
+                'destination': common, 'libraries': ['base'], 'library_paths': [directory]}))
+            write('libbase.so', 'base')
+            executable = Target('bin/test-a', write('test-a', 'executable'))
+            executable.add_recipe(Recipe(recipe.link_unittest, {
+                'destination': executable, 'libraries': [common, Target('gtest')], 'library_paths': [directory]}))
+            test = Target('test-a').add_recipe(
+                Recipe(recipe.test, {'destination': executable, 'library_paths': [directory]}))
+            signature = recipe.test_signature(test)
+            self.assertEqual(recipe.test_signature(test), signature)
+
+            write('libother.so', 'not linked')
+            self.assertEqual(recipe.test_signature(test), signature)
+
+            write('libcommon.so', 'changed library')
+            self.assertNotEqual(recipe.test_signature(test), signature)
+            signature = recipe.test_signature(test)
+
+            write('libbase.so', 'changed base')
+            self.assertNotEqual(recipe.test_signature(test), signature)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+import os
+import tempfile
+import unittest
+
+import casual.make.entity.state as state
+import casual.make.entity.cli as cli
+
+# recipes needs a compiler handler
+state.environment(cli.handle_arguments([]))
+
+import casual.make.entity.lazy as lazy
+import casual.make.entity.model as model
+import casual.make.tools.dependency as dependency
+import casual.make.tools.filesystem as filesystem
+
+from casual.make.tools.executor import cd
+
+MAKEFILES = {
+    'makefile.cmk': "from casual.make.api import *\n"
+                    "Build('a/makefile.cmk')\n"
+                    "Build('b/makefile.cmk')\n"
+                    "Build('c/makefile.cmk')\n",
+    'a/makefile.cmk': "from casual.make.api import *\n"
+                      "LinkLibrary('bin/a', [Compile('a.cpp')], [])\n",
+    'b/makefile.cmk': "from casual.make.api import *\n"
+                      "LinkLibrary('bin/b', [Compile('b.cpp')], [])\n",
+    'c/makefile.cmk': "from casual.make.api import *\n"
+                      "LinkLibrary('bin/c', [Compile('c.cpp')], ['a'])\n",
+}
+
+
+class TestIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.makefiles = {}
+        for name in ['top', 'a', 'b', 'c']:
+            path = os.path.join(self.directory.name, name + '.cmk')
+            with open(path, 'w') as file:
+                file.write(name)
+            self.makefiles[name] = path
+        filesystem.cache = filesystem.Cache()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def entry(self, name, builds=(), targets=(), requires=()):
+        return {'timestamp': filesystem.cache.timestamp(self.makefiles[name]),
+                'builds': [self.makefiles[build] for build in builds],
+                'targets': list(targets),
+                'requires': [self.makefiles[require] for require in requires]}
+
+    def index(self):
+        return lazy.Index(self.makefiles['top'], {
+            self.makefiles['top']: self.entry('top', builds=['a', 'b', 'c']),
+            self.makefiles['a']: self.entry('a', targets=['a']),
+            self.makefiles['b']: self.entry('b', targets=['b']),
+            self.makefiles['c']: self.entry('c', targets=['c'], requires=['a'])})
+
+    def test_needed(self):
+        index = self.index()
+        self.assertEqual(index.needed('c'), {self.makefiles[name] for name in ['top', 'a', 'c']})
+        self.assertEqual(index.needed('b'), {self.makefiles[name] for name in ['top', 'b']})
+
+        # all makefiles for a name that is not indexed
+        self.assertIsNone(index.needed('link'))
+        self.assertIsNone(lazy.Index(self.makefiles['top']).needed('c'))
+
+    def test_changed_makefiles_are_needed(self):
+        index = self.index()
+        index.makefiles[self.makefiles['b']]['timestamp'] -= 1
+        self.assertEqual(index.needed('a'), {self.makefiles[name] for name in ['top', 'a', 'b']})
+
+    def test_makefiles_not_indexed_are_wanted(self):
+        evaluation = lazy.Evaluation(self.index(), {self.makefiles['top']})
+        self.assertTrue(evaluation.wanted(self.makefiles['top']))
+        self.assertFalse(evaluation.wanted(self.makefiles['a']))
+        self.assertTrue(evaluation.wanted(os.path.join(self.directory.name, 'd.cmk')))
+
+    def test_update_requires_looked_up_names(self):
+        evaluation = lazy.Evaluation(self.index(), {self.makefiles[name] for name in ['top', 'c']})
+        evaluation.build(self.makefiles['top'], self.makefiles['c'])
+        evaluation.lookup(self.makefiles['c'], 'a')
+        evaluation.lookup(self.makefiles['c'], 'b')
+
+        missing = evaluation.update([], [self.makefiles['top'], self.makefiles['c']])
+        self.assertEqual(missing, {self.makefiles['a'], self.makefiles['b']})
+
+
+class TestLazy(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        for name, content in MAKEFILES.items():
+            self.write(name, content)
+        self.settings = dict(state.settings.model)
+        state.settings.model['cache_directory'] = os.path.join(self.directory.name, '.casual-make')
+        state.settings.model['lazy_model'] = True
+        dependency.current = None
+
+    def tearDown(self):
+        state.settings.model = self.settings
+        dependency.current = None
+        self.directory.cleanup()
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file:
+            file.write(content)
+        filesystem.cache.invalidate(path)
+
+    def build(self, goal=None):
+        filesystem.cache = filesystem.Cache()
+        with cd(self.directory.name):
+            model.build(goal)
+        self.assertIsNone(lazy.current)
+        return [os.path.relpath(makefile, self.directory.name) for makefile in model.evaluated]
+
+    def test_evaluates_the_makefiles_the_goal_needs(self):
+        everything = ['makefile.cmk', 'a/makefile.cmk', 'b/makefile.cmk', 'c/makefile.cmk']
+        self.assertEqual(self.build('c'), everything)
+
+        self.assertEqual(self.build('c'), ['makefile.cmk', 'a/makefile.cmk', 'c/makefile.cmk'])
+        self.assertIsNotNone(model.get('c'))
+        self.assertEqual(self.build('b'), ['makefile.cmk', 'b/makefile.cmk'])
+        self.assertEqual(self.build('link'), everything)
+
+    def test_evaluates_everything_when_a_changed_makefile_requires_more(self):
+        self.build()
+        self.write('c/makefile.cmk', "from casual.make.api import *\n"
+                                     "LinkLibrary('bin/c', [Compile('c.cpp')], ['a', 'b'])\n")
+        os.utime(os.path.join(self.directory.name, 'c/makefile.cmk'), ns=(0, 0))
+
+        everything = ['makefile.cmk', 'a/makefile.cmk', 'b/makefile.cmk', 'c/makefile.cmk']
+        self.assertEqual(self.build('c'), everything)
+        self.assertEqual(self.build('c'), everything)
+        self.assertEqual(self.build('a'), ['makefile.cmk', 'a/makefile.cmk'])
+
+    def test_evaluates_everything_with_another_configuration(self):
+        self.build()
+        os.environ['CASUAL_TEST_LAZY'] = 'other'
+        try:
+            everything = ['makefile.cmk', 'a/makefile.cmk', 'b/makefile.cmk', 'c/makefile.cmk']
+            self.assertEqual(self.build('b'), everything)
+            self.assertEqual(self.build('b'), ['makefile.cmk', 'b/makefile.cmk'])
+        finally:
+            del os.environ['CASUAL_TEST_LAZY']
+
+        state.settings.model['unity'] = True
+        self.assertEqual(self.build('b'), everything)
+
+
+if __name__ == '__main__':
+    unittest.main()
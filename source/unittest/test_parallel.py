@@ -0,0 +1,200 @@
+import glob
+import json
+import os
+import tempfile
+import unittest
+
+import casual.make.entity.state as state
+import casual.make.entity.cli as cli
+
+# recipes needs a compiler handler
+state.environment(cli.handle_arguments([]))
+
+import casual.make.entity.cache as cache
+import casual.make.entity.model as model
+import casual.make.entity.parallel as parallel
+import casual.make.tools.dependency as dependency
+import casual.make.tools.filesystem as filesystem
+import casual.make.tools.unity as unity
+
+from casual.make.tools.executor import cd
+
+MAKEFILES = {
+    'makefile.cmk': "from casual.make.api import *\n"
+                    "Environment('CASUAL_TEST_SUFFIX', '-top')\n"
+                    "Build('a/makefile.cmk')\n"
+                    "Build('b/makefile.cmk')\n"
+                    "Build('d/makefile.cmk')\n",
+    'a/makefile.cmk': "from casual.make.api import *\n"
+                      "import os\n"
+                      "LinkLibrary('bin/a' + os.environ['CASUAL_TEST_SUFFIX'], [Compile('a.cpp')], [])\n"
+                      "Build('../c/makefile.cmk')\n"
+                      "Environment('CASUAL_TEST_SIBLING', '-a')\n",
+    'c/makefile.cmk': "from casual.make.api import *\n"
+                      "LinkLibrary('bin/c', [Compile('c.cpp')], ['a-top'])\n",
+    'b/makefile.cmk': "from casual.make.api import *\n"
+                      "from casual.make.entity.target import Recipe\n"
+                      "LinkExecutable('bin/b', [Compile('b.cpp')], ['a-top', 'c']).add_recipe(Recipe(lambda input: None, {}))\n",
+    # the environment of the earlier sibling a
+    'd/makefile.cmk': "from casual.make.api import *\n"
+                      "import os\n"
+                      "LinkLibrary('bin/d' + os.environ.get('CASUAL_TEST_SIBLING', '-none'), [Compile('d.cpp')], [])\n",
+}
+
+
+def describe():
+    """
+    The model as comparable values
+    """
+    reply = set()
+    for name, targets in model.store.target_cache().items():
+        for filename, target in targets.items():
+            reply.add((name, filename, target.makefile(), target.execute(), target.serial(), tuple(target.pools()),
+                       tuple(sorted((dependency.name(), str(dependency.filename())) for dependency in target.dependency())),
+                       tuple(recipe.function.__name__ for recipe in target.recipe())))
+    return reply
+
+
+class TestParallel(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        for name, content in MAKEFILES.items():
+            path = os.path.join(self.directory.name, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as file:
+                file.write(content)
+        self.settings = dict(state.settings.model)
+        state.settings.model['cache_directory'] = os.path.join(self.directory.name, '.casual-make')
+        dependency.current = None
+
+    def tearDown(self):
+        state.settings.model = self.settings
+        dependency.current = None
+        os.environ.pop('CASUAL_TEST_SUFFIX', None)
+        os.environ.pop('CASUAL_TEST_SIBLING', None)
+        self.directory.cleanup()
+
+    def build(self):
+        # build() starts from a new model, with the global operations of the api
+        os.environ.pop('CASUAL_TEST_SUFFIX', None)
+        os.environ.pop('CASUAL_TEST_SIBLING', None)
+        with cd(self.directory.name):
+            model.build()
+        return describe(), list(model.evaluated)
+
+    def test_builds_inherit_the_environment(self):
+        journal = cache.Journal('/project/makefile.cmk')
+        journal.build('/project/a/makefile.cmk')
+        journal.environment('CASUAL_TEST_SUFFIX', '-top')
+        journal.build('/project/b/makefile.cmk')
+
+        self.assertEqual(parallel.builds(journal, {'PATH': '/bin'}), [
+            ('/project/a/makefile.cmk', {'PATH': '/bin'}),
+            ('/project/b/makefile.cmk', {'PATH': '/bin', 'CASUAL_TEST_SUFFIX': '-top'})])
+
+    def test_same_model_as_serial_evaluation(self):
+        serial = self.build()
+
+        state.settings.model['parallel_model'] = True
+        state.settings.model['jobs'] = 3
+        self.assertEqual(parallel.workers(), 3)
+        self.assertEqual(self.build(), serial)
+        self.assertIsNone(parallel.current)
+
+        # the fragments of the model cache are evaluated in parallel too
+        state.settings.model['model_cache'] = True
+        self.assertEqual(self.build(), serial)
+        self.assertEqual(self.build(), serial)
+
+    def test_environment_of_an_earlier_makefile(self):
+        serial = self.build()
+        self.assertIsNotNone(model.get('d-a'))
+
+        # d is submitted with the environment of the top makefile, before a has changed it
+        state.settings.model['parallel_model'] = True
+        state.settings.model['jobs'] = 3
+        self.assertEqual(self.build(), serial)
+        self.assertIsNone(model.get('d-none'))
+
+    def test_fragments_are_shared_with_serial_evaluation(self):
+        state.settings.model['model_cache'] = True
+        serial = self.build()
+        makefile = os.path.join(self.directory.name, 'makefile.cmk')
+        fragment = cache.location(makefile)
+        with open(fragment, 'rb') as file:
+            recorded = file.read()
+
+        # the parallel evaluation replays the fragment of the serial one
+        state.settings.model['parallel_model'] = True
+        state.settings.model['jobs'] = 3
+        os.environ.pop('CASUAL_TEST_SUFFIX', None)
+        os.environ.pop('CASUAL_TEST_SIBLING', None)
+        with open(makefile, 'rb') as file:
+            key = cache.identity(makefile, file.read())
+        self.assertIsNotNone(cache.load(makefile, key))
+        self.assertEqual(self.build(), serial)
+        with open(fragment, 'rb') as file:
+            self.assertEqual(file.read(), recorded)
+
+
+class TestUnity(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.write('makefile.cmk', "from casual.make.api import *\n" +
+                   ''.join("Build('" + name + "/makefile.cmk')\n" for name in ['a', 'b', 'c']))
+        for name in ['a', 'b', 'c']:
+            self.write(name + '/makefile.cmk', "from casual.make.api import *\n"
+                       "LinkLibrary('bin/" + name + "', CompileMany(['one.cpp', 'two.cpp']), [])\n")
+            self.write(name + '/one.cpp', 'int one() { return 1; }\n')
+            self.write(name + '/two.cpp', 'int two() { return 2; }\n')
+        self.settings = dict(state.settings.model)
+        state.settings.model['cache_directory'] = os.path.join(self.directory.name, '.casual-make')
+        state.settings.model['unity'] = True
+        dependency.current = None
+        unity.current = None
+
+    def tearDown(self):
+        state.settings.model = self.settings
+        dependency.current = None
+        unity.current = None
+        self.directory.cleanup()
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file:
+            file.write(content)
+        os.utime(path, ns=(10**9, 10**9))
+
+    def build(self):
+        filesystem.cache = filesystem.Cache()
+        with cd(self.directory.name):
+            model.build()
+
+    def test_isolated_sources_of_the_workers_are_merged(self):
+        self.build()
+        batches = sorted(glob.glob(os.path.join(self.directory.name, '*', 'obj', 'unity', '*.cpp')))
+        self.assertEqual(len(batches), 3)
+
+        # the batches are built, then a source of each is edited
+        for batch in batches:
+            objectfile = os.path.splitext(batch)[0] + '.o'
+            with open(objectfile, 'w') as file:
+                file.write('object')
+            os.utime(objectfile, ns=(2 * 10**9, 2 * 10**9))
+            source = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(batch))), 'one.cpp')
+            os.utime(source, ns=(3 * 10**9, 3 * 10**9))
+
+        state.settings.model['parallel_model'] = True
+        state.settings.model['jobs'] = 3
+        self.build()
+
+        with open(os.path.join(self.directory.name, '.casual-make', 'unity.json')) as file:
+            isolated = json.load(file)
+        self.assertEqual(sorted(isolated), [os.path.splitext(batch)[0] + '.o' for batch in batches])
+
+
+if __name__ == '__main__':
+    unittest.main()
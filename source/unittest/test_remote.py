@@ -0,0 +1,50 @@
+import tempfile
+import threading
+import unittest
+
+import casual.make.tools.cacheserver as cacheserver
+import casual.make.tools.remote as remote
+
+KEY = '0123456789abcdef0123'
+
+
+class TestRemote(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.server = cacheserver.server(self.directory.name)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = remote.Client('http://localhost:' + str(self.server.server_port), 5)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.directory.cleanup()
+
+    def test_put_and_get(self):
+        files = {'dependency': (0o644, b'a.o: a.cpp'), 'object': (0o644, b'\0object')}
+        self.client.put(KEY, files)
+        self.client.flush()
+        self.assertEqual(self.client.get(KEY), files)
+
+    def test_unknown_key(self):
+        self.assertIsNone(self.client.get(KEY))
+        self.assertTrue(self.client.available())
+
+    def test_unavailable_server(self):
+        port = self.server.server_port
+        self.server.shutdown()
+        self.server.server_close()
+
+        client = remote.Client('http://localhost:' + str(port), 5)
+        for dummy in range(remote.FAILURES):
+            self.assertIsNone(client.get(KEY))
+        self.assertFalse(client.available())
+
+    def test_pack(self):
+        files = {'output': (0o755, b'executable')}
+        self.assertEqual(remote.unpack(remote.pack(files)), files)
+
+
+if __name__ == '__main__':
+    unittest.main()
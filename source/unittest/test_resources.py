@@ -0,0 +1,53 @@
+import os
+import tempfile
+import unittest
+
+import casual.make.tools.resources as resources
+
+
+def write(directory, name, content):
+    with open(os.path.join(directory, name), 'w') as file:
+        file.write(content)
+
+
+class TestResources(unittest.TestCase):
+
+    def setUp(self):
+        self.m_directory = tempfile.TemporaryDirectory()
+        self.directory = self.m_directory.name
+
+    def tearDown(self):
+        self.m_directory.cleanup()
+
+    def test_quota(self):
+        missing = os.path.join(self.directory, 'missing')
+        self.assertEqual(resources.quota([self.directory], v1=missing), None)
+
+        write(self.directory, 'cpu.max', 'max 100000\n')
+        self.assertEqual(resources.quota([self.directory], v1=missing), None)
+
+        write(self.directory, 'cpu.max', '250000 100000\n')
+        self.assertEqual(resources.quota([self.directory], v1=missing), 2.5)
+
+        write(self.directory, 'cpu.cfs_quota_us', '100000\n')
+        write(self.directory, 'cpu.cfs_period_us', '100000\n')
+        self.assertEqual(resources.quota([], v1=self.directory), 1.0)
+
+    def test_memory(self):
+        missing = os.path.join(self.directory, 'missing')
+        write(self.directory, 'meminfo', 'MemTotal: 8000 kB\nMemAvailable: 4000 kB\n')
+        meminfo = os.path.join(self.directory, 'meminfo')
+        self.assertEqual(resources.memory([], meminfo, missing), 4000 * 1024)
+
+        write(self.directory, 'memory.max', str(3000 * 1024))
+        write(self.directory, 'memory.current', str(1000 * 1024))
+        self.assertEqual(resources.memory([self.directory], meminfo, missing), 2000 * 1024)
+
+        self.assertEqual(resources.memory([], missing, missing), None)
+
+    def test_cpus(self):
+        self.assertGreaterEqual(resources.cpus(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import unittest
+
+import casual.make.entity.state as state
+import casual.make.entity.cli as cli
+
+# recipes needs a compiler handler
+state.environment(cli.handle_arguments([]))
+
+import casual.make.entity.recipe as recipe
+import casual.make.tools.history as history
+import casual.make.tools.shard as shard
+
+from casual.make.entity.target import Target, Recipe
+
+
+def unittest_target(name):
+    return Target(name, makefile='/project/makefile.cmk').add_recipe(
+        Recipe(recipe.test, {'destination': Target('bin/' + name), 'library_paths': []})).pools('test')
+
+
+class TestShard(unittest.TestCase):
+
+    def setUp(self):
+        os.environ.pop('CASUAL_MAKE_TEST_SHARD_DURATION', None)
+        self.history = history.History('/nonexistent/history.json')
+
+    def test_split_slow_tests(self):
+        slow = unittest_target('test-slow')
+        fast = unittest_target('test-fast')
+        link = Target('link').add_recipe(Recipe(print, {}))
+        self.history.record(slow, 35.0, True)
+        self.history.record(fast, 5.0, True)
+
+        shards = shard.Shards(self.history, 8)
+        graph = shards.split({slow: [link], fast: [link], link: []})
+
+        split = [action for action in graph if action.name().startswith('test-slow')]
+        self.assertEqual([action.recipe()[0].arguments()['shard'] for action in split], [(0, 3), (1, 3), (2, 3)])
+        self.assertEqual([graph[action] for action in split], [[link]] * 3)
+        self.assertEqual(split[0].pools(), ['test'])
+        self.assertIn(fast, graph)
+        self.assertNotIn(slow, graph)
+
+        for action in split:
+            self.assertTrue(shards.sharded(action))
+            shards.done(action, 10.0, True)
+        self.assertFalse(shards.sharded(fast))
+        self.assertEqual(self.history.duration(slow), 30.0)
+
+    def test_limited_by_workers(self):
+        slow = unittest_target('test-slow')
+        self.history.record(slow, 100.0, True)
+        self.assertEqual(shard.Shards(self.history, 2).count(slow), 2)
+        self.assertEqual(shard.Shards(self.history, 2).count(unittest_target('test-unknown')), 1)
+
+    def test_failed_shard_fails_test(self):
+        slow = unittest_target('test-slow')
+        self.history.record(slow, 20.0, True)
+        shards = shard.Shards(self.history, 4)
+        first, second = shards.split({slow: []})
+
+        shards.done(first, 1.0, False)
+        self.assertTrue(self.history.failed(slow))
+        shards.done(second, 1.0, True)
+        self.assertTrue(self.history.failed(slow))
+
+
+if __name__ == '__main__':
+    unittest.main()
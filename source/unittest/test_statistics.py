@@ -0,0 +1,44 @@
+import unittest
+
+import casual.make.entity.state as state
+import casual.make.entity.cli as cli
+
+# recipes needs a compiler handler
+state.environment(cli.handle_arguments([]))
+
+import casual.make.entity.model as model
+import casual.make.entity.recipe as recipe
+import casual.make.tools.statistics as statistics
+import casual.make.tools.trace as trace
+
+from casual.make.entity.target import Recipe
+
+
+class TestStatistics(unittest.TestCase):
+
+    def setUp(self):
+        model.store = model.Store()
+
+    def test_collect(self):
+        source = model.register('a.cpp', 'a.cpp', '/project/makefile.cmk')
+        objects = [model.register(name, name, '/project/makefile.cmk').add_dependency(source).add_recipe(
+            Recipe(recipe.compile, {})) for name in ['a.o', 'b.o']]
+
+        instance = trace.Trace()
+        instance.m_phases.append({'name': 'execute', 'start': 0.0, 'duration': 2.0, 'cpu': 3.0})
+        instance.slots(2)
+        instance.action(objects[0], 'worker 1', 0.0, 2.0, True)
+        instance.action(objects[1], 'worker 2', 0.0, 1.0, False)
+
+        result = statistics.collect(instance, model.store, 7)
+
+        self.assertEqual((result['targets'], result['edges'], result['stats']), (3, 2, 7))
+        self.assertEqual((result['actions'], result['failed']), (2, 1))
+        self.assertEqual(result['kinds']['compile'], {'count': 2, 'total': 3.0, 'mean': 1.5})
+        self.assertEqual(result['slowest'][0]['name'], 'a.o')
+        self.assertEqual(result['efficiency'], 0.75)
+        self.assertIn('  parallel efficiency: 75% of 2 slots', statistics.text(result))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+import casual.make.entity.state as state
+import casual.make.entity.cli as cli
+
+# recipes needs a compiler handler
+state.environment(cli.handle_arguments([]))
+
+import casual.make.entity.recipe as recipe
+import casual.make.tools.trace as trace
+
+from casual.make.entity.target import Target, Recipe
+
+
+class TestTrace(unittest.TestCase):
+
+    def test_events(self):
+        instance = trace.Trace()
+        with instance.phase('model'):
+            pass
+        target = Target('a.o', '/project/a.o').add_recipe(Recipe(recipe.compile, {}))
+        instance.action(target, 'worker 2', instance.phases()[0]['start'] + 1.0, 0.5, False)
+
+        events = instance.events()
+        phase = [event for event in events if event.get('cat') == 'phase'][0]
+        self.assertEqual((phase['name'], phase['tid'], phase['ts']), ('model', 0, 0))
+
+        action = [event for event in events if event.get('cat') == 'compile'][0]
+        self.assertEqual((action['ts'], action['dur']), (1000000, 500000))
+        self.assertEqual(action['args']['status'], 'failed')
+
+        names = {event['tid']: event['args']['name'] for event in events if event['name'] == 'thread_name'}
+        self.assertEqual(names[action['tid']], 'worker 2')
+
+    def test_kind(self):
+        target = Target('a.o', '/project/a.o').add_recipe(
+            [Recipe(recipe.execute_dependency_generation, {}), Recipe(recipe.compile, {})])
+        self.assertEqual(recipe.kind(target), 'compile')
+        self.assertEqual(recipe.kind(Target('link')), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
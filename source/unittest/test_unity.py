@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+
+import casual.make.entity.state as state
+import casual.make.entity.cli as cli
+
+state.environment(cli.handle_arguments([]))
+
+import casual.make.tools.unity as unity
+
+
+class TestUnity(unittest.TestCase):
+
+    def test_pack_by_duration(self):
+        durations = [('a', 10.0), ('b', 15.0), ('c', 10.0), ('d', 40.0), ('e', 1.0)]
+        self.assertEqual(unity.pack(durations, 30.0), [['a', 'b'], ['c'], ['d'], ['e']])
+        self.assertEqual(unity.pack([], 30.0), [])
+
+    def test_split_at_the_boundaries(self):
+        self.assertEqual(unity.split(['a', 'b', 'c', 'd', 'e'], ['a', 'c', 'd']), [['a', 'b'], ['c'], ['d', 'e']])
+        # a new source before the first boundary is in the first batch, a removed boundary keeps its batch
+        self.assertEqual(unity.split(['0', 'b', 'd'], ['a', 'c', 'd']), [['0', 'b'], [], ['d']])
+
+    def test_boundaries_are_kept_until_the_limit_changes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'layout.json')
+            durations = [('a', 10.0), ('b', 15.0), ('c', 10.0), ('d', 40.0)]
+            self.assertEqual(unity.boundaries(path, durations, 30.0), ['a', 'c', 'd'])
+
+            # new durations don't move the boundaries
+            durations = [('a', 1.0), ('b', 1.0), ('c', 1.0), ('d', 1.0)]
+            self.assertEqual(unity.boundaries(path, durations, 30.0), ['a', 'c', 'd'])
+            self.assertEqual(unity.boundaries(path, durations, 60.0), ['a'])
+
+    def test_content_includes_relative_to_the_batch(self):
+        self.assertEqual(unity.content('/project/obj/unity', ['/project/source/a.cpp', '/project/source/b.cpp']),
+                         '#include "../../source/a.cpp"\n#include "../../source/b.cpp"\n')
+
+    def test_write_only_changed_content(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'obj', 'unity', 'batch.cpp')
+            unity.write(path, 'first\n')
+            os.utime(path, ns=(0, 0))
+            unity.write(path, 'first\n')
+            self.assertEqual(os.stat(path).st_mtime_ns, 0)
+            unity.write(path, 'second\n')
+            with open(path) as file:
+                self.assertEqual(file.read(), 'second\n')
+
+    def test_isolation_is_kept_until_reset(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'unity.json')
+            isolation = unity.Isolation(path)
+            isolation.isolate('/project/obj/unity/common.1.o', '/project/source/a.cpp')
+            isolation.isolate('/project/obj/unity/common.1.o', '/project/source/a.cpp')
+            isolation.save()
+
+            isolation = unity.Isolation(path)
+            self.assertEqual(isolation.isolated('/project/obj/unity/common.1.o'), ['/project/source/a.cpp'])
+            isolation.reset('/project/obj/unity/common.1.o')
+            self.assertEqual(isolation.isolated('/project/obj/unity/common.1.o'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
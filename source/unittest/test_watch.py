@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+
+import casual.make.tools.filesystem as filesystem
+import casual.make.tools.watch as watch
+
+from casual.make.entity.target import Target
+
+
+class TestWatch(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.watcher = watch.create()
+        if not self.watcher:
+            self.skipTest('inotify is not available')
+
+    def tearDown(self):
+        self.watcher.close()
+        self.directory.cleanup()
+
+    def test_written_file_is_reported(self):
+        self.assertTrue(self.watcher.watch(self.directory.name))
+        path = os.path.join(self.directory.name, 'a.cpp')
+        with open(path, 'w') as file:
+            file.write('int main() {}')
+
+        self.assertEqual(self.watcher.changes(), {path})
+        self.assertEqual(self.watcher.changes(), set())
+
+    def test_missing_directory_is_not_watched(self):
+        self.assertFalse(self.watcher.watch(os.path.join(self.directory.name, 'obj')))
+
+    def test_removed_directory_is_forgotten(self):
+        directory = os.path.join(self.directory.name, 'obj')
+        os.mkdir(directory)
+        self.assertTrue(self.watcher.watch(directory))
+        os.rmdir(directory)
+
+        self.assertIn(directory, self.watcher.changes())
+        self.assertFalse(self.watcher.watched(directory))
+
+
+class TestRefresh(unittest.TestCase):
+
+    def test_refreshed_after_build(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'a.o')
+            target = Target('a.o', path)
+            requested = Target('test', path).execute(True)
+            self.assertTrue(target.execute())
+
+            with open(path, 'w') as file:
+                file.write('object')
+            filesystem.cache.invalidate(path)
+            target.refresh()
+            requested.refresh()
+
+            self.assertTrue(target.timestamp())
+            self.assertFalse(target.execute())
+            self.assertTrue(requested.execute())
+
+
+if __name__ == '__main__':
+    unittest.main()